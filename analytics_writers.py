@@ -0,0 +1,98 @@
+"""GeoJSON and CSV exports of a parsed track for analysis tools.
+
+Both are produced in chunks, one per run, like iter_gpx. Numbers are
+written the way the API sent them (see format_column) and times as in the
+GPX output.
+"""
+import csv
+import io
+import json
+import math
+
+from instrumentation import timed_iter
+from kinematics import run_kinematics, track_top_speed
+from track_model import format_column, format_timestamps, get_track_name, load_track
+
+CSV_COLUMNS = ('run', 'time', 'lat', 'lon', 'ele', 'speed_kmh', 'status')
+# Added with gps_extensions: the blended speed and heading written to <gte:gps>
+GPS_COLUMNS = ('gps_speed_ms', 'azimuth')
+
+def _gps_columns(run, top_speed):
+    speeds, azimuths = run_kinematics(run, top_speed)
+    return ([f"{speed:.2f}" if speed == speed else None for speed in speeds],
+            [f"{azimuth:.1f}" if azimuth == azimuth else None for azimuth in azimuths])
+
+def _run_columns(run, timezone_offset):
+    return (
+        format_column(run.lat, run.lat_integral),
+        format_column(run.lon, run.lon_integral),
+        format_column(run.ele, run.ele_integral),
+        format_timestamps(run.time, timezone_offset),
+        format_column(run.speed, False),
+    )
+
+def iter_geojson(track_data, timezone_offset=0, gps_extensions=False):
+    """Yield a GeoJSON FeatureCollection with one LineString feature per run.
+
+    Positions are [lon, lat] or [lon, lat, ele]; points without a position
+    are left out. Each feature's properties carry the track name, the run
+    number and per-point coordTimes and speeds (km/h), plus gps_speeds (m/s)
+    and azimuths with gps_extensions; missing values are null.
+    """
+    return timed_iter('serialize', _iter_geojson(track_data, timezone_offset, gps_extensions), writer='geojson')
+
+def _iter_geojson(track_data, timezone_offset, gps_extensions):
+    track = load_track(track_data)
+    name = json.dumps(get_track_name(track), ensure_ascii=False)
+    top_speed = track_top_speed(track)
+    yield b'{"type":"FeatureCollection","features":['
+
+    for run_idx, run in enumerate(track.runs):
+        lats, lons, eles, times, speeds = _run_columns(run, timezone_offset)
+        kept = [i for i, (lat, lon) in enumerate(zip(run.lat, run.lon)) if math.isfinite(lat) and math.isfinite(lon)]
+        coordinates = ','.join(f'[{lons[i]},{lats[i]},{eles[i]}]' if eles[i] is not None else f'[{lons[i]},{lats[i]}]'
+                               for i in kept)
+        properties = [
+            f'"name":{name}',
+            f'"run":{run_idx + 1}',
+            f'"coordTimes":{json.dumps([times[i] for i in kept])}',
+            f'"speeds":[{",".join(speeds[i] or "null" for i in kept)}]',
+        ]
+        if gps_extensions:
+            gps_speeds, azimuths = _gps_columns(run, top_speed)
+            properties.append(f'"gps_speeds":[{",".join(gps_speeds[i] or "null" for i in kept)}]')
+            properties.append(f'"azimuths":[{",".join(azimuths[i] or "null" for i in kept)}]')
+        feature = (f'{{"type":"Feature","geometry":{{"type":"LineString","coordinates":[{coordinates}]}},'
+                   f'"properties":{{{",".join(properties)}}}}}')
+        yield (feature if run_idx == 0 else ',' + feature).encode('utf-8')
+
+    yield b']}'
+
+def iter_csv(track_data, timezone_offset=0, gps_extensions=False):
+    """Yield the track as CSV with a header row and one row per point (see CSV_COLUMNS).
+
+    Runs are numbered from 1; missing values are empty. gps_extensions adds
+    GPS_COLUMNS.
+    """
+    return timed_iter('serialize', _iter_csv(track_data, timezone_offset, gps_extensions), writer='csv')
+
+def _iter_csv(track_data, timezone_offset, gps_extensions):
+    track = load_track(track_data)
+    top_speed = track_top_speed(track)
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS + GPS_COLUMNS if gps_extensions else CSV_COLUMNS)
+
+    for run_idx, run in enumerate(track.runs):
+        lats, lons, eles, times, speeds = _run_columns(run, timezone_offset)
+        statuses = [None if status < 0 else status for status in run.status]
+        columns = [[run_idx + 1] * len(run), times, lats, lons, eles, speeds, statuses]
+        if gps_extensions:
+            columns.extend(_gps_columns(run, top_speed))
+        writer.writerows(zip(*columns))
+        yield output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
+
+    if output.tell():
+        yield output.getvalue().encode('utf-8')
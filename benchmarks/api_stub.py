@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""A local stand-in for the Huabei API's /tracks/ and /skis/ endpoints.
+
+UUIDs starting with 'ski' only exist under /skis/ and get a 404 from
+/tracks/, so they exercise the endpoint fallback; UUIDs starting with
+'missing' get a 404 from both. UUIDs starting with 'flaky' get a 503 the
+first time each endpoint is asked for them and 'broken' ones always do, to
+exercise retries. Everything else is served from /tracks/. Every track is
+the same payload, the sample response or a synthetic track.
+
+Run from the repository root, then point the converter at it:
+    python -m benchmarks.api_stub --port 8765 --latency 0.2 --points 100k
+    HUABEI_API_BASE=http://127.0.0.1:8765/api python converter_gpx.py ...
+"""
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic import SAMPLE_FILE, SIZES, generate_track, parse_size
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        parts = self.path.strip('/').split('/')
+        with server.lock:
+            server.requests += 1
+            server.paths.append(self.path)
+            attempts = server.attempts[self.path] = server.attempts[self.path] + 1
+        if len(parts) != 3 or parts[0] != 'api' or parts[1] not in ('tracks', 'skis'):
+            self._send(404)
+            return
+        _, endpoint, track_uuid = parts
+        if server.latency:
+            time.sleep(server.latency)
+        if track_uuid.startswith('broken') or (track_uuid.startswith('flaky') and attempts == 1):
+            self._send(503)
+            return
+        if track_uuid.startswith('missing') or (endpoint == 'skis') != track_uuid.startswith('ski'):
+            self._send(404)
+            return
+        self._send(200, server.payload(track_uuid) if callable(server.payload) else server.payload)
+
+    def _send(self, status, body=b''):
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class StubServer(ThreadingHTTPServer):
+    """Serve payload (bytes) for every known UUID after latency seconds.
+
+    payload may also be a function returning the body for a UUID. Use as a
+    context manager to serve from a background thread; api_base is the value
+    for HUABEI_API_BASE. paths lists the paths requested, in order.
+    """
+    daemon_threads = True
+
+    def __init__(self, payload, latency=0.0, host='127.0.0.1', port=0):
+        super().__init__((host, port), StubHandler)
+        self.payload = payload
+        self.latency = latency
+        self.requests = 0
+        self.paths = []
+        self.attempts = Counter()
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def api_base(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='api-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+def load_payload(points=None):
+    """Return the response body: the sample file, or a synthetic track of points points."""
+    if points is None:
+        with open(SAMPLE_FILE, 'rb') as f:
+            return f.read()
+    return json.dumps(generate_track(points), ensure_ascii=False).encode('utf-8')
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Huabei track API')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before every response')
+    parser.add_argument('--points', help=f'Serve a synthetic track of this many points or one of {", ".join(SIZES)} '
+                                         '(default: the sample response)')
+    args = parser.parse_args()
+
+    payload = load_payload(parse_size(args.points) if args.points else None)
+    server = StubServer(payload, args.latency, args.host, args.port)
+    print(f"Serving {len(payload) / 1e6:.1f} MB tracks at {server.api_base} with {args.latency:g}s latency")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
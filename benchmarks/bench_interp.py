@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Compare the single-pass interp with the binary search per query it replaced.
+
+Point times are interpolated against thinned altitude_arr/speed_arr sample
+times, as track_align does for a run whose arrays differ in length. Sorted
+queries are the usual case; shuffled ones exercise the fallback.
+
+Run from the repository root:
+    python -m benchmarks.bench_interp --points 1000000 --step 3
+"""
+import argparse
+import random
+import time
+from array import array
+from bisect import bisect_right
+
+from track_align import NAN, interp
+
+def bisect_interp(x, xp, fp):
+    """The previous interp: one binary search per query, O(n log m)."""
+    if not xp:
+        return array('d', [NAN] * len(x))
+    last = len(xp) - 1
+    result = array('d')
+    for value in x:
+        if value != value:
+            result.append(NAN)
+            continue
+        i = bisect_right(xp, value)
+        if i == 0:
+            result.append(fp[0])
+        elif i > last:
+            result.append(fp[last])
+        else:
+            x0 = xp[i - 1]
+            x1 = xp[i]
+            if x1 == x0:
+                result.append(fp[i])
+            else:
+                result.append(fp[i - 1] + (fp[i] - fp[i - 1]) * (value - x0) / (x1 - x0))
+    return result
+
+def columns(points, step):
+    """Point times one to three seconds apart, and every step-th of them as samples of a value."""
+    rng = random.Random(1)
+    times = array('d')
+    t = 1707100000.0
+    for _ in range(points):
+        t += rng.choice((1, 1, 1, 2, 3))
+        times.append(t)
+    sample_times = times[::step]
+    values = array('d', (1500 + (i % 400) * 0.5 for i in range(len(sample_times))))
+    return times, sample_times, values
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark single-pass vs binary-search interpolation')
+    parser.add_argument('--points', type=int, default=1000000, help='Number of point times to interpolate at')
+    parser.add_argument('--step', type=int, default=3, help='Keep every step-th point time as a sample')
+    args = parser.parse_args()
+
+    times, sample_times, values = columns(args.points, args.step)
+    shuffled = array('d', times)
+    random.Random(2).shuffle(shuffled)
+
+    print(f"Points:  {args.points}, samples: {len(sample_times)}")
+    for label, queries in (('sorted', times), ('shuffled', shuffled)):
+        expected, bisect_seconds = measure(bisect_interp, queries, sample_times, values)
+        result, merge_seconds = measure(interp, queries, sample_times, values)
+        if result != expected:
+            raise SystemExit(f"interp does not match the binary-search version on {label} queries")
+        print(f"{label:9s} bisect {bisect_seconds:.2f}s, single pass {merge_seconds:.2f}s, "
+              f"speedup {bisect_seconds / merge_seconds:.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
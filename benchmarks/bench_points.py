@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Compare the per-point and batch time/coordinate formatting paths.
+
+Run from the repository root:
+    python -m benchmarks.bench_points --points 1000000
+"""
+import argparse
+import datetime
+import os
+import time
+
+from converter_gpx import load_json_file, parse_timestamp, parse_timestamps, format_timestamps
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'apireturn_example.json')
+
+def scaled_columns(points):
+    """Repeat the sample's coordinates and altitude_arr entries up to the requested number of points."""
+    data = load_json_file(SAMPLE_FILE)['data']
+    coords = [coord for run in data['track_detail'] for coord in run]
+    altitudes = [alt_point for run in data['altitude_arr'] for alt_point in run]
+    repeats = points // len(coords) + 1
+    return (coords * repeats)[:points], (altitudes * repeats)[:points]
+
+def per_point(coords, altitudes, timezone_offset):
+    """The original per-point formatting loop."""
+    tz_suffix = f"{timezone_offset:+03d}:00"
+    out = []
+    for coord, alt_point in zip(coords, altitudes):
+        timestamp = parse_timestamp(alt_point[1]) + datetime.timedelta(hours=timezone_offset)
+        out.append((str(coord[1]), str(coord[0]), str(alt_point[0]),
+                    timestamp.strftime('%Y-%m-%dT%H:%M:%S') + tz_suffix))
+    return out
+
+def batch(coords, altitudes, timezone_offset):
+    """The batch path used by iter_track_points."""
+    times = format_timestamps(parse_timestamps([alt_point[1] for alt_point in altitudes]), timezone_offset)
+    lats = [str(coord[1]) for coord in coords]
+    lons = [str(coord[0]) for coord in coords]
+    eles = [str(alt_point[0]) for alt_point in altitudes]
+    return list(zip(lats, lons, eles, times))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-point vs batch point formatting')
+    parser.add_argument('--points', type=int, default=1000000, help='Number of points to format')
+    parser.add_argument('-t', '--timezone', type=int, default=8, help='Timezone offset in hours')
+    args = parser.parse_args()
+    
+    coords, altitudes = scaled_columns(args.points)
+    
+    start = time.perf_counter()
+    expected = per_point(coords, altitudes, args.timezone)
+    per_point_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    result = batch(coords, altitudes, args.timezone)
+    batch_seconds = time.perf_counter() - start
+    
+    if result != expected:
+        raise SystemExit("Batch output does not match the per-point output")
+    
+    print(f"Points:    {args.points}")
+    print(f"Per-point: {per_point_seconds:.2f}s")
+    print(f"Batch:     {batch_seconds:.2f}s")
+    print(f"Speedup:   {per_point_seconds / batch_seconds:.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""Repeatable conversion benchmarks with JSON results for comparing commits.
+
+Every case runs in a fresh process against synthetic tracks, so its peak RSS
+is its own. process_track and the web index route fetch from a local API
+stub (benchmarks.api_stub) with the configured latency; serve load-tests the
+index route through web_server's worker processes, and api posts single
+tracks to /api/convert with gzip, reporting the compressed bytes sent.
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --sizes 10k,100k -o before.json
+    python -m benchmarks.run_benchmarks --sizes 10k,100k --compare before.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.api_stub import StubServer, load_payload
+from benchmarks.synthetic import SIZES, generate_track, parse_size
+
+CASES = ('create_gpx', 'save_gpx', 'write_gpx', 'write_fit', 'write_geojson', 'write_csv', 'preview_build', 'preview',
+         'fetch', 'fetch_stream', 'process_track', 'index', 'serve', 'api')
+DEFAULT_SIZES = '10k,100k,1m'
+DEFAULT_THRESHOLD = 0.1  # relative change in throughput or peak RSS reported as a regression
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def track_uuid(n):
+    return f'{n:08d}-0000-4000-8000-000000000000'
+
+def track_url(n):
+    return f'https://www.fenxuekeji.com/h5/track?track_uuid={track_uuid(n)}'
+
+@contextlib.contextmanager
+def _quiet():
+    """Silence the converter's progress output, which would dominate small cases."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+# Each case takes (points, options, work_dir) and returns (run, points_per_run).
+# run() performs one timed repetition and returns the number of bytes produced.
+
+def case_create_gpx(points, options, work_dir):
+    from converter_gpx import create_gpx
+    track_data = generate_track(points)
+
+    def run():
+        create_gpx(track_data, options['timezone'])
+        return 0
+    return run, points
+
+def case_save_gpx(points, options, work_dir):
+    from converter_gpx import create_gpx, save_gpx
+    output_file = os.path.join(work_dir, 'save.gpx')
+    with _quiet():
+        gpx_tree = create_gpx(generate_track(points), options['timezone'])
+
+    def run():
+        save_gpx(gpx_tree, output_file)
+        return os.path.getsize(output_file)
+    return run, points
+
+def case_write_gpx(points, options, work_dir):
+    from converter_gpx import write_gpx
+    track_data = generate_track(points)
+    output_file = os.path.join(work_dir, 'write.gpx')
+
+    def run():
+        write_gpx(track_data, output_file, options['timezone'])
+        return os.path.getsize(output_file)
+    return run, points
+
+def case_write_output(points, options, work_dir, output_format):
+    """Write an already parsed Track in output_format, the part every writer shares done once."""
+    from converter_gpx import write_output
+    from track_model import load_track
+    track = load_track(generate_track(points))
+    output_file = os.path.join(work_dir, f'write.{output_format}')
+
+    def run():
+        write_output(track, output_file, output_format, options['timezone'])
+        return os.path.getsize(output_file)
+    return run, points
+
+def case_write_fit(points, options, work_dir):
+    return case_write_output(points, options, work_dir, 'fit')
+
+def case_write_geojson(points, options, work_dir):
+    return case_write_output(points, options, work_dir, 'geojson')
+
+def case_write_csv(points, options, work_dir):
+    return case_write_output(points, options, work_dir, 'csv')
+
+def case_preview_build(points, options, work_dir):
+    """Build a parsed Track's preview pyramid, done once per track."""
+    from preview import build_pyramid, dump_pyramid
+    from track_model import load_track
+    track = load_track(generate_track(points))
+
+    def run():
+        return len(dump_pyramid(build_pyramid(track)))
+    return run, points
+
+def case_preview(points, options, work_dir):
+    """Draw the default SVG preview from a cached pyramid, as the preview route does."""
+    from preview import build_pyramid, dump_pyramid, load_pyramid, pick_level, render_svg
+    content = dump_pyramid(build_pyramid(generate_track(points)))
+
+    def run():
+        pyramid = load_pyramid(content)
+        return len(render_svg(pyramid, pick_level(pyramid)))
+    return run, points
+
+def case_fetch(points, options, work_dir, stream=False):
+    """Fetch from the stub and parse into a Track, with response.json() or streamed."""
+    from huabei_api import fetch_track_data
+    from track_model import load_track
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        load_track(fetch_track_data(track_uuid(next(counter)), stream=stream))
+        return 0
+    return run, points
+
+def case_fetch_stream(points, options, work_dir):
+    return case_fetch(points, options, work_dir, stream=True)
+
+def case_process_track(points, options, work_dir):
+    from converter_gpx import process_track
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        output_file = process_track(track_url(next(counter)), options['timezone'], work_dir)
+        if output_file is None:
+            raise RuntimeError("process_track failed, see the converter output")
+        size = os.path.getsize(output_file)
+        os.remove(output_file)
+        return size
+    return run, points
+
+def case_index(points, options, work_dir):
+    """POST batches of URLs to the index route from concurrent clients over real HTTP."""
+    from werkzeug.serving import make_server
+    from web_interface import app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no access log line per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return post_batches(f'http://127.0.0.1:{server.server_port}/', points, options)
+
+def case_serve(points, options, work_dir):
+    """The index case against web_server's pre-forked worker processes.
+
+    The admission queue holds every client, so a 503 fails the case instead
+    of being counted as a fast response.
+    """
+    from web_interface import app
+    from web_server import PooledWSGIServer, Supervisor
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = PooledWSGIServer('127.0.0.1', 0, app, options['server_threads'], options['clients'])
+    # Workers exit on their own once this process has gone
+    Supervisor(server, options['server_processes']).start()
+    return post_batches(f'http://127.0.0.1:{server.port}/', points, options)
+
+def case_api(points, options, work_dir):
+    """POST one track per request to /api/convert from concurrent clients, accepting gzip."""
+    from werkzeug.serving import make_server
+    from web_interface import app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f'http://127.0.0.1:{server.server_port}/api/convert'
+    clients = options['clients']
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def post():
+        with counter_lock:
+            uuid = track_uuid(next(counter))
+        body = json.dumps({'tracks': [uuid], 'timezone': options['timezone']}).encode()
+        request = urllib.request.Request(api_url, data=body, headers={
+            'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(request, timeout=600) as response:
+            if response.headers.get('Content-Encoding') != 'gzip':
+                raise RuntimeError("/api/convert did not gzip its response")
+            return len(response.read())
+
+    return run_clients(post, clients), points * clients
+
+def post_batches(index_url, points, options):
+    """A run() POSTing urls_per_request URLs from each of clients concurrent clients to index_url."""
+    clients = options['clients']
+    urls_per_request = options['urls_per_request']
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def post():
+        with counter_lock:
+            urls = [track_url(next(counter)) for _ in range(urls_per_request)]
+        fields = [('urls[]', url) for url in urls] + [('timezone', str(options['timezone']))]
+        request = urllib.request.Request(index_url, data=urllib.parse.urlencode(fields).encode())
+        with urllib.request.urlopen(request, timeout=600) as response:
+            if response.headers.get_content_type() != 'application/zip':
+                raise RuntimeError(f"index returned {response.headers.get_content_type()}, not a ZIP")
+            return len(response.read())
+
+    return run_clients(post, clients), points * clients * urls_per_request
+
+def run_clients(post, clients):
+    """A run() calling post() from clients concurrent threads and returning the bytes they received."""
+    def run():
+        sizes = [0] * clients
+        errors = []
+
+        def client(i):
+            try:
+                sizes[i] = post()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return sum(sizes)
+    return run
+
+def measure(case, points, options):
+    """Run one case in this process and return its result record."""
+    import huabei_api
+    import result_cache
+    huabei_api.API_BASE = options['api_base']
+    huabei_api.set_cache(None)
+    huabei_api.set_limiter(None)  # measure conversion, not the upstream rate limit
+    result_cache.set_result_cache(None)  # nor converted outputs kept from earlier runs
+
+    with tempfile.TemporaryDirectory(prefix='huabei-bench-') as work_dir:
+        with _quiet():
+            run, points_per_run = globals()[f'case_{case}'](points, options, work_dir)
+        setup_rss = peak_rss_mb()
+        seconds = []
+        output_bytes = 0
+        for _ in range(options['repeats']):
+            with _quiet():
+                start = time.perf_counter()
+                output_bytes = run()
+                seconds.append(time.perf_counter() - start)
+
+    best = min(seconds)
+    return {
+        'case': case,
+        'points': points,
+        'points_per_run': points_per_run,
+        'seconds': seconds,
+        'best_seconds': best,
+        'median_seconds': statistics.median(seconds),
+        'points_per_second': points_per_run / best if best else None,
+        'output_bytes': output_bytes,
+        'setup_rss_mb': setup_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def run_isolated(case, points, options):
+    """Run measure() in a fresh spawned process so peak RSS is not inherited."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(measure, case, points, options).result()
+
+def git_revision():
+    """Return (commit, dirty) for the working tree, or (None, None) outside git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Print each case's change against a baseline results file and return the regressions."""
+    previous = {(r['case'], r['points']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['case'], result['points']))
+        if old is None:
+            continue
+        line = f"{result['case']:>14} {result['points']:>9}"
+        if old['points_per_second'] and result['points_per_second']:
+            change = result['points_per_second'] / old['points_per_second'] - 1
+            line += f"  throughput {change:+.1%}"
+            if change < -threshold:
+                regressions.append(f"{result['case']} at {result['points']} points: throughput {change:+.1%}")
+        if old.get('peak_rss_mb') and result['peak_rss_mb']:
+            change = result['peak_rss_mb'] / old['peak_rss_mb'] - 1
+            line += f"  peak RSS {change:+.1%}"
+            if change > threshold:
+                regressions.append(f"{result['case']} at {result['points']} points: peak RSS {change:+.1%}")
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GPX conversion on synthetic tracks')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f'Comma-separated point counts or {", ".join(SIZES)} (default: {DEFAULT_SIZES})')
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help=f'Comma-separated cases to run (default: {",".join(CASES)})')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed repetitions per case (default: 3)')
+    parser.add_argument('-t', '--timezone', type=int, default=8, help='Timezone offset in hours (default: 8)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds the API stub waits before every response (default: 0.05)')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Concurrent clients for the index and serve cases (default: 4)')
+    parser.add_argument('--urls-per-request', type=int, default=2,
+                        help='URLs each index client posts per request (default: 2)')
+    parser.add_argument('--server-processes', type=int, default=2,
+                        help='Worker processes for the serve case (default: 2)')
+    parser.add_argument('--server-threads', type=int, default=8,
+                        help='Request threads per worker process for the serve case (default: 8)')
+    parser.add_argument('-o', '--output', help='Results file (default: benchmark_<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against an earlier results file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative change reported as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    sizes = [parse_size(size) for size in args.sizes.split(',') if size.strip()]
+    options = {
+        'repeats': args.repeats,
+        'timezone': args.timezone,
+        'latency': args.latency,
+        'clients': args.clients,
+        'urls_per_request': args.urls_per_request,
+        'server_processes': args.server_processes,
+        'server_threads': args.server_threads,
+    }
+
+    commit, dirty = git_revision()
+    results = []
+    for points in sizes:
+        # The stub serves a track of the size being measured
+        with StubServer(load_payload(points), args.latency) as stub:
+            options['api_base'] = stub.api_base
+            for case in cases:
+                result = run_isolated(case, points, options)
+                results.append(result)
+                print(f"{case:>14} {points:>9} points  {result['best_seconds']:8.3f}s  "
+                      f"{result['points_per_second']:>12,.0f} points/s  "
+                      f"peak RSS {result['peak_rss_mb'] or 0:8.1f} MB")
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': {key: value for key, value in options.items() if key != 'api_base'},
+        'results': results,
+    }
+    output_file = args.output or f"benchmark_{(commit or 'results')[:12]}.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output_file}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
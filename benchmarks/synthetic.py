@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Scale apireturn_example.json into synthetic tracks of any size.
+
+The sample's points are repeated one day after another, each copy nudged
+east a little, and cut into runs of equal length. The output has the same
+shape as an API response, so it goes through every conversion path.
+
+Run from the repository root:
+    python -m benchmarks.synthetic --points 1000000 -o track_1m.json
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+
+from track_model import parse_timestamp
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'apireturn_example.json')
+
+# Named sizes accepted wherever a point count is
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000, '5m': 5000000}
+POINTS_PER_RUN = 200  # default run length, close to the sample's
+DAY = datetime.timedelta(days=1)
+LON_STEP = 0.00001  # degrees added to longitudes for every repeat of the sample
+
+def parse_size(value):
+    """Turn a named size ('100k') or a plain number into a point count."""
+    value = str(value).strip().lower()
+    if value in SIZES:
+        return SIZES[value]
+    return int(value)
+
+_sample = None
+
+def load_sample():
+    """Return the parsed sample response, read once."""
+    global _sample
+    if _sample is None:
+        with open(SAMPLE_FILE, 'r', encoding='utf-8') as f:
+            _sample = json.load(f)
+    return _sample
+
+def _sample_points():
+    """The sample's points flattened across runs as (lon, lat, altitude, date, clock, speed, status)."""
+    data = load_sample()['data']
+    points = []
+    for coords, altitudes, speeds, statuses in zip(data['track_detail'], data['altitude_arr'],
+                                                   data['speed_arr'], data['status_arr']):
+        for coord, alt_point, speed_point, status in zip(coords, altitudes, speeds, statuses):
+            time = parse_timestamp(alt_point[1])
+            points.append((coord[0], coord[1], alt_point[0], time.date(), time.strftime('%H:%M:%S'),
+                           speed_point[0], status[0]))
+    return points
+
+def iter_runs(points, runs=None):
+    """Yield (track_detail, altitude_arr, speed_arr, status_arr) entries for each synthetic run.
+
+    runs defaults to one run per POINTS_PER_RUN points; the remainder goes to
+    the last run.
+    """
+    if runs is None:
+        runs = max(1, points // POINTS_PER_RUN)
+    runs = max(1, min(runs, points))
+    sample = _sample_points()
+    run_length = points // runs
+    dates = {}  # (repeat, sample date) -> shifted date string
+    index = 0
+    for run in range(runs):
+        length = run_length if run < runs - 1 else points - index
+        coords, altitudes, speeds, statuses = [], [], [], []
+        for i in range(index, index + length):
+            repeat, offset = divmod(i, len(sample))
+            lon, lat, altitude, date, clock, speed, status = sample[offset]
+            key = (repeat, date)
+            if key not in dates:
+                dates[key] = (date + repeat * DAY).strftime('%Y-%m-%d')
+            timestamp = f"{dates[key]} {clock}"
+            coords.append([round(lon + repeat * LON_STEP, 6), lat])
+            altitudes.append([altitude, timestamp])
+            speeds.append([speed, timestamp, 0, 0, ['consuming']])
+            statuses.append([status])
+        index += length
+        yield coords, altitudes, speeds, statuses
+
+def generate_track(points, runs=None):
+    """Return a synthetic API response with the given number of points."""
+    track_data = copy.deepcopy(load_sample())
+    data = track_data['data']
+    columns = ([], [], [], [])
+    for run in iter_runs(points, runs):
+        for column, values in zip(columns, run):
+            column.append(values)
+    data['track_detail'], data['altitude_arr'], data['speed_arr'], data['status_arr'] = columns
+    return track_data
+
+def write_track(output_file, points, runs=None):
+    """Write a synthetic API response to a file one run at a time.
+
+    The four point arrays are generated in turn, so only one run is held in
+    memory even at millions of points. Returns the file size in bytes.
+    """
+    sample = load_sample()
+    arrays = ('track_detail', 'altitude_arr', 'speed_arr', 'status_arr')
+    # Serialise everything else with data last, then splice the arrays in
+    # before the closing braces
+    track_data = {key: value for key, value in sample.items() if key != 'data'}
+    track_data['data'] = {key: value for key, value in sample['data'].items() if key not in arrays}
+    head = json.dumps(track_data, ensure_ascii=False)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(head[:-2])
+        for column, key in enumerate(arrays):
+            f.write(f', "{key}": [')
+            for i, run in enumerate(iter_runs(points, runs)):
+                if i:
+                    f.write(', ')
+                f.write(json.dumps(run[column], ensure_ascii=False))
+            f.write(']')
+        f.write('}}')
+    return os.path.getsize(output_file)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic track from the sample response')
+    parser.add_argument('--points', default='100k',
+                        help=f'Number of points or one of {", ".join(SIZES)} (default: 100k)')
+    parser.add_argument('--runs', type=int, help=f'Number of runs (default: one per {POINTS_PER_RUN} points)')
+    parser.add_argument('-o', '--output', help='Output JSON file (default: synthetic_<points>.json)')
+    args = parser.parse_args()
+
+    points = parse_size(args.points)
+    output_file = args.output or f'synthetic_{points}.json'
+    size = write_track(output_file, points, args.runs)
+    print(f"Wrote {points} points to {output_file} ({size / 1e6:.1f} MB)")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
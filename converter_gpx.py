@@ -1,14 +1,50 @@
 #!/usr/bin/env python3
 import argparse
+import glob
+import gzip
 import json
+import logging
 import os
 import re
-import requests
+import sys
+import tempfile
+import time
 import datetime
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from xml.etree import ElementTree as ET
 
+# huabei_api (and with it requests) is imported where tracks are fetched, so
+# convert-dir starts without it
+from analytics_writers import iter_csv, iter_geojson
+from day_merge import group_by_key, merge_tracks
+from fit_writer import iter_fit
+from instrumentation import LOG_FORMATS, configure_logging, span, timed_iter
+from kinematics import run_kinematics, track_top_speed
+from result_cache import result_key
+from simplify import METHODS, simplify_track
+from track_cache import TrackCache
+from track_model import (Track, format_column, format_timestamps, get_track_name, load_track, parse_timestamp,
+                         parse_timestamps)
+from track_stream import DEFAULT_CHUNK_BYTES, load_track_stream
+
+GPX_ATTRIBUTES = (
+    ('version', '1.1'),
+    ('creator', 'Huabei to Slopes Converter'),
+    ('xmlns', 'http://www.topografix.com/GPX/1/1'),
+    ('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance'),
+    ('xsi:schemaLocation', 'http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd'),
+)
+# Namespace of the <gte:gps speed azimuth> point extension read by Slopes
+GTE_NAMESPACE = 'http://www.gpstrackeditor.com/xmlschemas/General/1'
+
+log = logging.getLogger(__name__)
+
 def extract_track_uuid(url):
-    """Extract the track_uuid or ski_uuid from the shared URL."""
+    """Extract the track_uuid or ski_uuid from the shared URL; a bare UUID is returned as is."""
+    if re.fullmatch(r'[0-9A-Za-z_-]+', url.strip()):
+        return url.strip()
+    
     # Try to find track_uuid first
     track_match = re.search(r'track_uuid=([^&]+)', url)
     if track_match:
@@ -21,278 +57,716 @@ def extract_track_uuid(url):
     
     raise ValueError("Could not find track_uuid or ski_uuid in the provided URL")
 
-def fetch_track_data(track_uuid):
-    """Fetch track data from the Huabei API."""
-    # First try the track endpoint
-    url = f"https://api.fenxuekeji.com/api/tracks/{track_uuid}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        return response.json()
-    
-    # If track endpoint fails, try the ski endpoint
-    url = f"https://api.fenxuekeji.com/api/skis/{track_uuid}"
-    response = requests.get(url)
+def track_day(track_data):
+    """Return the (date, resort) a track's filename is made of; either is None when the response lacks it.
+
+    The date reads like "February 05, 2024" and the resort name is made
+    file-system friendly. Raises ValueError for a malformed start_at_str.
+    """
+    if isinstance(track_data, Track):
+        track_data = track_data.metadata
+    data = track_data.get('data') or {}
+    track_info = data.get('track') or {}
     
-    if response.status_code != 200:
-        raise ValueError(f"Failed to fetch track data: {response.status_code}")
+    # Try to get formatted date string first, like "2024-02-05"
+    date_formatted = None
+    date_str = track_info.get('start_at_str')
+    if date_str:
+        date_formatted = datetime.datetime.strptime(date_str, "%Y-%m-%d").strftime("%B %d, %Y")
+    elif track_info.get('start_at'):
+        # Fall back to timestamp if string date not available
+        date_formatted = datetime.datetime.fromtimestamp(track_info['start_at']).strftime("%B %d, %Y")
     
-    return response.json()
+    resort_name = (data.get('ski_ranch') or {}).get('name')
+    if resort_name:
+        # Clean resort name to make it file-system friendly
+        resort_name = resort_name.replace('/', '-').replace('\\', '-').replace(' ', '_')
+    return date_formatted, resort_name or None
 
 def get_default_filename(track_data):
     """Generate a default filename based on date and resort name."""
     try:
-        # Get date
-        if 'data' in track_data and 'track' in track_data['data']:
-            # Try to get formatted date string first
-            date_str = track_data['data']['track'].get('start_at_str')
-            if date_str:
-                # Convert from format like "2024-02-05" to "February 05, 2024"
-                date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
-                date_formatted = date_obj.strftime("%B %d, %Y")
-            else:
-                # Fall back to timestamp if string date not available
-                start_timestamp = track_data['data']['track'].get('start_at')
-                if start_timestamp:
-                    date_obj = datetime.datetime.fromtimestamp(start_timestamp)
-                    date_formatted = date_obj.strftime("%B %d, %Y")
-                else:
-                    date_formatted = "unknown_date"
-        else:
-            date_formatted = "unknown_date"
-        
-        # Get resort name
-        if 'data' in track_data and 'ski_ranch' in track_data['data']:
-            resort_name = track_data['data']['ski_ranch'].get('name', 'unknown_resort')
-            # Clean resort name to make it file-system friendly
-            resort_name = resort_name.replace('/', '-').replace('\\', '-').replace(' ', '_')
-        else:
-            resort_name = "unknown_resort"
-        
-        # Combine date and resort name
-        return f"{date_formatted} - {resort_name}.gpx"
+        date_formatted, resort_name = track_day(track_data)
+        return f"{date_formatted or 'unknown_date'} - {resort_name or 'unknown_resort'}.gpx"
     except Exception as e:
-        print(f"Warning: Could not generate default filename: {str(e)}")
+        log.warning("Could not generate default filename: %s", e)
+        if isinstance(track_data, Track):
+            track_data = track_data.metadata
         if 'data' in track_data and 'track' in track_data['data'] and 'uuid' in track_data['data']['track']:
             return f"{track_data['data']['track']['uuid']}.gpx"
         return "ski_track.gpx"
 
-def parse_timestamp(timestamp_str):
-    """Parse timestamp string to datetime object."""
-    try:
-        # Format is likely "YYYY-MM-DD HH:MM:SS"
-        return datetime.datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        # Try alternative formats if necessary
-        try:
-            return datetime.datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M")
-        except ValueError:
-            return None
+def format_gps_extensions(run, top_speed=None):
+    """Build the gte:gps attributes (speed in m/s, azimuth in degrees) for each point of a run."""
+    speeds, azimuths = run_kinematics(run, top_speed)
+    gps = []
+    for speed, azimuth in zip(speeds, azimuths):
+        attributes = []
+        if speed == speed:
+            attributes.append(('speed', f"{speed:.2f}"))
+        if azimuth == azimuth:
+            attributes.append(('azimuth', f"{azimuth:.1f}"))
+        gps.append(tuple(attributes) or None)
+    return gps
+
+def iter_track_points(track, timezone_offset=0, gps_extensions=False):
+    """Yield the points of each run as a list of (lat, lon, ele, time, gps) tuples.
+
+    track is raw track data or a Track from load_track. lat, lon, ele and
+    time are strings; gps is a tuple of gte:gps (name, value) attributes when
+    gps_extensions is set. ele, time and gps are None when the point has no
+    such data.
+    """
+    track = load_track(track)
+    total_added_points = 0
+    
+    # Slopes overstates max speed from raw positions, so cap at what Huabei measured
+    top_speed = track_top_speed(track)
+    
+    for run_idx, run in enumerate(track.runs):
+        if gps_extensions:
+            gps = format_gps_extensions(run, top_speed)
+        else:
+            gps = [None] * len(run)
+        # In GPX format, latitude comes first as an attribute
+        points = list(zip(
+            format_column(run.lat, run.lat_integral),
+            format_column(run.lon, run.lon_integral),
+            format_column(run.ele, run.ele_integral),
+            format_timestamps(run.time, timezone_offset),
+            gps,
+        ))
+        total_added_points += len(points)
+        log.debug("Added %d points from RUN %d", len(points), run_idx + 1)
+        yield points
+    
+    log.debug("Total points added to the GPX file: %d", total_added_points)
+
+def _gpx_attributes(gps_extensions):
+    if gps_extensions:
+        return GPX_ATTRIBUTES + (('xmlns:gte', GTE_NAMESPACE),)
+    return GPX_ATTRIBUTES
 
-def create_gpx(track_data, timezone_offset=0):
+def create_gpx(track_data, timezone_offset=0, gps_extensions=False):
     """Convert track data to GPX format."""
+    track = load_track(track_data)
+    
     # Create the root GPX element
     gpx = ET.Element('gpx')
-    gpx.set('version', '1.1')
-    gpx.set('creator', 'Huabei to Slopes Converter')
-    gpx.set('xmlns', 'http://www.topografix.com/GPX/1/1')
-    gpx.set('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
-    gpx.set('xsi:schemaLocation', 'http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd')
-    
-    # Extract track information
-    if 'data' in track_data and 'track' in track_data['data']:
-        track_info = track_data['data']['track']
-        # Use the formatted date-time if available
-        if 'start_at_str_format' in track_info:
-            track_name = f"Ski Track - {track_info['start_at_str_format']}"
-        else:
-            track_name = f"Ski Track - {track_info.get('start_at_str', 'Unknown')}"
-        
-        # Get resort name if available
-        if 'ski_ranch' in track_data['data'] and 'name' in track_data['data']['ski_ranch']:
-            resort_name = track_data['data']['ski_ranch']['name']
-            track_name = f"{track_name} at {resort_name}"
-    else:
-        track_name = "Ski Track"
+    for key, value in _gpx_attributes(gps_extensions):
+        gpx.set(key, value)
+    
+    track_name = get_track_name(track)
     
     # Add metadata
     metadata = ET.SubElement(gpx, 'metadata')
     name = ET.SubElement(metadata, 'name')
     name.text = track_name
     
-    # Extract GPS coordinates (track_detail) and altitude/time data (altitude_arr)
-    runs = []
-    altitude_data = []
-    total_points = 0
-    
-    if 'data' in track_data:
-        if 'track_detail' in track_data['data']:
-            # track_detail is a collection of runs, with each run being a list of coordinates
-            runs = track_data['data']['track_detail']
-            for run in runs:
-                total_points += len(run)
-            print(f"Found {len(runs)} ski runs with a total of {total_points} coordinate points")
-        
-        if 'altitude_arr' in track_data['data']:
-            altitude_data = track_data['data']['altitude_arr']
-            if altitude_data and isinstance(altitude_data[0], list) and len(altitude_data[0]) >= 2:
-                # If altitude_arr exists and has the expected format
-                print(f"Found altitude/time data")
-    
-    if not runs:
-        raise ValueError("No coordinate data found in the track data")
-    
     # Create track element
     trk = ET.SubElement(gpx, 'trk')
     trk_name = ET.SubElement(trk, 'name')
     trk_name.text = track_name
     
-    # Get the max altitude for default elevation if needed
-    default_elevation = None
-    if 'data' in track_data and 'track' in track_data['data']:
-        default_elevation = track_data['data']['track'].get('max_altitude_meter')
+    # Each run becomes a separate trkseg
+    for points in iter_track_points(track, timezone_offset, gps_extensions):
+        trkseg = ET.SubElement(trk, 'trkseg')
+        for lat, lon, ele, time_text, gps in points:
+            trkpt = ET.SubElement(trkseg, 'trkpt')
+            trkpt.set('lat', lat)
+            trkpt.set('lon', lon)
+            if ele is not None:
+                ET.SubElement(trkpt, 'ele').text = ele
+            if time_text is not None:
+                ET.SubElement(trkpt, 'time').text = time_text
+            if gps is not None:
+                extensions = ET.SubElement(trkpt, 'extensions')
+                ET.SubElement(extensions, 'gte:gps', dict(gps))
     
-    # Process each run as a separate trkseg
-    total_added_points = 0
+    return ET.ElementTree(gpx)
+
+def _escape_text(text):
+    """Escape element text the same way ElementTree does."""
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+def _escape_attrib(text):
+    """Escape an attribute value the same way ElementTree does."""
+    text = _escape_text(text)
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if '\r' in text:
+        text = text.replace('\r', '&#13;')
+    if '\n' in text:
+        text = text.replace('\n', '&#10;')
+    if '\t' in text:
+        text = text.replace('\t', '&#09;')
+    return text
+
+def _format_trkseg(points):
+    """Serialize one run as a trkseg string."""
+    if not points:
+        return '<trkseg />'
+    parts = ['<trkseg>']
+    for lat, lon, ele, time_text, gps in points:
+        head = f'<trkpt lat="{_escape_attrib(lat)}" lon="{_escape_attrib(lon)}"'
+        if ele is None and time_text is None and gps is None:
+            parts.append(head + ' />')
+            continue
+        parts.append(head + '>')
+        if ele is not None:
+            parts.append(f'<ele>{_escape_text(ele)}</ele>')
+        if time_text is not None:
+            parts.append(f'<time>{_escape_text(time_text)}</time>')
+        if gps is not None:
+            attributes = ''.join(f' {key}="{_escape_attrib(value)}"' for key, value in gps)
+            parts.append(f'<extensions><gte:gps{attributes} /></extensions>')
+        parts.append('</trkpt>')
+    parts.append('</trkseg>')
+    return ''.join(parts)
+
+def iter_gpx(track_data, timezone_offset=0, gps_extensions=False):
+    """Yield the GPX document as UTF-8 encoded chunks, one per run.
+
+    The output is byte-identical to create_gpx followed by save_gpx, but only
+    one run's text is held in memory at a time. Invalid track data raises
+    before the first chunk is produced. gps_extensions adds Slopes'
+    <gte:gps speed azimuth> data to every point. Time spent generating the
+    chunks is recorded as the serialize stage.
+    """
+    return timed_iter('serialize', _iter_gpx(track_data, timezone_offset, gps_extensions), writer='gpx')
+
+def _iter_gpx(track_data, timezone_offset, gps_extensions):
+    track = load_track(track_data)
+    track_name = _escape_text(get_track_name(track))
     
-    # Get time offset from track start time if available
-    start_time = None
-    if 'data' in track_data and 'track' in track_data['data']:
-        start_time = track_data['data']['track'].get('start_at')
+    attributes = ''.join(f' {key}="{_escape_attrib(value)}"' for key, value in _gpx_attributes(gps_extensions))
+    yield (
+        "<?xml version='1.0' encoding='utf-8'?>\n"
+        f"<gpx{attributes}>"
+        f"<metadata><name>{track_name}</name></metadata>"
+        f"<trk><name>{track_name}</name>"
+    ).encode('utf-8')
     
-    # Process each run
-    for run_idx, run in enumerate(runs):
-        # Create a new track segment for this run
-        trkseg = ET.SubElement(trk, 'trkseg')
-        run_points = 0
-        
-        # Process each point in the run
-        for point_idx, coord in enumerate(run):
-            if len(coord) >= 2:  # Ensure we have at least lon, lat
-                trkpt = ET.SubElement(trkseg, 'trkpt')
-                # In GPX format, latitude comes first as an attribute
-                trkpt.set('lat', str(coord[1]))  # Latitude is second in coordinate
-                trkpt.set('lon', str(coord[0]))  # Longitude is first in coordinate
-                
-                # Add elevation if available from altitude_arr
-                # Note: altitude_arr may not directly map to track points, so we need to be careful
-                if altitude_data and run_idx < len(altitude_data) and point_idx < len(altitude_data[run_idx]):
-                    alt_point = altitude_data[run_idx][point_idx]
-                    if isinstance(alt_point, list) and len(alt_point) >= 1:
-                        ele = ET.SubElement(trkpt, 'ele')
-                        ele.text = str(alt_point[0])  # First element is elevation
-                        
-                        # Add time if available
-                        if len(alt_point) >= 2 and isinstance(alt_point[1], str):
-                            time_str = alt_point[1]  # Second element is timestamp string
-                            timestamp = parse_timestamp(time_str)
-                            if timestamp:
-                                # Adjust for timezone offset
-                                timestamp = timestamp + datetime.timedelta(hours=timezone_offset)
-                                time_elem = ET.SubElement(trkpt, 'time')
-                                time_elem.text = timestamp.strftime('%Y-%m-%dT%H:%M:%S') + f"{timezone_offset:+03d}:00"
-                elif default_elevation is not None:
-                    # Use default elevation if no specific elevation data
-                    ele = ET.SubElement(trkpt, 'ele')
-                    ele.text = str(default_elevation)
-                
-                # Add time based on start_time if we don't have specific time data but have start_time
-                if start_time and trkpt.find('time') is None:
-                    time_elem = ET.SubElement(trkpt, 'time')
-                    point_time = datetime.datetime.fromtimestamp(start_time + total_added_points + point_idx)
-                    # Adjust for timezone offset
-                    point_time = point_time + datetime.timedelta(hours=timezone_offset)
-                    time_elem.text = point_time.strftime('%Y-%m-%dT%H:%M:%S') + f"{timezone_offset:+03d}:00"
-                
-                run_points += 1
-        
-        total_added_points += run_points
-        print(f"Added {run_points} points from RUN {run_idx+1}")
+    for points in iter_track_points(track, timezone_offset, gps_extensions):
+        yield _format_trkseg(points).encode('utf-8')
     
-    print(f"Total points added to the GPX file: {total_added_points}")
-    return ET.ElementTree(gpx)
+    yield b'</trk></gpx>'
+
+# An output format: its file extension, MIME type and the function yielding
+# the file in chunks from (track_data, timezone_offset, gps_extensions)
+OutputFormat = namedtuple('OutputFormat', ['extension', 'mimetype', 'iter_chunks'])
+
+OUTPUT_FORMATS = {
+    'gpx': OutputFormat('.gpx', 'application/gpx+xml', iter_gpx),
+    'fit': OutputFormat('.fit', 'application/vnd.ant.fit', iter_fit),
+    'geojson': OutputFormat('.geojson', 'application/geo+json', iter_geojson),
+    'csv': OutputFormat('.csv', 'text/csv', iter_csv),
+}
+
+def get_output_format(output_format):
+    """Return the OutputFormat called output_format; raises ValueError for unknown names."""
+    try:
+        return OUTPUT_FORMATS[output_format]
+    except KeyError:
+        raise ValueError(f"Unknown output format: {output_format}") from None
+
+def with_extension(filename, output_format):
+    """Give a filename (such as get_default_filename's) the extension of output_format."""
+    return os.path.splitext(filename)[0] + get_output_format(output_format).extension
+
+def iter_output(track_data, output_format='gpx', timezone_offset=0, gps_extensions=False):
+    """Yield the track in output_format as chunks; every writer takes the same Track."""
+    return get_output_format(output_format).iter_chunks(track_data, timezone_offset, gps_extensions)
+
+def write_output(track_data, output, output_format='gpx', timezone_offset=0, gps_extensions=False):
+    """Stream the track in output_format to a file path or a writable binary file object."""
+    chunks = iter_output(track_data, output_format, timezone_offset, gps_extensions)
+    if hasattr(output, 'write'):
+        for chunk in chunks:
+            output.write(chunk)
+        return
+    
+    # Write to a temporary name first so a failed conversion leaves no partial file
+    temp_file = f"{output}.part"
+    try:
+        with open(temp_file, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_file, output)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def write_gpx(track_data, output, timezone_offset=0, gps_extensions=False):
+    """Stream GPX for the track to a file path or a writable binary file object."""
+    write_output(track_data, output, 'gpx', timezone_offset, gps_extensions)
 
 def load_json_file(file_path):
-    """Load JSON data from a file."""
-    with open(file_path, 'r', encoding='utf-8') as f:
+    """Load JSON data from a file; .gz files are decompressed."""
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'rt', encoding='utf-8') as f:
         return json.load(f)
 
+def load_track_file(file_path):
+    """Decode a saved API response (.json or .json.gz) into a Track without loading it whole."""
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'rb') as f:
+        return load_track_stream(iter(lambda: f.read(DEFAULT_CHUNK_BYTES), b''))
+
 def save_gpx(gpx_tree, output_file):
     """Save the GPX tree to a file."""
-    gpx_tree.write(output_file, encoding='utf-8', xml_declaration=True)
+    with span('serialize', writer='etree'):
+        gpx_tree.write(output_file, encoding='utf-8', xml_declaration=True)
+
+def output_size(track, output_format='gpx', timezone_offset=0, gps_extensions=False):
+    """Return the size in bytes of the track in output_format without keeping it."""
+    return sum(len(chunk) for chunk in iter_output(track, output_format, timezone_offset, gps_extensions))
+
+def convert_track(track_data, timezone_offset=0, output_dir=None, filename=None, gps_extensions=False,
+                  simplify=None, simplify_method='dp', output_format='gpx'):
+    """Write already fetched track data to a file in output_format and return the output filename.
+
+    simplify is a tolerance in metres; when set, the track is thinned with
+    simplify_method ('dp' or 'vw') and the point and byte savings are logged.
+    The size before simplifying is estimated from the bytes per point written,
+    and only measured by writing the whole track when logging at DEBUG.
+    """
+    # Generate default filename based on date and resort
+    output_file = filename or with_extension(get_default_filename(track_data), output_format)
+    
+    # If output directory is specified, prepend it to the filename
+    if output_dir:
+        output_file = os.path.join(output_dir, output_file)
+    
+    track = load_track(track_data)
+    if simplify:
+        original_points = track.point_count
+        original_size = None
+        if log.isEnabledFor(logging.DEBUG):
+            original_size = output_size(track, output_format, timezone_offset, gps_extensions)
+        track = simplify_track(track, simplify, simplify_method)
+    
+    log.info("Converting to %s format with timezone offset: %s hours...", output_format.upper(), timezone_offset)
+    log.info("Saving to %s...", output_file)
+    write_output(track, output_file, output_format, timezone_offset, gps_extensions)
+    
+    if simplify:
+        size = os.path.getsize(output_file)
+        if original_size is None:
+            log.info("%s size reduced from about %d to %d bytes", output_format.upper(),
+                     size * original_points // max(track.point_count, 1), size)
+        else:
+            log.info("%s size reduced from %d to %d bytes", output_format.upper(), original_size, size)
+    log.info("Conversion completed successfully. The %s file is saved to %s", output_format.upper(), output_file)
+    return output_file
 
 def process_track(url, timezone_offset=0, output_dir=None):
     """Process a single track URL and return the output filename."""
+    from huabei_api import fetch_track_data
+    
     try:
         # Extract UUID from URL
-        track_uuid = extract_track_uuid(url)
-        print(f"Extracted track UUID: {track_uuid}")
+        with span('url_parse'):
+            track_uuid = extract_track_uuid(url)
+        log.info("Extracted track UUID: %s", track_uuid)
         
-        print(f"Fetching track data...")
+        log.info("Fetching track data...")
         track_data = fetch_track_data(track_uuid)
         
-        # Generate default filename based on date and resort
-        output_file = get_default_filename(track_data)
-        
-        # If output directory is specified, prepend it to the filename
-        if output_dir:
-            output_file = os.path.join(output_dir, output_file)
-        
-        print(f"Converting to GPX format with timezone offset: {timezone_offset} hours...")
-        gpx_tree = create_gpx(track_data, timezone_offset)
-        
-        print(f"Saving to {output_file}...")
-        save_gpx(gpx_tree, output_file)
-        
-        print(f"Conversion completed successfully. The GPX file is saved to {output_file}")
-        return output_file
+        return convert_track(track_data, timezone_offset, output_dir)
     
     except Exception as e:
-        print(f"Error processing {url}: {str(e)}")
+        log.error("Error processing %s: %s", url, e)
         return None
 
-def handle_duplicate_filenames(files):
-    """Handle duplicate filenames by adding sequential numbers."""
-    # Group files by base filename
-    filename_groups = {}
-    for file in files:
-        if file:  # Skip None values
-            base_name = os.path.splitext(file)[0]
-            if base_name not in filename_groups:
-                filename_groups[base_name] = []
-            filename_groups[base_name].append(file)
-    
-    # Rename files in groups with more than one file
-    for base_name, group in filename_groups.items():
-        if len(group) > 1:
-            for i, file in enumerate(group, 1):
-                new_name = f"{base_name}_{i}.gpx"
-                if file != new_name:  # Only rename if the name is different
-                    os.rename(file, new_name)
-                    print(f"Renamed {file} to {new_name}")
-
-def main():
-    parser = argparse.ArgumentParser(description='Convert Huabei ski tracks to GPX format')
-    parser.add_argument('urls', nargs='+', help='Huabei shared URLs')
-    parser.add_argument('-o', '--output-dir', help='Output directory for GPX files')
+def fetch_urls(urls, max_workers=None, offline=False, stream=None):
+    """Fetch the tracks behind several URLs concurrently.
+
+    Returns a list of (track_data, error_message) in input order; track_data
+    is None if the URL failed. max_workers and stream default to huabei_api's;
+    streamed tracks come back as a Track rather than the raw dict.
+    """
+    from huabei_api import DEFAULT_WORKERS, fetch_tracks
+    
+    track_uuids = {}
+    errors = {}
+    for url in urls:
+        try:
+            with span('url_parse'):
+                track_uuids[url] = extract_track_uuid(url)
+        except ValueError as e:
+            log.error("Error processing %s: %s", url, e)
+            errors[url] = str(e)
+    
+    log.info("Fetching %d tracks...", len(track_uuids))
+    fetched = dict(zip(track_uuids, fetch_tracks(list(track_uuids.values()), max_workers or DEFAULT_WORKERS,
+                                                 offline=offline, stream=stream)))
+    
+    results = []
+    for url in urls:
+        if url in errors:
+            results.append((None, errors[url]))
+        elif isinstance(fetched[url], Exception):
+            log.error("Error processing %s: %s", url, fetched[url])
+            results.append((None, str(fetched[url])))
+        else:
+            results.append((fetched[url], None))
+    return results
+
+def unique_filenames(filenames, number_format='_{}', always_number=False):
+    """Make a batch of output filenames collision-free.
+
+    Names that occur more than once (or every name, with always_number) get
+    their sequence number inserted before the extension using number_format.
+    Numbered names never clash with a name that is kept as is. None entries
+    are passed through.
+    """
+    counts = {}
+    for filename in filenames:
+        if filename:
+            counts[filename] = counts.get(filename, 0) + 1
+    
+    # Names kept unchanged are reserved first so numbered names avoid them
+    used = set()
+    if not always_number:
+        used.update(filename for filename, count in counts.items() if count == 1)
+    
+    sequence = {}
+    result = []
+    for filename in filenames:
+        if not filename or (counts[filename] == 1 and not always_number):
+            result.append(filename)
+            continue
+        base_name, extension = os.path.splitext(filename)
+        while True:
+            sequence[filename] = sequence.get(filename, 0) + 1
+            candidate = f"{base_name}{number_format.format(sequence[filename])}{extension}"
+            if candidate not in used:
+                break
+        used.add(candidate)
+        result.append(candidate)
+    return result
+
+def plan_outputs(results, merge_by_day=False):
+    """Decide which fetched tracks go into which output file.
+
+    results are fetch_urls results. Returns (positions, track) pairs in order
+    of first appearance, where positions index into results. With
+    merge_by_day, tracks sharing a date and resort (the default filename) are
+    merged into one track; tracks missing either are never merged.
+    """
+    fetched = [(position, track_data) for position, (track_data, _) in enumerate(results)
+               if track_data is not None]
+    if not merge_by_day:
+        return [([position], track_data) for position, track_data in fetched]
+    
+    def day_key(item):
+        # Tracks whose date or resort is unknown could be from any day, so each stays on its own
+        position, track_data = item
+        try:
+            day = track_day(track_data)
+        except ValueError:
+            day = (None, None)
+        return day if all(day) else position
+    
+    groups = group_by_key(fetched, key=day_key)
+    return [([position for position, _ in items], merge_tracks([track_data for _, track_data in items]))
+            for _, items in groups]
+
+def process_tracks(urls, timezone_offset=0, output_dir=None, max_workers=None, offline=False,
+                   merge_by_day=False, stream=None, **options):
+    """Process several track URLs, fetching them concurrently.
+
+    Output names are resolved for the whole batch before anything is written,
+    so repeated date/resort names get _1, _2, ... suffixes without renaming;
+    with merge_by_day they are merged into one file instead. options are
+    passed on to convert_track. Yields (output_file, error_message) for each
+    URL in input order; output_file is None if the URL failed.
+    """
+    results = fetch_urls(urls, max_workers, offline, stream)
+    units = plan_outputs(results, merge_by_day)
+    output_format = options.get('output_format', 'gpx')
+    filenames = unique_filenames([with_extension(get_default_filename(track), output_format) for _, track in units])
+    unit_of = {position: index for index, (positions, _) in enumerate(units) for position in positions}
+    
+    converted = {}
+    for position, (track_data, error) in enumerate(results):
+        if track_data is None:
+            yield None, error
+            continue
+        index = unit_of[position]
+        # Merged URLs share one output, written when its first URL comes up
+        if index not in converted:
+            try:
+                converted[index] = (convert_track(units[index][1], timezone_offset, output_dir,
+                                                  filenames[index], **options), None)
+            except Exception as e:
+                log.error("Error processing %s: %s", filenames[index], e)
+                converted[index] = (None, str(e))
+        yield converted[index]
+
+# Saved API responses picked up from a directory given to convert-dir
+INPUT_PATTERNS = ('*.json', '*.json.gz')
+
+def available_cpus():
+    """Number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def find_input_files(sources, recursive=False):
+    """Expand directories and glob patterns into a sorted list of JSON files."""
+    input_files = set()
+    for source in sources:
+        if os.path.isdir(source):
+            for pattern in INPUT_PATTERNS:
+                input_files.update(glob.glob(os.path.join(source, '**' if recursive else '', pattern),
+                                             recursive=recursive))
+        else:
+            input_files.update(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+    return sorted(input_files)
+
+def output_filenames(input_files, extension='.gpx'):
+    """Name each output after its input file, numbering repeated names in input order."""
+    names = []
+    for input_file in input_files:
+        name = os.path.basename(input_file)
+        for suffix in ('.gz', '.json'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        names.append(f"{name}{extension}")
+    return unique_filenames(names)
+
+# Kept in a convert-dir output directory: the conversion options of each output
+CONVERT_MANIFEST = '.huabei-convert.json'
+
+def options_key(options):
+    """Identify the convert_track options (output_format, simplify, ...) an output is written with."""
+    return result_key([], **options)
+
+def load_manifest(output_dir):
+    """The {output filename: options_key} manifest of a directory; empty if there is none."""
+    try:
+        with open(os.path.join(output_dir, CONVERT_MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def save_manifest(output_dir, manifest):
+    """Replace a directory's manifest atomically."""
+    fd, temp_file = tempfile.mkstemp(dir=output_dir, prefix=CONVERT_MANIFEST, suffix='.part')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_file, os.path.join(output_dir, CONVERT_MANIFEST))
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+def is_up_to_date(input_file, output_file, key=None, manifest=None):
+    """True if output_file exists, is not older than input_file and was written with options key.
+
+    key and manifest come from options_key and load_manifest; without them
+    only the modification times are compared.
+    """
+    if manifest is not None and manifest.get(os.path.basename(output_file)) != key:
+        return False
+    try:
+        return os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+    except OSError:
+        return False
+
+def convert_file(task):
+    """Process pool worker: convert one saved API response.
+
+    task is (input_file, output_file, options), options being convert_track
+    keyword arguments. Returns (input_file, output_file, points, error).
+    """
+    input_file, output_file, options = task
+    try:
+        track = load_track_file(input_file)
+        convert_track(track, output_dir=os.path.dirname(output_file), filename=os.path.basename(output_file),
+                      **options)
+    except Exception as e:
+        log.error("Error processing %s: %s", input_file, e)
+        return input_file, None, 0, str(e)
+    return input_file, output_file, track.point_count, None
+
+def _init_worker(log_level, log_format):
+    # Per-track INFO lines from thousands of files are noise; keep warnings and DEBUG
+    level = log_level if logging.getLevelName(log_level) == logging.DEBUG else 'WARNING'
+    configure_logging(level, log_format, sys.stdout)
+
+def convert_files(input_files, output_dir, workers=None, force=False, log_level='INFO', log_format='plain',
+                  **options):
+    """Convert saved API responses to output files on a process pool.
+
+    Outputs are named after their inputs (see output_filenames) and inputs
+    whose output is up to date are skipped unless force is set. An output
+    is only up to date if the directory's CONVERT_MANIFEST says it was
+    written with the same options, so changing the format, timezone or
+    simplification converts everything again. workers defaults to the
+    available CPUs. Yields (input_file, output_file, None, None) for each
+    skipped file first, then (input_file, output_file, points, error) for
+    each converted file in input order.
+    """
+    tasks = []
+    extension = get_output_format(options.get('output_format', 'gpx')).extension
+    key = options_key(options)
+    manifest = load_manifest(output_dir)
+    for input_file, filename in zip(input_files, output_filenames(input_files, extension)):
+        output_file = os.path.join(output_dir, filename)
+        if not force and is_up_to_date(input_file, output_file, key, manifest):
+            yield input_file, output_file, None, None
+        else:
+            tasks.append((input_file, output_file, options))
+    
+    def recorded(results):
+        # Saved even if the run stops early, so an interrupted run keeps what it converted
+        try:
+            for result in results:
+                output_file = result[1]
+                if output_file:
+                    manifest[os.path.basename(output_file)] = key
+                yield result
+        finally:
+            if tasks:
+                save_manifest(output_dir, manifest)
+    
+    workers = min(workers or available_cpus(), len(tasks))
+    if workers <= 1:
+        yield from recorded(map(convert_file, tasks))
+        return
+    
+    # Hand out several files at a time so small tracks do not wait on IPC
+    chunksize = max(1, min(16, len(tasks) // (workers * 4)))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(log_level, log_format)) as executor:
+        yield from recorded(executor.map(convert_file, tasks, chunksize=chunksize))
+
+def _add_conversion_arguments(parser):
+    """Options shared by URL conversion and convert-dir."""
     parser.add_argument('-t', '--timezone', type=int, default=0, 
                       help='Timezone offset in hours (e.g., -7 for Mountain Time, 8 for China Standard Time)')
+    parser.add_argument('--format', dest='output_format', choices=OUTPUT_FORMATS, default='gpx',
+                      help='Output format: GPX, Garmin FIT activity, GeoJSON or CSV (default: gpx)')
+    parser.add_argument('--gps-extensions', action='store_true',
+                      help='Add computed speed/azimuth (<gte:gps>) to every point so Slopes does not overstate speed')
+    parser.add_argument('--simplify', type=float, metavar='METRES',
+                      help='Drop points that deviate less than this many metres from the simplified track')
+    parser.add_argument('--simplify-method', choices=METHODS, default='dp',
+                      help='Simplification algorithm: Douglas-Peucker (dp) or Visvalingam-Whyatt (vw)')
+    parser.add_argument('--log-level', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), type=str.upper,
+                      help='Logging level (default: $HUABEI_LOG_LEVEL or INFO); DEBUG adds per-run and timing lines')
+    parser.add_argument('--log-format', choices=LOG_FORMATS,
+                      help='Log line format (default: $HUABEI_LOG_FORMAT or plain)')
+
+def _configure_cli_logging(args):
+    args.log_level = args.log_level or os.environ.get('HUABEI_LOG_LEVEL', 'INFO').upper()
+    args.log_format = args.log_format or os.environ.get('HUABEI_LOG_FORMAT', 'plain')
+    configure_logging(args.log_level, args.log_format, sys.stdout)
+
+def convert_dir_main(argv):
+    parser = argparse.ArgumentParser(prog='converter_gpx.py convert-dir',
+                                     description='Convert saved Huabei API responses (JSON files) to GPX in parallel')
+    parser.add_argument('sources', nargs='+', help='Directories of .json/.json.gz files or glob patterns')
+    parser.add_argument('-o', '--output-dir', default='.', help='Output directory for GPX files (default: .)')
+    parser.add_argument('-j', '--jobs', type=int, default=available_cpus(),
+                      help='Number of worker processes (default: available CPUs)')
+    parser.add_argument('-r', '--recursive', action='store_true', help='Also search subdirectories')
+    parser.add_argument('-f', '--force', action='store_true',
+                      help='Convert inputs even if their output is newer than them and has the same options')
+    _add_conversion_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    _configure_cli_logging(args)
+    
+    input_files = find_input_files(args.sources, args.recursive)
+    if not input_files:
+        parser.error('no JSON files found')
+    os.makedirs(args.output_dir, exist_ok=True)
+    
+    start = time.perf_counter()
+    converted = skipped = failed = points = output_bytes = 0
+    for _, output_file, point_count, error in convert_files(
+            input_files, args.output_dir, args.jobs, args.force, args.log_level, args.log_format,
+            timezone_offset=args.timezone, gps_extensions=args.gps_extensions, simplify=args.simplify,
+            simplify_method=args.simplify_method, output_format=args.output_format):
+        if error:
+            failed += 1
+        elif point_count is None:
+            skipped += 1
+        else:
+            converted += 1
+            points += point_count
+            output_bytes += os.path.getsize(output_file)
+    seconds = time.perf_counter() - start
     
-    args = parser.parse_args()
+    log.info("Converted %d, skipped %d up-to-date and failed %d of %d files in %.1fs",
+             converted, skipped, failed, len(input_files), seconds)
+    if converted and seconds > 0:
+        log.info("Throughput: %.1f files/s, %.0f points/s, %.1f MB/s of output with %d workers",
+                 converted / seconds, points / seconds, output_bytes / seconds / 1e6,
+                 min(args.jobs, converted + failed))
+    return 1 if failed else 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'convert-dir':
+        return convert_dir_main(argv[1:])
+    
+    parser = argparse.ArgumentParser(description='Convert Huabei ski tracks to GPX, FIT, GeoJSON or CSV',
+                                     epilog='Saved API responses are converted with: %(prog)s convert-dir DIR')
+    parser.add_argument('urls', nargs='+', help='Huabei shared URLs')
+    parser.add_argument('-o', '--output-dir', help='Output directory for converted files')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of tracks to fetch concurrently (default: 16)')
+    parser.add_argument('--cache-dir', help='Directory for cached API responses')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write cached API responses')
+    parser.add_argument('--offline', action='store_true',
+                      help='Only use cached API responses, never the network')
+    parser.add_argument('--merge-by-day', action='store_true',
+                      help='Merge tracks from the same day and resort into one time-ordered GPX file')
+    parser.add_argument('--stream', action='store_true',
+                      help='Decode API responses while they download, which needs far less memory for long tracks '
+                           '(default: $HUABEI_API_STREAM)')
+    _add_conversion_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    _configure_cli_logging(args)
+    
+    from huabei_api import get_cache, set_cache
+    
+    if args.offline and args.no_cache:
+        parser.error('--offline needs the cache, it cannot be combined with --no-cache')
+    if args.no_cache:
+        set_cache(None)
+    elif args.cache_dir:
+        set_cache(TrackCache(args.cache_dir))
     
     # Create output directory if it doesn't exist
     if args.output_dir and not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
     
     # Process all tracks
-    output_files = []
-    for url in args.urls:
-        output_file = process_track(url, args.timezone, args.output_dir)
-        if output_file:
-            output_files.append(output_file)
-    
-    # Handle duplicate filenames
-    handle_duplicate_filenames(output_files)
+    results = process_tracks(args.urls, args.timezone, args.output_dir, args.jobs, args.offline,
+                             args.merge_by_day, args.stream or None, gps_extensions=args.gps_extensions, simplify=args.simplify,
+                             simplify_method=args.simplify_method, output_format=args.output_format)
+    output_files = [output_file for output_file, _ in results if output_file]
+    
+    cache = get_cache()
+    if cache is not None:
+        stats = cache.stats()
+        log.info("Cache: %d hits, %d misses", stats['hits'], stats['misses'])
+    
+    log.info("Converted %d of %d tracks into %d files", len(output_files), len(args.urls), len(set(output_files)))
     
     return 0
 
@@ -0,0 +1,96 @@
+"""Merge several recordings of one ski day into a single time-ordered track."""
+import heapq
+import logging
+
+from instrumentation import span
+from track_model import Track, load_track, subset_run
+
+INF = float('inf')
+
+# Statistics of a recording in data.track and how a day's recordings combine them
+MERGED_STATS = {
+    'top_speed_km_per_hour': max,
+    'max_altitude_meter': max,
+    'max_slopeangle': max,
+    'min_altitude_meter': min,
+    'distance_traveled_meter': sum,
+    'ski_distance_meter': sum,
+    'vertical_distance_meter': sum,
+    'duration_second': sum,
+    'fall_down_count': sum,
+    'calorie': sum,
+}
+
+log = logging.getLogger(__name__)
+
+def run_start(run):
+    """Time of the first timed point of a run, or infinity if it has none."""
+    for t in run.time:
+        if t == t:
+            return t
+    return INF
+
+def group_by_key(items, key):
+    """Group items by key(item), keeping groups in order of first appearance.
+
+    Returns a list of (key, [item, ...]) pairs.
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return list(groups.items())
+
+def iter_merged_runs(tracks):
+    """Yield the runs of several tracks k-way merged by start time.
+
+    Points at or before the last time already emitted are overlap between
+    recordings and are dropped; runs left empty are skipped. Runs are yielded
+    as they are, and only a run trimmed for overlap is copied.
+    """
+    streams = [sorted(track.runs, key=run_start) for track in tracks]
+    last_time = -INF
+    for run in heapq.merge(*streams, key=run_start):
+        # NaN times compare False and are kept
+        keep = [i for i, t in enumerate(run.time) if not t <= last_time]
+        if not keep:
+            continue
+        if len(keep) < len(run):
+            run = subset_run(run, keep)
+        last_time = max([last_time] + [t for t in run.time if t == t])
+        yield run
+
+def merge_metadata(tracks, earliest):
+    """The metadata of earliest with its MERGED_STATS combined across all tracks.
+
+    Only recordings that report a statistic take part in it, and one none of
+    them report is left out as before. Sums count the time and distance of
+    overlapping recordings twice.
+    """
+    data = dict(earliest.metadata.get('data') or {})
+    track_info = dict(data.get('track') or {})
+    for field, combine in MERGED_STATS.items():
+        values = [((track.metadata.get('data') or {}).get('track') or {}).get(field) for track in tracks]
+        values = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        if values:
+            track_info[field] = combine(values)
+    data['track'] = track_info
+    return dict(earliest.metadata, data=data)
+
+def merge_tracks(tracks):
+    """Merge parsed or raw tracks into one Track named after the earliest recording.
+
+    Every recording is parsed whole, and the merged Track lists all of the
+    day's runs, because the writers read a Track's runs more than once (the
+    track's top speed is needed before its first point is written). The
+    merged runs are the recordings' own, so merging only adds copies of the
+    runs trimmed for overlap. Statistics such as the top speed cover every
+    recording (see merge_metadata).
+    """
+    tracks = [load_track(track) for track in tracks]
+    if len(tracks) == 1:
+        return tracks[0]
+    earliest = min(tracks, key=lambda track: min((run_start(run) for run in track.runs), default=INF))
+    with span('merge', recordings=len(tracks)):
+        merged = Track(merge_metadata(tracks, earliest), list(iter_merged_runs(tracks)))
+    log.info("Merged %d recordings into %d runs with %d points", len(tracks), len(merged.runs), merged.point_count)
+    return merged
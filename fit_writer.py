@@ -0,0 +1,264 @@
+"""Garmin FIT activity encoder: one record per point and one lap per run.
+
+The file is produced in chunks like iter_gpx. Every message has a fixed
+size, so the data size in the header is known before the first run is
+encoded, and the CRC is carried along as the chunks are yielded.
+"""
+import math
+import struct
+from itertools import accumulate
+
+from instrumentation import timed_iter
+from kinematics import run_kinematics, segment_kinematics, track_top_speed
+from track_model import load_track
+
+FIT_EPOCH = 631065600  # 1989-12-31T00:00:00Z in Unix seconds
+PROTOCOL_VERSION = 0x20  # 2.0
+PROFILE_VERSION = 2132  # 21.32
+SEMICIRCLES = 2 ** 31 / 180  # per degree
+
+# Base types: (number, struct format, invalid value, lowest valid, highest valid)
+ENUM = (0x00, 'B', 0xFF, 0, 0xFE)
+UINT8 = (0x02, 'B', 0xFF, 0, 0xFE)
+UINT16 = (0x84, 'H', 0xFFFF, 0, 0xFFFE)
+SINT32 = (0x85, 'i', 0x7FFFFFFF, -0x80000000, 0x7FFFFFFE)
+UINT32 = (0x86, 'I', 0xFFFFFFFF, 0, 0xFFFFFFFE)
+
+# Values of the enums used below
+FILE_ACTIVITY = 4
+MANUFACTURER_DEVELOPMENT = 255
+SPORT_ALPINE_SKIING = 13
+EVENT_TIMER, EVENT_SESSION, EVENT_LAP, EVENT_ACTIVITY = 0, 8, 9, 26
+EVENT_TYPE_START, EVENT_TYPE_STOP, EVENT_TYPE_STOP_ALL = 0, 1, 4
+ACTIVITY_MANUAL = 0
+SESSION_TRIGGER_ACTIVITY_END = 0
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC_TABLE = _crc_table()
+
+def fit_crc(data, crc=0):
+    """Continue the FIT CRC-16 (CRC-16/ARC) of the bytes before data."""
+    table = _CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+def _valid(value, base_type):
+    """value as a FIT field value, or the base type's invalid value if it is missing or out of range."""
+    _, _, invalid, low, high = base_type
+    if value is None or value != value:
+        return invalid
+    value = round(value)
+    return value if low <= value <= high else invalid
+
+def _scaled(value, scale, offset=0):
+    return None if value is None or value != value else (value + offset) * scale
+
+def _timestamp(epoch):
+    return None if epoch is None or epoch != epoch else epoch - FIT_EPOCH
+
+class Message:
+    """A FIT message type: its definition record and a packer for its data records.
+
+    fields are (name, field number, base type); values are passed to pack()
+    by name already scaled, and missing ones are written as invalid.
+    """
+
+    def __init__(self, local_type, global_number, fields):
+        self.local_type = local_type
+        self.fields = fields
+        self.struct = struct.Struct('<B' + ''.join(base_type[1] for _, _, base_type in fields))
+        self.definition = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, global_number, len(fields)) + b''.join(
+            struct.pack('<BBB', number, struct.calcsize(base_type[1]), base_type[0]) for _, number, base_type in fields)
+
+    @property
+    def size(self):
+        return self.struct.size
+
+    def pack(self, **values):
+        return self.struct.pack(self.local_type, *(_valid(values.get(name), base_type)
+                                                   for name, _, base_type in self.fields))
+
+FILE_ID = Message(0, 0, (
+    ('type', 0, ENUM), ('manufacturer', 1, UINT16), ('product', 2, UINT16), ('time_created', 4, UINT32)))
+EVENT = Message(1, 21, (
+    ('timestamp', 253, UINT32), ('event', 0, ENUM), ('event_type', 1, ENUM), ('event_group', 4, UINT8)))
+RECORD = Message(2, 20, (
+    ('timestamp', 253, UINT32), ('position_lat', 0, SINT32), ('position_long', 1, SINT32),
+    ('altitude', 2, UINT16), ('speed', 6, UINT16), ('distance', 5, UINT32)))
+LAP = Message(3, 19, (
+    ('message_index', 254, UINT16), ('timestamp', 253, UINT32), ('event', 0, ENUM), ('event_type', 1, ENUM),
+    ('start_time', 2, UINT32), ('start_position_lat', 3, SINT32), ('start_position_long', 4, SINT32),
+    ('end_position_lat', 5, SINT32), ('end_position_long', 6, SINT32), ('total_elapsed_time', 7, UINT32),
+    ('total_timer_time', 8, UINT32), ('total_distance', 9, UINT32), ('avg_speed', 13, UINT16),
+    ('max_speed', 14, UINT16), ('total_ascent', 21, UINT16), ('total_descent', 22, UINT16), ('sport', 25, ENUM)))
+SESSION = Message(4, 18, (
+    ('message_index', 254, UINT16), ('timestamp', 253, UINT32), ('event', 0, ENUM), ('event_type', 1, ENUM),
+    ('start_time', 2, UINT32), ('start_position_lat', 3, SINT32), ('start_position_long', 4, SINT32),
+    ('sport', 5, ENUM), ('total_elapsed_time', 7, UINT32), ('total_timer_time', 8, UINT32),
+    ('total_distance', 9, UINT32), ('avg_speed', 14, UINT16), ('max_speed', 15, UINT16),
+    ('total_ascent', 22, UINT16), ('total_descent', 23, UINT16), ('first_lap_index', 25, UINT16),
+    ('num_laps', 26, UINT16), ('trigger', 28, ENUM)))
+ACTIVITY = Message(5, 34, (
+    ('timestamp', 253, UINT32), ('total_timer_time', 0, UINT32), ('num_sessions', 1, UINT16), ('type', 2, ENUM),
+    ('event', 3, ENUM), ('event_type', 4, ENUM), ('local_timestamp', 5, UINT32)))
+MESSAGES = (FILE_ID, EVENT, RECORD, LAP, SESSION, ACTIVITY)
+
+def _recorded_points(run):
+    """Indices of the points that have a position and a time, the ones written as records."""
+    return [i for i, (lat, lon, epoch) in enumerate(zip(run.lat, run.lon, run.time))
+            if math.isfinite(lat) and math.isfinite(lon) and math.isfinite(epoch)]
+
+def _climb(eles):
+    """Total ascent and descent in metres over the elevations that are present."""
+    ascent = descent = 0.0
+    previous = None
+    for ele in eles:
+        if ele != ele:
+            continue
+        if previous is not None:
+            if ele > previous:
+                ascent += ele - previous
+            else:
+                descent += previous - ele
+        previous = ele
+    return ascent, descent
+
+def _finite_max(values):
+    return max((value for value in values if value == value), default=None)
+
+class _Totals:
+    """Lap or session summary values accumulated over runs."""
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.start_position = (None, None)
+        self.end_position = (None, None)
+        self.timer = 0.0
+        self.distance = 0.0
+        self.max_speed = None
+        self.ascent = 0.0
+        self.descent = 0.0
+
+    def add(self, other):
+        if self.start is None:
+            self.start = other.start
+            self.start_position = other.start_position
+        self.end = other.end
+        self.end_position = other.end_position
+        self.timer += other.timer
+        self.distance += other.distance
+        if other.max_speed is not None and (self.max_speed is None or other.max_speed > self.max_speed):
+            self.max_speed = other.max_speed
+        self.ascent += other.ascent
+        self.descent += other.descent
+
+    def summary(self):
+        """The fields lap and session messages share."""
+        return {
+            'timestamp': self.end,
+            'start_time': self.start,
+            'start_position_lat': self.start_position[0],
+            'start_position_long': self.start_position[1],
+            'total_elapsed_time': _scaled(self.end - self.start, 1000),
+            'total_timer_time': _scaled(self.timer, 1000),
+            'total_distance': _scaled(self.distance, 100),
+            'avg_speed': _scaled(self.distance / self.timer if self.timer > 0 else None, 1000),
+            'max_speed': _scaled(self.max_speed, 1000),
+            'total_ascent': self.ascent,
+            'total_descent': self.descent,
+            'sport': SPORT_ALPINE_SKIING,
+        }
+
+def _encode_run(run, indices, speeds, distance_offset):
+    """Encode one run's records and return (bytes, totals)."""
+    lats = [run.lat[i] for i in indices]
+    lons = [run.lon[i] for i in indices]
+    times = [run.time[i] - FIT_EPOCH for i in indices]
+    eles = [run.ele[i] for i in indices]
+    speeds = [speeds[i] for i in indices]
+    distances, _, _ = segment_kinematics(lats, lons, times)
+    distances = list(accumulate(distances, initial=distance_offset))
+
+    pack = RECORD.struct.pack
+    records = b''.join(
+        pack(RECORD.local_type, _valid(epoch, UINT32), _valid(lat * SEMICIRCLES, SINT32),
+             _valid(lon * SEMICIRCLES, SINT32), _valid(_scaled(ele, 5, 500), UINT16),
+             _valid(_scaled(speed, 1000), UINT16), _valid(distance * 100, UINT32))
+        for epoch, lat, lon, ele, speed, distance in zip(times, lats, lons, eles, speeds, distances))
+
+    totals = _Totals()
+    totals.start, totals.end = times[0], times[-1]
+    totals.start_position = (lats[0] * SEMICIRCLES, lons[0] * SEMICIRCLES)
+    totals.end_position = (lats[-1] * SEMICIRCLES, lons[-1] * SEMICIRCLES)
+    totals.timer = times[-1] - times[0]
+    totals.distance = distances[-1] - distance_offset
+    totals.max_speed = _finite_max(speeds)
+    totals.ascent, totals.descent = _climb(eles)
+    return records, totals
+
+def iter_fit(track_data, timezone_offset=0, gps_extensions=False):
+    """Yield a FIT activity file for the track in chunks, one per run.
+
+    Points need a position and a time to become records; each run with any
+    is a lap, with the timer stopped between runs. Speed is speed_arr, or
+    the blended GPS speed with gps_extensions (see run_kinematics); record
+    distance only counts the runs, not the lifts between them.
+    timezone_offset sets the activity's local time. Time spent encoding is
+    recorded as the serialize stage.
+    """
+    return timed_iter('serialize', _iter_fit(track_data, timezone_offset, gps_extensions), writer='fit')
+
+def _iter_fit(track_data, timezone_offset, gps_extensions):
+    track = load_track(track_data)
+    recorded = [(run, indices) for run in track.runs for indices in [_recorded_points(run)] if indices]
+    if not recorded:
+        raise ValueError("No points with a position and time to write as FIT")
+    top_speed = track_top_speed(track)
+
+    data_size = (sum(len(message.definition) for message in MESSAGES) + FILE_ID.size + SESSION.size
+                 + ACTIVITY.size + sum(2 * EVENT.size + len(indices) * RECORD.size + LAP.size
+                                       for _, indices in recorded))
+    header = struct.pack('<BBHI4s', 14, PROTOCOL_VERSION, PROFILE_VERSION, data_size, b'.FIT')
+    header += struct.pack('<H', fit_crc(header))
+    first_time = recorded[0][0].time[recorded[0][1][0]] - FIT_EPOCH
+    chunk = b''.join([header] + [message.definition for message in MESSAGES] + [FILE_ID.pack(
+        type=FILE_ACTIVITY, manufacturer=MANUFACTURER_DEVELOPMENT, product=0, time_created=first_time)])
+    crc = fit_crc(chunk)
+    yield chunk
+
+    session = _Totals()
+    for lap_index, (run, indices) in enumerate(recorded):
+        if gps_extensions:
+            speeds, _ = run_kinematics(run, top_speed)
+        else:
+            speeds = [speed / 3.6 for speed in run.speed]  # speed_arr is km/h
+        records, lap = _encode_run(run, indices, speeds, session.distance)
+        session.add(lap)
+        chunk = b''.join((
+            EVENT.pack(timestamp=lap.start, event=EVENT_TIMER, event_type=EVENT_TYPE_START, event_group=0),
+            records,
+            EVENT.pack(timestamp=lap.end, event=EVENT_TIMER, event_type=EVENT_TYPE_STOP_ALL, event_group=0),
+            LAP.pack(message_index=lap_index, event=EVENT_LAP, event_type=EVENT_TYPE_STOP,
+                     end_position_lat=lap.end_position[0], end_position_long=lap.end_position[1],
+                     **lap.summary()),
+        ))
+        crc = fit_crc(chunk, crc)
+        yield chunk
+
+    chunk = SESSION.pack(message_index=0, event=EVENT_SESSION, event_type=EVENT_TYPE_STOP, first_lap_index=0,
+                         num_laps=len(recorded), trigger=SESSION_TRIGGER_ACTIVITY_END, **session.summary())
+    chunk += ACTIVITY.pack(timestamp=session.end, total_timer_time=_scaled(session.timer, 1000), num_sessions=1,
+                           type=ACTIVITY_MANUAL, event=EVENT_ACTIVITY, event_type=EVENT_TYPE_STOP,
+                           local_timestamp=session.end + timezone_offset * 3600)
+    crc = fit_crc(chunk, crc)
+    yield chunk + struct.pack('<H', crc)
@@ -0,0 +1,261 @@
+"""Client for the Huabei (fenxuekeji) track API."""
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import REGISTRY, span
+from throttle import RateLimiter, SingleFlight
+from track_cache import TrackCache
+from track_stream import DEFAULT_CHUNK_BYTES, TrackStreamDecoder, load_track_stream
+
+# Can be pointed at a local stub server, e.g. http://127.0.0.1:8000/api
+API_BASE = os.environ.get('HUABEI_API_BASE', 'https://api.fenxuekeji.com/api')
+ENDPOINTS = ('tracks', 'skis')
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5  # seconds, doubled after every retry
+DEFAULT_WORKERS = 16
+# Decode responses incrementally into a Track instead of with response.json()
+DEFAULT_STREAM = os.environ.get('HUABEI_API_STREAM', '0') not in ('', '0')
+
+# Limits on upstream requests shared by every fetch in this process
+DEFAULT_RATE = float(os.environ.get('HUABEI_API_RATE', 10))  # requests per second, 0 for no limit
+DEFAULT_BURST = int(os.environ.get('HUABEI_API_BURST', 20))
+DEFAULT_CONCURRENCY = int(os.environ.get('HUABEI_API_CONCURRENCY', DEFAULT_WORKERS))
+DEFAULT_WAIT_TIMEOUT = float(os.environ.get('HUABEI_API_WAIT_TIMEOUT', 30))  # seconds
+
+# Upstream responses worth retrying; anything else is final
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+# Response cache shared by all fetches; False until first configured
+_cache = False
+_cache_lock = threading.Lock()
+
+# Upstream rate limiter; False until first configured
+_limiter = False
+_limiter_lock = threading.Lock()
+
+# Fetches in flight, shared by concurrent requests for the same UUID
+_flights = SingleFlight()
+
+# Endpoint that last served each UUID style, tried first next time
+_preferred_endpoints = {}
+_preferred_lock = threading.Lock()
+
+log = logging.getLogger(__name__)
+
+FETCH_REQUESTS = REGISTRY.counter(
+    'huabei_fetch_requests_total', 'Upstream API requests by endpoint and HTTP status.', ('endpoint', 'status'))
+FETCH_RETRIES = REGISTRY.counter('huabei_fetch_retries_total', 'Upstream API retries by endpoint.', ('endpoint',))
+CACHE_LOOKUPS = REGISTRY.counter('huabei_cache_lookups_total', 'Response cache lookups by result.', ('result',))
+
+class TrackFetchError(ValueError):
+    """Raised when neither endpoint returns the track."""
+
+def get_session():
+    """Return the shared keep-alive session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=DEFAULT_WORKERS * 2)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+def get_cache():
+    """Return the shared response cache, or None if caching is disabled."""
+    global _cache
+    with _cache_lock:
+        if _cache is False:
+            _cache = TrackCache()
+        return _cache
+
+def set_cache(cache):
+    """Replace the shared response cache; None disables caching."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+def uuid_style(track_uuid):
+    """Classify a UUID by shape so that similar UUIDs share an endpoint preference."""
+    return (len(track_uuid), track_uuid.count('-'))
+
+def endpoint_order(track_uuid):
+    """Return the endpoints to try for a UUID, the last one that worked for its style first."""
+    with _preferred_lock:
+        preferred = _preferred_endpoints.get(uuid_style(track_uuid))
+    if preferred is None:
+        return ENDPOINTS
+    return (preferred,) + tuple(e for e in ENDPOINTS if e != preferred)
+
+def get_limiter():
+    """Return the shared upstream rate limiter, or None if requests are not limited."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is False:
+            _limiter = RateLimiter(DEFAULT_RATE or None, DEFAULT_BURST, DEFAULT_CONCURRENCY or None,
+                                   DEFAULT_WAIT_TIMEOUT)
+        return _limiter
+
+def set_limiter(limiter):
+    """Replace the shared upstream rate limiter; None removes the limits."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+
+def _remember_endpoint(track_uuid, endpoint):
+    with _preferred_lock:
+        _preferred_endpoints[uuid_style(track_uuid)] = endpoint
+
+def _get_with_retry(url, endpoint, session, timeout, retries, backoff, stream=False):
+    """GET a URL, retrying connection errors and transient statuses with exponential backoff.
+
+    Every attempt waits for the shared rate limiter; with stream=True the body
+    is read by the caller after the limiter has let go. Returns (response,
+    retries used).
+    """
+    limiter = get_limiter()
+    for attempt in range(retries + 1):
+        if attempt:
+            FETCH_RETRIES.inc(endpoint=endpoint)
+        try:
+            if limiter is None:
+                response = session.get(url, timeout=timeout, stream=stream)
+            else:
+                with limiter.acquire():
+                    response = session.get(url, timeout=timeout, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            FETCH_REQUESTS.inc(endpoint=endpoint, status='error')
+            if attempt == retries:
+                raise
+            log.warning("Retrying %s after %s", url, type(e).__name__)
+        else:
+            FETCH_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response, attempt
+            log.warning("Retrying %s after HTTP %s", url, response.status_code)
+            response.close()
+        time.sleep(backoff * (2 ** attempt))
+
+def fetch_track_data(track_uuid, session=None, timeout=DEFAULT_TIMEOUT,
+                     retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, offline=False, stream=None):
+    """Fetch track data from the Huabei API.
+
+    Track and ski UUIDs are served by different endpoints; the one that worked
+    last for this UUID style is tried first and the other is the fallback.
+    Responses are served from the shared cache when possible. With offline=True
+    the network is never used and a cache miss is an error.
+
+    With stream=True (default DEFAULT_STREAM) the response is decoded while it
+    downloads and a Track is returned instead of the raw dict; see
+    track_stream. Concurrent calls for the same UUID share one fetch and its result (the
+    same dict, which callers must not modify). Waiting on the rate limiter
+    or on the shared fetch for over DEFAULT_WAIT_TIMEOUT seconds raises
+    ThrottleTimeout.
+    """
+    if stream is None:
+        stream = DEFAULT_STREAM
+
+    def fetch():
+        with span('fetch', uuid=track_uuid) as fetch_span:
+            return _fetch_track_data(track_uuid, fetch_span, session, timeout, retries, backoff, offline, stream)
+
+    # The fetch in flight is bounded by its own timeouts, so waiters get the
+    # longest it can take plus the limiter wait
+    attempts = len(ENDPOINTS) * (retries + 1)
+    wait = DEFAULT_WAIT_TIMEOUT + attempts * sum(timeout if isinstance(timeout, tuple) else (timeout,))
+    return _flights.do((track_uuid, offline, stream), fetch, wait)
+
+def _fetch_track_data(track_uuid, fetch_span, session, timeout, retries, backoff, offline, stream):
+    cache = get_cache()
+    endpoints = endpoint_order(track_uuid)
+
+    if cache is not None:
+        content = cache.lookup(track_uuid, endpoints)
+        CACHE_LOOKUPS.inc(result='miss' if content is None else 'hit')
+        if content is not None:
+            fetch_span.set(source='cache')
+            if stream:
+                return load_track_stream([content])
+            with span('json_decode', bytes=len(content)):
+                return json.loads(content)
+
+    if offline:
+        raise TrackFetchError(f"Track {track_uuid} is not in the cache (offline mode)")
+
+    if session is None:
+        session = get_session()
+
+    status_code = None
+    total_retries = 0
+    for endpoint in endpoints:
+        url = f"{API_BASE}/{endpoint}/{track_uuid}"
+        response, used = _get_with_retry(url, endpoint, session, timeout, retries, backoff, stream)
+        total_retries += used
+        fetch_span.set(source='api', endpoint=endpoint, status=response.status_code, retries=total_retries)
+        if response.status_code == 200:
+            _remember_endpoint(track_uuid, endpoint)
+            if stream:
+                return _decode_stream(response, cache, endpoint, track_uuid)
+            with span('json_decode', bytes=len(response.content)):
+                track_data = response.json()
+            if cache is not None and _is_complete(track_data):
+                cache.put(endpoint, track_uuid, response.content)
+            return track_data
+        status_code = response.status_code
+        response.close()
+        log.debug("Track %s not found on /%s/ (HTTP %s)", track_uuid, endpoint, status_code)
+
+    raise TrackFetchError(f"Failed to fetch track data: {status_code}")
+
+def _decode_stream(response, cache, endpoint, track_uuid):
+    """Decode a streamed response into a Track, writing it to the cache as it arrives.
+
+    The cache entry is only kept if the whole response decodes to a track
+    with coordinates.
+    """
+    decoder = TrackStreamDecoder()
+    with contextlib.ExitStack() as stack:
+        stack.callback(response.close)
+        body = stack.enter_context(cache.writer(endpoint, track_uuid)) if cache is not None else None
+        for chunk in response.iter_content(DEFAULT_CHUNK_BYTES):
+            if body is not None:
+                body.write(chunk)
+            decoder.feed(chunk)
+        return decoder.close()
+
+def _is_complete(track_data):
+    """Only successful responses that carry coordinates are worth caching."""
+    data = track_data.get('data') if isinstance(track_data, dict) else None
+    return isinstance(data, dict) and bool(data.get('track_detail'))
+
+def fetch_tracks(track_uuids, max_workers=DEFAULT_WORKERS, **kwargs):
+    """Fetch several tracks concurrently over the shared session.
+
+    Returns a list in input order holding either the track data or the
+    exception raised while fetching it.
+    """
+    def fetch(track_uuid):
+        try:
+            return fetch_track_data(track_uuid, **kwargs)
+        except Exception as e:
+            return e
+
+    if not track_uuids:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(track_uuids))) as executor:
+        return list(executor.map(fetch, track_uuids))
@@ -0,0 +1,318 @@
+"""Logging setup, per-stage timing spans, Prometheus metrics and request profiling."""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+LOG_FORMATS = ('plain', 'text', 'json')
+# Upper bounds in seconds of the stage duration histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILE_MODES = ('cpu', 'memory')
+PROFILE_TOP = 30  # lines of a profile report
+
+log = logging.getLogger(__name__)
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def _record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+class KeyValueFormatter(logging.Formatter):
+    """Format a record with fmt and append the extra= fields as key=value pairs."""
+
+    def format(self, record):
+        message = super().format(record)
+        fields = _record_fields(record)
+        if fields:
+            message += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return message
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line, extra= fields included."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(_record_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def configure_logging(level=None, log_format=None, stream=None):
+    """Send log records to stream (stderr by default) at level in log_format.
+
+    level and log_format fall back to HUABEI_LOG_LEVEL and HUABEI_LOG_FORMAT,
+    then to INFO and 'text'. 'plain' is just the message and its fields,
+    'text' adds time, level and logger, 'json' writes one object per line.
+    """
+    level = level or os.environ.get('HUABEI_LOG_LEVEL', 'INFO')
+    log_format = log_format or os.environ.get('HUABEI_LOG_FORMAT', 'text')
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    elif log_format == 'plain':
+        formatter = KeyValueFormatter('%(message)s')
+    else:
+        formatter = KeyValueFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(formatter)
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+def _escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _label_string(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A monotonically increasing count per label combination."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _label_string(self.labelnames, key), value
+
+class Histogram:
+    """Observations counted into cumulative buckets per label combination."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in values:
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', _label_string(self.labelnames, key, [('le', bound)]), count
+            yield f'{self.name}_bucket', _label_string(self.labelnames, key, [('le', '+Inf')]), counts[-2]
+            yield f'{self.name}_sum', _label_string(self.labelnames, key), counts[-1]
+            yield f'{self.name}_count', _label_string(self.labelnames, key), counts[-2]
+
+class Registry:
+    """The metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Return the counter called name, creating it on first use."""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Return the histogram called name, creating it on first use."""
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'huabei_stage_duration_seconds', 'Time spent in each conversion stage.', ('stage', 'outcome'))
+
+def observe_stage(stage, seconds, outcome='ok', **fields):
+    """Record a stage duration in the histogram and log it at DEBUG with its fields."""
+    STAGE_SECONDS.observe(seconds, stage=stage, outcome=outcome)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('%s took %.4fs', stage, seconds,
+                  extra=dict(fields, stage=stage, seconds=round(seconds, 6), outcome=outcome))
+
+class Span:
+    """A timed stage; fields set while it runs are logged with its duration."""
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+        self.seconds = None
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+@contextmanager
+def span(stage, **fields):
+    """Time the enclosed block as stage; an exception is recorded as outcome=error."""
+    current = Span(stage, fields)
+    outcome = 'ok'
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        current.seconds = time.perf_counter() - start
+        observe_stage(stage, current.seconds, outcome, **current.fields)
+
+def timed_iter(stage, iterable, **fields):
+    """Yield from iterable, recording the time spent producing items as one stage.
+
+    Only time inside the iterable counts, not time the consumer spends between
+    items, so a lazily generated stream is not charged for what consumes it.
+    """
+    iterator = iter(iterable)
+    elapsed = 0.0
+    outcome = 'ok'
+    items = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            except BaseException:
+                outcome = 'error'
+                raise
+            finally:
+                elapsed += time.perf_counter() - start
+            items += 1
+            yield item
+    finally:
+        observe_stage(stage, elapsed, outcome, items=items, **fields)
+
+def _write_text(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+# cProfile and tracemalloc are process-wide, so one request is profiled at a time
+_profile_lock = threading.Lock()
+
+class RequestProfiler:
+    """Profile one request with cProfile ('cpu') or tracemalloc ('memory').
+
+    start() returns False when another request is already being profiled.
+    stop() logs the top entries and, with output_dir, saves the full profile.
+    cProfile only sees the thread that called start().
+    """
+
+    def __init__(self, mode, label, output_dir=None, top=PROFILE_TOP):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self.label = label
+        self.output_dir = output_dir
+        self.top = top
+        self._profile = None
+        self._started_tracing = False
+        self._start = None
+
+    def start(self):
+        if not _profile_lock.acquire(blocking=False):
+            return False
+        self._start = time.perf_counter()
+        if self.mode == 'cpu':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._profile = tracemalloc.take_snapshot()
+        return True
+
+    def stop(self):
+        """Finish profiling and return the report text."""
+        try:
+            seconds = time.perf_counter() - self._start
+            if self.mode == 'cpu':
+                self._profile.disable()
+                report = io.StringIO()
+                stats = pstats.Stats(self._profile, stream=report)
+                stats.sort_stats('cumulative').print_stats(self.top)
+                report = report.getvalue()
+                saved = self._save('prof', stats.dump_stats)
+            else:
+                _, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                if self._started_tracing:
+                    tracemalloc.stop()
+                lines = [f'peak traced memory: {peak / 1e6:.1f} MB']
+                lines += [str(stat) for stat in snapshot.compare_to(self._profile, 'lineno')[:self.top]]
+                report = '\n'.join(lines) + '\n'
+                saved = self._save('txt', lambda path: _write_text(path, report))
+        finally:
+            self._profile = None
+            _profile_lock.release()
+        log.info('%s profile of %s (%.3fs)\n%s', self.mode, self.label, seconds, report,
+                 extra={'profile': self.mode, 'saved_to': saved} if saved else {'profile': self.mode})
+        return report
+
+    def _save(self, extension, write):
+        if not self.output_dir:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', self.label).strip('_') or 'request'
+        path = os.path.join(self.output_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{self.mode}-{name}.{extension}')
+        write(path)
+        return path
@@ -0,0 +1,283 @@
+"""Background conversion jobs for the web interface."""
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 16
+DEFAULT_TTL = 3600  # seconds a finished job and its archive are kept
+DEFAULT_HEARTBEAT = 30  # seconds between status saves of unfinished jobs
+STALE_HEARTBEATS = 3  # missed heartbeats after which an unfinished job counts as abandoned
+ABANDONED_MESSAGE = '处理该任务的服务进程已退出，请重新提交'
+
+log = logging.getLogger(__name__)
+
+_JOB_ID = re.compile(r'[0-9a-f]+')
+
+def _process_alive(pid):
+    """True unless pid is known not to be a running process."""
+    if pid is None:
+        return False
+    if os.name == 'nt':
+        # os.kill would terminate the process; the heartbeat has to do
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity or draining."""
+
+class Job:
+    """A batch of URLs converted in the background into one archive."""
+
+    def __init__(self, urls, options, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.urls = urls
+        self.options = options
+        self.artifact_path = None
+        self.status_path = None
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # The process running the job, and when it last saved the job's status
+        self.owner = os.getpid()
+        self.updated_at = None
+        self._save_lock = threading.Lock()
+        # One entry per URL, updated by the worker as each one finishes
+        self.progress = [
+            {'url': url, 'status': 'pending', 'filename': None, 'error': None}
+            for url in urls
+        ]
+
+    def update(self, index, filename=None, error=None):
+        """Record the outcome of the URL at index."""
+        entry = self.progress[index]
+        entry['status'] = 'failed' if error else 'done'
+        entry['filename'] = filename
+        entry['error'] = error
+        self.save()
+
+    def save(self):
+        """Write the job's status to status_path, if it has one, for other processes to read."""
+        if self.status_path is None:
+            return
+        # Serialised so a heartbeat cannot replace a newer status with an older one
+        with self._save_lock:
+            self.updated_at = time.time()
+            state = dict(self.to_dict(), owner=self.owner)
+            # A temporary file of its own, so concurrent saves never write to the same one
+            fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(self.status_path),
+                                             prefix=os.path.basename(self.status_path) + '.', suffix='.part')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(state, f)
+                os.replace(temp_file, self.status_path)
+            except BaseException:
+                os.remove(temp_file)
+                raise
+
+    @classmethod
+    def load(cls, status_path, artifact_path):
+        """Read a job saved by another process; returns None if there is none."""
+        try:
+            with open(status_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls([entry['url'] for entry in state['progress']], {}, state['id'])
+        job.artifact_path = artifact_path
+        job.status = state['status']
+        job.error = state['error']
+        job.created_at = state['created_at']
+        job.finished_at = state['finished_at']
+        job.progress = state['progress']
+        job.owner = state.get('owner')
+        job.updated_at = state.get('updated_at')
+        return job
+
+    def abandoned(self, stale_after):
+        """True if the job is unfinished but its process has exited or not saved it for stale_after seconds."""
+        if self.finished_at is not None:
+            return False
+        if self.updated_at is None or time.time() - self.updated_at > stale_after:
+            return True
+        return not _process_alive(self.owner)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'updated_at': self.updated_at,
+            'completed': sum(1 for entry in self.progress if entry['status'] != 'pending'),
+            'total': len(self.progress),
+            'progress': [dict(entry) for entry in self.progress],
+        }
+
+class JobQueue:
+    """A bounded queue of jobs processed by a pool of worker threads.
+
+    handler(job) does the work and writes job.artifact_path; an exception
+    marks the job as failed. Finished jobs are dropped, along with their
+    archives, once they are older than ttl seconds.
+
+    Each job's status is also saved in artifact_dir, so server processes
+    sharing that directory (forked after the queue was made) can report and
+    serve each other's jobs. Unfinished jobs are saved every heartbeat
+    seconds; one whose process has exited or stopped saving it is reported
+    as failed, so submitting it again starts it over. drain() stops new
+    submissions and waits for the queued and running jobs.
+    """
+
+    def __init__(self, handler, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 ttl=DEFAULT_TTL, artifact_dir=None, heartbeat=DEFAULT_HEARTBEAT):
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.artifact_dir = artifact_dir or tempfile.mkdtemp(prefix='huabei-jobs-')
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self.draining = False
+
+    def _start(self):
+        # Workers start on first use so importing the app does not spawn threads
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, urls, job_id=None, **options):
+        """Enqueue a job and return it, or raise QueueFull.
+
+        If job_id names a job that is queued, running or done, that job is
+        returned instead of starting another; a failed or abandoned one is
+        replaced.
+        """
+        self.cleanup()
+        self._start()
+        with self._lock:
+            existing = (self._jobs.get(job_id) or self._load(job_id)) if job_id else None
+            if existing is not None and existing.status != 'failed':
+                return existing
+            if self.draining:
+                raise QueueFull("The server is shutting down, try again later")
+            job = Job(urls, options, job_id)
+            job.artifact_path = os.path.join(self.artifact_dir, f'{job.id}.zip')
+            job.status_path = os.path.join(self.artifact_dir, f'{job.id}.json')
+            self._jobs[job.id] = job
+        # Saved before a worker can pick the job up and save it too
+        job.save()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            os.remove(job.status_path)
+            raise QueueFull("Too many conversion jobs are waiting, try again later")
+        return job
+
+    def get(self, job_id):
+        """Return the job with this id, or None if it is unknown or expired."""
+        self.cleanup()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job or self._load(job_id)
+
+    def _load(self, job_id):
+        """The saved status of a job submitted to another process, or None."""
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        job = Job.load(os.path.join(self.artifact_dir, f'{job_id}.json'),
+                       os.path.join(self.artifact_dir, f'{job_id}.zip'))
+        if job is not None and job.abandoned(STALE_HEARTBEATS * self.heartbeat):
+            log.warning("Job %s was left %s by process %s", job.id, job.status, job.owner)
+            job.status = 'failed'
+            job.error = ABANDONED_MESSAGE
+            job.finished_at = job.updated_at or job.created_at
+        if job is not None and job.finished_at is not None and time.time() - job.finished_at > self.ttl:
+            return None
+        return job
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.status = 'running'
+                job.save()
+                self.handler(job)
+                job.status = 'done'
+            except Exception as e:
+                log.error("Job %s failed: %s", job.id, e)
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                job.finished_at = time.time()
+                try:
+                    job.save()
+                except OSError as e:
+                    log.error("Could not save the status of job %s: %s", job.id, e)
+                self._queue.task_done()
+
+    def _beat(self):
+        while True:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                unfinished = [job for job in self._jobs.values() if job.finished_at is None]
+            for job in unfinished:
+                try:
+                    job.save()
+                except OSError as e:
+                    log.error("Could not save the status of job %s: %s", job.id, e)
+
+    def drain(self, timeout):
+        """Refuse new jobs and wait up to timeout seconds for the rest; True if they all finished."""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def cleanup(self):
+        """Forget finished jobs older than the TTL and delete their archives."""
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished_at is not None and now - job.finished_at > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            for path in (job.artifact_path, job.status_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    def close(self):
+        """Delete the artifact directory."""
+        shutil.rmtree(self.artifact_dir, ignore_errors=True)
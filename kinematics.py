@@ -0,0 +1,100 @@
+"""Per-run speed and heading for the Slopes gte:gps GPX extension."""
+import math
+from array import array
+from itertools import accumulate
+
+NAN = float('nan')
+EARTH_RADIUS = 6371008.8  # metres
+
+DEFAULT_SMOOTHING = 5  # points in the centred moving average
+DEFAULT_API_WEIGHT = 0.5  # share of speed_arr in the blended speed
+MAX_SPEED = 40.0  # m/s; faster GPS segments are treated as jumps
+
+def _pairwise(values):
+    return values[:-1], values[1:]
+
+def segment_kinematics(lat, lon, time):
+    """Haversine distance (m), duration (s) and initial bearing (degrees) of each segment.
+
+    Columns are processed whole with map() rather than a Python loop per point.
+    Returns three arrays of len(lat) - 1.
+    """
+    lat_r = array('d', map(math.radians, lat))
+    lon_r = array('d', map(math.radians, lon))
+    lat1, lat2 = _pairwise(lat_r)
+    lon1, lon2 = _pairwise(lon_r)
+    dlat = list(map(float.__sub__, lat2, lat1))
+    dlon = list(map(float.__sub__, lon2, lon1))
+
+    cos1 = list(map(math.cos, lat1))
+    cos2 = list(map(math.cos, lat2))
+    sin1 = list(map(math.sin, lat1))
+    sin2 = list(map(math.sin, lat2))
+    sin_dlat = list(map(math.sin, (d / 2 for d in dlat)))
+    sin_dlon = list(map(math.sin, (d / 2 for d in dlon)))
+
+    # Clamp a to [0, 1] against rounding before the square root
+    a = [min(1.0, sl * sl + c1 * c2 * so * so)
+         for sl, so, c1, c2 in zip(sin_dlat, sin_dlon, cos1, cos2)]
+    distance = array('d', (2 * EARTH_RADIUS * x for x in map(math.asin, map(math.sqrt, a))))
+
+    y = list(map(float.__mul__, map(math.sin, dlon), cos2))
+    x = [c1 * s2 - s1 * c2 * cd for c1, s2, s1, c2, cd in zip(cos1, sin2, sin1, cos2, map(math.cos, dlon))]
+    bearing = array('d', (b % 360.0 for b in map(math.degrees, map(math.atan2, y, x))))
+
+    t1, t2 = _pairwise(time)
+    duration = array('d', map(float.__sub__, t2, t1))
+    return distance, duration, bearing
+
+def moving_average(values, window=DEFAULT_SMOOTHING):
+    """Centred moving average that skips NaN values, computed from prefix sums."""
+    n = len(values)
+    if n == 0 or window <= 1:
+        return array('d', values)
+    sums = [0.0] + list(accumulate(v if v == v else 0.0 for v in values))
+    counts = [0] + list(accumulate(1 if v == v else 0 for v in values))
+    half = window // 2
+    result = array('d')
+    for i in range(n):
+        lo = max(0, i - half)
+        hi = min(n, i + half + 1)
+        count = counts[hi] - counts[lo]
+        result.append((sums[hi] - sums[lo]) / count if count else NAN)
+    return result
+
+def track_top_speed(track):
+    """The top speed Huabei measured for a Track in m/s, or None."""
+    top_speed = track.metadata.get('data', {}).get('track', {}).get('top_speed_km_per_hour')
+    return top_speed / 3.6 if top_speed else None
+
+def run_kinematics(run, top_speed=None, api_weight=DEFAULT_API_WEIGHT,
+                   window=DEFAULT_SMOOTHING, max_speed=MAX_SPEED):
+    """Compute (speed m/s, azimuth degrees) arrays for every point of a Run.
+
+    GPS speed is distance over time between consecutive points. Segments
+    faster than max_speed, or than the track's reported top_speed (m/s), are
+    dropped as outliers before smoothing. Where speed_arr has a value it is
+    blended in with api_weight. Each point takes the heading of the segment
+    that reaches it; the first point uses the first segment, and stationary
+    points keep the previous heading.
+    """
+    n = len(run)
+    if n < 2:
+        return array('d', [NAN] * n), array('d', [NAN] * n)
+
+    distance, duration, bearing = segment_kinematics(run.lat, run.lon, run.time)
+
+    limit = max_speed if top_speed is None else min(max_speed, top_speed)
+    segment_speed = [d / t if t > 0 else NAN for d, t in zip(distance, duration)]
+    segment_speed = [s if s <= limit else NAN for s in segment_speed]
+
+    gps_speed = moving_average([segment_speed[0]] + segment_speed, window)
+    api_speed = [s / 3.6 for s in run.speed]  # speed_arr is km/h
+    speed = array('d', (
+        g if a != a else a if g != g else api_weight * a + (1 - api_weight) * g
+        for g, a in zip(gps_speed, api_speed)))
+
+    azimuth = array('d', [bearing[0]])
+    for d, b in zip(distance, bearing):
+        azimuth.append(b if d > 0.5 else azimuth[-1])
+    return speed, azimuth
@@ -0,0 +1,224 @@
+"""Level-of-detail previews of a track as SVG or GeoJSON.
+
+A preview only has to show the shape of the day, so instead of simplifying
+the full track on every request build_pyramid ranks its points once with
+douglas_peucker_significance and keeps a few levels of at most
+PREVIEW_LEVELS points. Each kept point is stored once with its rank, the
+coarsest level it is part of, so level k is the points of rank >= k. The
+pyramid is cached as JSON next to the converted outputs and a preview only
+reads and draws a few hundred points, whatever the size of the track.
+"""
+import hashlib
+import json
+import math
+from array import array
+from xml.sax.saxutils import escape
+
+from instrumentation import span
+from simplify import EARTH_RADIUS, douglas_peucker_significance
+from track_model import get_track_name, load_track
+
+# Most points in each level, finest first; run end points are always kept
+PREVIEW_LEVELS = (2000, 500, 125)
+# Levels are picked as the finest one with at most this many points
+DEFAULT_PREVIEW_POINTS = 500
+DEFAULT_PREVIEW_SIZE = 320
+MAX_PREVIEW_SIZE = 2048
+PREVIEW_FORMATS = {'svg': 'image/svg+xml', 'geojson': 'application/geo+json'}
+# Bump when the pyramid changes so old entries are no longer found
+PREVIEW_VERSION = 2
+
+# Alternating run colours, so consecutive runs can be told apart
+RUN_COLOURS = ('#2196F3', '#f44336', '#4CAF50', '#FF9800', '#9C27B0')
+
+def preview_key(track_uuid):
+    """Result cache key of a track's preview pyramid."""
+    payload = json.dumps([PREVIEW_VERSION, 'preview', track_uuid, PREVIEW_LEVELS])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _resort_bbox(data):
+    """[west, south, east, north] of the ski resort from the API's ski_ranch corners, or None."""
+    ranch = data.get('ski_ranch') or {}
+    try:
+        lats = (float(ranch['start_lat']), float(ranch['end_lat']))
+        lons = (float(ranch['start_lng']), float(ranch['end_lng']))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+def _center(data, bbox):
+    """The API's [lon, lat] center, or the middle of bbox when it is missing or malformed."""
+    center = data.get('center')
+    if (isinstance(center, list) and len(center) == 2
+            and all(isinstance(value, (int, float)) and math.isfinite(value) for value in center)):
+        return [float(center[0]), float(center[1])]
+    return [(bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2]
+
+def _level_tolerances(significances):
+    """Tolerance of each level: the smallest that keeps it within its PREVIEW_LEVELS budget.
+
+    Run end points are kept at every level, so a level whose budget they
+    already fill gets an infinite tolerance.
+    """
+    ranked = sorted((value for value in significances if value != math.inf), reverse=True)
+    ends = len(significances) - len(ranked)
+    tolerances = []
+    for budget in PREVIEW_LEVELS:
+        kept = budget - ends
+        if kept < 0:
+            tolerances.append(math.inf)
+        elif kept < len(ranked):
+            # Keeping points above the (kept + 1)th significance keeps kept of them
+            tolerances.append(ranked[kept])
+        else:
+            tolerances.append(0.0)
+    return tolerances
+
+def build_pyramid(track_data):
+    """Return the preview pyramid of a track as a JSON-serializable dict.
+
+    Keys: name, center ([lon, lat], from the API when it has one), bbox of
+    the track and resort_bbox of the ski resort ([west, south, east, north];
+    resort_bbox may be None), points (the track's point count), tolerances
+    (metres, None when only run end points are kept) and counts of each
+    level, and runs, each a list of [lon, lat, rank]. Points without a
+    position are left out, as are runs left with none. Raises ValueError if
+    no point has one.
+    """
+    track = load_track(track_data)
+    data = track.metadata.get('data', {})
+    with span('preview_build', points=track.point_count) as build_span:
+        runs = []
+        for run in track.runs:
+            positions = [(lon, lat) for lon, lat in zip(run.lon, run.lat) if math.isfinite(lon) and math.isfinite(lat)]
+            if positions:
+                runs.append(positions)
+        if not runs:
+            raise ValueError("No coordinate data found in the track data")
+
+        bbox = [min(lon for positions in runs for lon, _ in positions),
+                min(lat for positions in runs for _, lat in positions),
+                max(lon for positions in runs for lon, _ in positions),
+                max(lat for positions in runs for _, lat in positions)]
+        center = _center(data, bbox)
+        scale_x = EARTH_RADIUS * math.cos(math.radians(center[1]))
+        significances = []
+        for positions in runs:
+            xs = array('d', (scale_x * math.radians(lon) for lon, _ in positions))
+            ys = array('d', (EARTH_RADIUS * math.radians(lat) for _, lat in positions))
+            significances.append(douglas_peucker_significance(xs, ys))
+
+        tolerances = _level_tolerances([value for run in significances for value in run])
+        counts = [0] * len(tolerances)
+        ranked_runs = []
+        for positions, run_significances in zip(runs, significances):
+            ranked = []
+            for (lon, lat), significance in zip(positions, run_significances):
+                rank = sum(1 for tolerance in tolerances if significance > tolerance or significance == math.inf) - 1
+                if rank >= 0:
+                    ranked.append([round(lon, 6), round(lat, 6), rank])
+                    for level in range(rank + 1):
+                        counts[level] += 1
+            ranked_runs.append(ranked)
+        build_span.set(kept=counts[0])
+
+    return {
+        'name': get_track_name(track),
+        'center': center,
+        'bbox': bbox,
+        'resort_bbox': _resort_bbox(data),
+        'points': track.point_count,
+        'tolerances': [round(tolerance, 2) if tolerance != math.inf else None for tolerance in tolerances],
+        'counts': counts,
+        'runs': ranked_runs,
+    }
+
+def dump_pyramid(pyramid):
+    """Serialize a pyramid for the result cache."""
+    return json.dumps(pyramid, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def load_pyramid(content):
+    """Inverse of dump_pyramid."""
+    return json.loads(content)
+
+def pick_level(pyramid, max_points=DEFAULT_PREVIEW_POINTS):
+    """The finest level with at most max_points points, or the coarsest level."""
+    for level, count in enumerate(pyramid['counts']):
+        if count <= max_points:
+            return level
+    return len(pyramid['counts']) - 1
+
+def level_runs(pyramid, level):
+    """The runs of a level as lists of (lon, lat)."""
+    return [[(lon, lat) for lon, lat, rank in run if rank >= level] for run in pyramid['runs']]
+
+def render_svg(pyramid, level, size=DEFAULT_PREVIEW_SIZE):
+    """SVG bytes drawing each run of a level as a polyline, size pixels on its longer side.
+
+    A run of a single point is drawn as a dot.
+    """
+    with span('preview_render', format='svg', level=level):
+        west, south, east, north = pyramid['bbox']
+        scale_x = math.cos(math.radians(pyramid['center'][1]))
+        width = (east - west) * scale_x
+        height = north - south
+        margin = 4
+        scale = (size - 2 * margin) / max(width, height, 1e-9)
+        view_width = round(max(width, 1e-9) * scale + 2 * margin)
+        view_height = round(max(height, 1e-9) * scale + 2 * margin)
+        # Centred, so a single point or a straight line is not drawn against an edge
+        left = (view_width - width * scale) / 2
+        top = (view_height - height * scale) / 2
+
+        parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{view_width}" height="{view_height}" '
+                 f'viewBox="0 0 {view_width} {view_height}">',
+                 f'<title>{escape(pyramid["name"])}</title>',
+                 '<g fill="none" stroke-width="1.5" stroke-linejoin="round" stroke-linecap="round">']
+        for run_idx, run in enumerate(level_runs(pyramid, level)):
+            colour = RUN_COLOURS[run_idx % len(RUN_COLOURS)]
+            points = [(left + (lon - west) * scale_x * scale, top + (north - lat) * scale) for lon, lat in run]
+            if len(points) == 1:
+                (x, y), = points
+                parts.append(f'<circle fill="{colour}" cx="{x:.1f}" cy="{y:.1f}" r="2"/>')
+            else:
+                points = ' '.join(f'{x:.1f},{y:.1f}' for x, y in points)
+                parts.append(f'<polyline stroke="{colour}" points="{points}"/>')
+        parts.append('</g></svg>')
+    return ''.join(parts).encode('utf-8')
+
+def render_geojson(pyramid, level):
+    """GeoJSON bytes of a level: a MultiLineString feature with a line per run.
+
+    Runs of a single point, which make no line, follow as a MultiPoint
+    feature.
+    """
+    with span('preview_render', format='geojson', level=level):
+        runs = level_runs(pyramid, level)
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'MultiLineString',
+                         'coordinates': [[[lon, lat] for lon, lat in run] for run in runs if len(run) > 1]},
+            'properties': {
+                'name': pyramid['name'],
+                'center': pyramid['center'],
+                'resort_bbox': pyramid['resort_bbox'],
+                'points': pyramid['points'],
+                'preview_points': pyramid['counts'][level],
+                'tolerance': pyramid['tolerances'][level],
+            },
+        }
+        features = [feature]
+        points = [[lon, lat] for run in runs if len(run) == 1 for lon, lat in run]
+        if points:
+            features.append({'type': 'Feature', 'geometry': {'type': 'MultiPoint', 'coordinates': points},
+                             'properties': {'name': pyramid['name']}})
+        collection = {'type': 'FeatureCollection', 'bbox': pyramid['bbox'], 'features': features}
+    return json.dumps(collection, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def render_preview(pyramid, output_format='svg', level=0, size=DEFAULT_PREVIEW_SIZE):
+    """Render a level of the pyramid in output_format (see PREVIEW_FORMATS); size is for SVG."""
+    if output_format == 'svg':
+        return render_svg(pyramid, level, size)
+    if output_format == 'geojson':
+        return render_geojson(pyramid, level)
+    raise ValueError(f"Unknown preview format: {output_format}")
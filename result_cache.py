@@ -0,0 +1,135 @@
+"""Cache of converted output: an in-memory LRU in front of an on-disk tier."""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from instrumentation import REGISTRY
+from track_cache import DEFAULT_CACHE_DIR, TrackCache
+
+DEFAULT_RESULT_DIR = os.environ.get('HUABEI_RESULT_CACHE_DIR', f'{DEFAULT_CACHE_DIR}-results')
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+# Larger outputs are streamed without being cached
+MAX_ENTRY_BYTES = 32 * 1024 * 1024
+# Bump when an output format changes so old entries are no longer found
+RESULT_VERSION = 1
+# TrackCache endpoint the disk tier files every output under, whatever its format
+DISK_LABEL = 'result'
+
+RESULT_LOOKUPS = REGISTRY.counter(
+    'huabei_result_cache_lookups_total', 'Converted output cache lookups by the tier that answered.', ('tier',))
+
+# A converted track: its default filename, the file's bytes and when it was made
+CachedResult = namedtuple('CachedResult', ['filename', 'content', 'created_at'])
+
+_result_cache = False
+_result_cache_lock = threading.Lock()
+
+def result_key(track_uuids, timezone_offset=0, gps_extensions=False, simplify=None, simplify_method='dp',
+               output_format='gpx'):
+    """Key of the output converted from track_uuids (several when merged) with these options."""
+    # 5 and 5.0 metres are the same tolerance
+    simplify = float(simplify) if simplify else None
+    options = [timezone_offset, bool(gps_extensions), simplify, simplify_method if simplify else None, output_format]
+    payload = json.dumps([RESULT_VERSION, list(track_uuids), options])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """Converted outputs by result_key, kept in memory and on disk.
+
+    The memory tier is an LRU bounded by memory_bytes of output. Misses fall
+    through to a TrackCache directory, whose hits are promoted back into
+    memory; the disk tier evicts by its own size and age limits.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_RESULT_DIR, memory_bytes=DEFAULT_MEMORY_BYTES,
+                 disk_bytes=DEFAULT_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk = TrackCache(cache_dir, max_bytes=disk_bytes) if cache_dir else None
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the CachedResult for key, or None."""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+        if result is not None:
+            RESULT_LOOKUPS.inc(tier='memory')
+            return result
+
+        content = self.disk.get(DISK_LABEL, key) if self.disk else None
+        if content is None:
+            RESULT_LOOKUPS.inc(tier='miss')
+            return None
+        header, _, content = content.partition(b'\n')
+        header = json.loads(header)
+        result = CachedResult(header['filename'], content, header['created_at'])
+        self._remember(key, result)
+        RESULT_LOOKUPS.inc(tier='disk')
+        return result
+
+    def put(self, key, filename, content):
+        """Store a converted output in both tiers and return it as a CachedResult."""
+        result = CachedResult(filename, content, time.time())
+        if len(content) > MAX_ENTRY_BYTES:
+            return result
+        self._remember(key, result)
+        if self.disk:
+            header = json.dumps({'filename': filename, 'created_at': result.created_at}, ensure_ascii=False)
+            self.disk.put(DISK_LABEL, key, header.encode('utf-8') + b'\n' + content)
+        return result
+
+    def _remember(self, key, result):
+        if len(result.content) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_size -= len(previous.content)
+            self._memory[key] = result
+            self._memory_size += len(result.content)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted.content)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._memory), 'memory_bytes': self._memory_size}
+
+def get_result_cache():
+    """Return the shared result cache, or None if result caching is disabled."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is False:
+            _result_cache = ResultCache()
+        return _result_cache
+
+def set_result_cache(cache):
+    """Replace the shared result cache; None disables it."""
+    global _result_cache
+    with _result_cache_lock:
+        _result_cache = cache
+
+def cache_chunks(cache, key, filename, chunks):
+    """Yield chunks unchanged and store their concatenation in cache once they are exhausted.
+
+    Outputs that grow past MAX_ENTRY_BYTES, or that stop early, are not stored.
+    """
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size > MAX_ENTRY_BYTES:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        cache.put(key, filename, b''.join(parts))
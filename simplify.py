@@ -0,0 +1,139 @@
+"""Track simplification (Douglas-Peucker and Visvalingam-Whyatt)."""
+import heapq
+import logging
+import math
+from array import array
+
+from instrumentation import span
+from track_model import Track, subset_run
+
+EARTH_RADIUS = 6371008.8  # metres
+METHODS = ('dp', 'vw')
+
+log = logging.getLogger(__name__)
+
+def project(run):
+    """Project a run onto a local plane in metres (equirectangular around its mean latitude)."""
+    lat0 = math.radians(sum(run.lat) / len(run.lat)) if len(run.lat) else 0.0
+    scale_x = EARTH_RADIUS * math.cos(lat0)
+    xs = array('d', (scale_x * x for x in map(math.radians, run.lon)))
+    ys = array('d', (EARTH_RADIUS * y for y in map(math.radians, run.lat)))
+    return xs, ys
+
+def _segment_distances(xs, ys, start, end):
+    """Distances of the points strictly between start and end to the segment start-end."""
+    x1, y1, x2, y2 = xs[start], ys[start], xs[end], ys[end]
+    dx = x2 - x1
+    dy = y2 - y1
+    length2 = dx * dx + dy * dy
+    px = xs[start + 1:end]
+    py = ys[start + 1:end]
+    if length2 == 0:
+        return [math.hypot(x - x1, y - y1) for x, y in zip(px, py)]
+    # Project onto the segment, clamped to its end points
+    ts = [min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / length2)) for x, y in zip(px, py)]
+    return [math.hypot(x - (x1 + t * dx), y - (y1 + t * dy)) for x, y, t in zip(px, py, ts)]
+
+def douglas_peucker(xs, ys, tolerance, start, end):
+    """Indices kept by Douglas-Peucker between start and end (inclusive), using an explicit stack."""
+    keep = {start, end}
+    stack = [(start, end)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(xs, ys, first, last)
+        farthest = max(range(len(distances)), key=distances.__getitem__)
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep.add(index)
+            stack.append((first, index))
+            stack.append((index, last))
+    return keep
+
+def douglas_peucker_significance(xs, ys):
+    """The largest tolerance at which Douglas-Peucker still keeps each point (inf for the end points).
+
+    Recursing to the bottom once gives every tolerance's result: a point is
+    kept at tolerance t exactly when its significance exceeds t.
+    """
+    n = len(xs)
+    significance = [0.0] * n
+    if not n:
+        return significance
+    significance[0] = significance[-1] = math.inf
+    stack = [(0, n - 1, math.inf)]
+    while stack:
+        first, last, limit = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(xs, ys, first, last)
+        farthest = max(range(len(distances)), key=distances.__getitem__)
+        index = first + 1 + farthest
+        # A split below its parent's only happens at the parent's tolerance or lower
+        value = significance[index] = min(limit, distances[farthest])
+        stack.append((first, index, value))
+        stack.append((index, last, value))
+    return significance
+
+def _triangle_area(xs, ys, a, b, c):
+    return abs((xs[b] - xs[a]) * (ys[c] - ys[a]) - (xs[c] - xs[a]) * (ys[b] - ys[a])) / 2
+
+def visvalingam_whyatt(xs, ys, tolerance, start, end):
+    """Indices kept by Visvalingam-Whyatt between start and end (inclusive).
+
+    Points are removed smallest effective area first while that area is below
+    tolerance squared, using a heap with lazy invalidation.
+    """
+    threshold = tolerance * tolerance
+    prev = {i: i - 1 for i in range(start, end + 1)}
+    next_ = {i: i + 1 for i in range(start, end + 1)}
+    heap = [(_triangle_area(xs, ys, i - 1, i, i + 1), i, i - 1, i + 1) for i in range(start + 1, end)]
+    heapq.heapify(heap)
+    removed = set()
+    while heap:
+        area, i, a, c = heapq.heappop(heap)
+        if area >= threshold:
+            break
+        # Skip entries whose neighbours changed since they were pushed
+        if i in removed or prev[i] != a or next_[i] != c:
+            continue
+        removed.add(i)
+        next_[a] = c
+        prev[c] = a
+        # A neighbour's area never drops below the point just removed
+        if a != start:
+            heapq.heappush(heap, (max(area, _triangle_area(xs, ys, prev[a], a, c)), a, prev[a], c))
+        if c != end:
+            heapq.heappush(heap, (max(area, _triangle_area(xs, ys, a, c, next_[c])), c, a, next_[c]))
+    return set(range(start, end + 1)) - removed
+
+def simplify_run(run, tolerance, method='dp'):
+    """Return a Run with the points the chosen method keeps at tolerance metres.
+
+    The first and last points and every point where status_arr changes are
+    always kept; the spans between them are simplified independently.
+    """
+    n = len(run)
+    if n < 3 or tolerance <= 0:
+        return run
+    simplify = douglas_peucker if method == 'dp' else visvalingam_whyatt
+    xs, ys = project(run)
+
+    anchors = [0] + [i for i in range(1, n) if run.status[i] != run.status[i - 1]] + [n - 1]
+    keep = set()
+    for start, end in zip(anchors, anchors[1:]):
+        if end > start:
+            keep |= simplify(xs, ys, tolerance, start, end)
+    keep.update(anchors)
+    return subset_run(run, sorted(keep))
+
+def simplify_track(track, tolerance, method='dp'):
+    """Return a simplified copy of a Track; see simplify_run."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown simplification method: {method}")
+    with span('simplify', method=method, tolerance=tolerance):
+        simplified = Track(track.metadata, [simplify_run(run, tolerance, method) for run in track.runs])
+    log.info("Simplified from %d to %d points (%s, %g m tolerance)",
+             track.point_count, simplified.point_count, method, tolerance)
+    return simplified
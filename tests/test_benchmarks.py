@@ -0,0 +1,89 @@
+"""Synthetic tracks, the API stub and result comparison of the benchmark suite."""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+from benchmarks import run_benchmarks
+from benchmarks.api_stub import StubServer
+from benchmarks.synthetic import generate_track, load_sample, write_track
+from track_model import load_track
+
+def status(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+class SyntheticTrackTest(unittest.TestCase):
+
+    def test_tracks_have_the_requested_size(self):
+        sample_points = sum(len(run) for run in load_sample()['data']['track_detail'])
+        for points, runs in ((500, None), (sample_points * 2 + 7, 9), (3, 10)):
+            track = load_track(generate_track(points, runs))
+            self.assertEqual(track.point_count, points)
+            if runs:
+                self.assertEqual(len(track.runs), min(runs, points))
+            times = [t for run in track.runs for t in run.time]
+            self.assertFalse(any(t != t for t in times))
+
+    def test_repeats_fall_on_later_days(self):
+        sample_points = sum(len(run) for run in load_sample()['data']['track_detail'])
+        track = load_track(generate_track(sample_points * 2, runs=2))
+        first, second = track.runs
+        self.assertEqual(second.time[0] - first.time[0], 86400)
+        self.assertGreater(second.lon[0], first.lon[0])
+
+    def test_written_file_matches_the_generated_track(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, 'track.json')
+            size = write_track(output_file, 1234, runs=5)
+            self.assertEqual(size, os.path.getsize(output_file))
+            with open(output_file, encoding='utf-8') as f:
+                self.assertEqual(json.load(f), generate_track(1234, runs=5))
+
+class StubServerTest(unittest.TestCase):
+
+    def test_uuid_prefixes_select_the_behaviour(self):
+        with StubServer(b'{}') as stub:
+            base = stub.api_base
+            self.assertEqual(status(f'{base}/tracks/track-1'), 200)
+            self.assertEqual((status(f'{base}/tracks/ski-1'), status(f'{base}/skis/ski-1')), (404, 200))
+            self.assertEqual((status(f'{base}/tracks/missing-1'), status(f'{base}/skis/missing-1')), (404, 404))
+            self.assertEqual([status(f'{base}/tracks/flaky-1') for _ in range(2)], [503, 200])
+            self.assertEqual([status(f'{base}/tracks/broken-1') for _ in range(2)], [503, 503])
+            self.assertEqual(status(f'{base}/other/track-1'), 404)
+        self.assertEqual(stub.attempts['/api/tracks/flaky-1'], 2)
+        self.assertEqual(len(stub.paths), 10)
+
+class CompareTest(unittest.TestCase):
+
+    def test_regressions_past_the_threshold(self):
+        baseline = {'results': [
+            {'case': 'write_gpx', 'points': 10000, 'points_per_second': 1000.0, 'peak_rss_mb': 100.0},
+            {'case': 'fetch', 'points': 10000, 'points_per_second': 1000.0, 'peak_rss_mb': 100.0},
+        ]}
+        results = [
+            {'case': 'write_gpx', 'points': 10000, 'points_per_second': 850.0, 'peak_rss_mb': 105.0},
+            {'case': 'fetch', 'points': 10000, 'points_per_second': 950.0, 'peak_rss_mb': 120.0},
+            {'case': 'api', 'points': 10000, 'points_per_second': 1.0, 'peak_rss_mb': 1000.0},
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            regressions = run_benchmarks.compare(results, baseline, threshold=0.1)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('write_gpx at 10000 points: throughput'))
+        self.assertTrue(regressions[1].startswith('fetch at 10000 points: peak RSS'))
+
+    def test_cases_measure_their_output(self):
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            run, points = run_benchmarks.case_write_gpx(2000, {'timezone': 8}, directory)
+            self.assertEqual(points, 2000)
+            self.assertEqual(run(), os.path.getsize(os.path.join(directory, 'write.gpx')))
+
+if __name__ == '__main__':
+    unittest.main()
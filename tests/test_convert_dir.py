@@ -0,0 +1,71 @@
+"""Offline conversion of saved API responses with convert-dir."""
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from benchmarks.synthetic import SAMPLE_FILE
+from converter_gpx import CONVERT_MANIFEST, convert_files, find_input_files, load_manifest, output_filenames
+
+class ConvertDirTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input_dir = os.path.join(directory.name, 'dumps')
+        self.output_dir = os.path.join(directory.name, 'out')
+        os.makedirs(os.path.join(self.input_dir, 'older'))
+        os.makedirs(self.output_dir)
+        shutil.copy(SAMPLE_FILE, os.path.join(self.input_dir, 'day.json'))
+        with open(SAMPLE_FILE, 'rb') as f, gzip.open(os.path.join(self.input_dir, 'older', 'day.json.gz'), 'wb') as out:
+            out.write(f.read())
+        with open(os.path.join(self.input_dir, 'broken.json'), 'w') as f:
+            f.write('{"data": {}}')
+        self.inputs = find_input_files([self.input_dir], recursive=True)
+
+    def convert(self, **options):
+        return list(convert_files(self.inputs, self.output_dir, workers=1, **options))
+
+    def test_inputs_and_output_names(self):
+        self.assertEqual([os.path.relpath(path, self.input_dir) for path in self.inputs],
+                         ['broken.json', 'day.json', os.path.join('older', 'day.json.gz')])
+        self.assertEqual(output_filenames(self.inputs, '.fit'), ['broken.fit', 'day_1.fit', 'day_2.fit'])
+
+    def test_failures_are_reported_per_file(self):
+        results = self.convert()
+        self.assertEqual([error is None for _, _, _, error in results], [False, True, True])
+        self.assertEqual(sorted(os.listdir(self.output_dir)), [CONVERT_MANIFEST, 'day_1.gpx', 'day_2.gpx'])
+        self.assertEqual(sorted(load_manifest(self.output_dir)), ['day_1.gpx', 'day_2.gpx'])
+
+    def test_up_to_date_outputs_are_skipped(self):
+        self.convert(timezone_offset=8)
+        skipped = [output_file for _, output_file, points, error in self.convert(timezone_offset=8)
+                   if points is None and error is None]
+        self.assertEqual([os.path.basename(path) for path in skipped], ['day_1.gpx', 'day_2.gpx'])
+        # A newer input is converted again
+        later = time.time() + 10
+        os.utime(self.inputs[1], (later, later))
+        skipped = [output_file for _, output_file, points, error in self.convert(timezone_offset=8)
+                   if points is None and error is None]
+        self.assertEqual([os.path.basename(path) for path in skipped], ['day_2.gpx'])
+
+    def test_changed_options_make_outputs_stale(self):
+        self.convert(timezone_offset=8)
+        for options in ({'timezone_offset': 9}, {'timezone_offset': 9, 'simplify': 5.0},
+                        {'timezone_offset': 9, 'simplify': 5.0, 'gps_extensions': True}):
+            results = self.convert(**options)
+            self.assertEqual([points is None for _, _, points, error in results if error is None], [False, False])
+        # The same tolerance given as an int is the same option
+        results = self.convert(timezone_offset=9, simplify=5, gps_extensions=True)
+        self.assertEqual([points for _, _, points, error in results if error is None], [None, None])
+
+    def test_outputs_without_a_manifest_entry_are_converted(self):
+        self.convert()
+        os.remove(os.path.join(self.output_dir, CONVERT_MANIFEST))
+        results = self.convert()
+        self.assertTrue(all(points for _, _, points, error in results if error is None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""GPX output of converter_gpx."""
+import copy
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks.synthetic import SAMPLE_FILE
+from converter_gpx import create_gpx, iter_gpx, save_gpx, write_gpx
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+def etree_gpx(track_data, timezone_offset=0, gps_extensions=False):
+    """The GPX bytes the ElementTree writer produces."""
+    output = io.BytesIO()
+    save_gpx(create_gpx(track_data, timezone_offset, gps_extensions), output)
+    return output.getvalue()
+
+class StreamingGpxTest(unittest.TestCase):
+
+    def test_matches_the_element_tree_writer(self):
+        for timezone_offset, gps_extensions in ((0, False), (8, False), (-7, True)):
+            self.assertEqual(b''.join(iter_gpx(SAMPLE, timezone_offset, gps_extensions)),
+                             etree_gpx(SAMPLE, timezone_offset, gps_extensions), (timezone_offset, gps_extensions))
+
+    def test_names_and_empty_runs_are_written_like_element_tree(self):
+        track_data = copy.deepcopy(SAMPLE)
+        track_data['data']['ski_ranch']['name'] = 'Tom & Jerry\'s <"Resort">'
+        track_data['data']['track_detail'].append([])
+        gpx = b''.join(iter_gpx(track_data))
+        self.assertEqual(gpx, etree_gpx(track_data))
+        self.assertIn(b'Tom &amp; Jerry\'s &lt;"Resort"&gt;', gpx)
+        self.assertTrue(gpx.endswith(b'<trkseg /></trk></gpx>'))
+
+    def test_one_chunk_per_run(self):
+        chunks = list(iter_gpx(SAMPLE))
+        self.assertEqual(len(chunks), len(SAMPLE['data']['track_detail']) + 2)
+
+    def test_invalid_track_raises_before_the_first_chunk(self):
+        chunks = iter_gpx({'data': {'track_detail': []}})
+        with self.assertRaises(ValueError):
+            next(chunks)
+
+    def test_failed_write_leaves_no_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, 'track.gpx')
+            with self.assertRaises(ValueError):
+                write_gpx({'data': {}}, output_file)
+            self.assertEqual(os.listdir(directory), [])
+            write_gpx(SAMPLE, output_file)
+            with open(output_file, 'rb') as f:
+                self.assertEqual(f.read(), etree_gpx(SAMPLE))
+
+if __name__ == '__main__':
+    unittest.main()
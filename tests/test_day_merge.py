@@ -0,0 +1,57 @@
+"""Grouping and merging of a day's recordings."""
+import copy
+import json
+import unittest
+
+from benchmarks.synthetic import SAMPLE_FILE
+from converter_gpx import plan_outputs
+from day_merge import merge_tracks
+from kinematics import track_top_speed
+from track_model import load_track
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+def without_resort():
+    track_data = copy.deepcopy(SAMPLE)
+    del track_data['data']['ski_ranch']
+    return track_data
+
+class DayMergeTest(unittest.TestCase):
+
+    def test_same_day_and_resort_are_merged(self):
+        units = plan_outputs([(SAMPLE, None), (None, 'failed'), (copy.deepcopy(SAMPLE), None)], merge_by_day=True)
+        self.assertEqual([positions for positions, _ in units], [[0, 2]])
+
+    def test_tracks_without_a_resort_are_not_merged(self):
+        results = [(without_resort(), None), (SAMPLE, None), (without_resort(), None)]
+        units = plan_outputs(results, merge_by_day=True)
+        self.assertEqual([positions for positions, _ in units], [[0], [1], [2]])
+
+    def test_overlapping_recordings_keep_each_point_once(self):
+        track = load_track(SAMPLE)
+        merged = merge_tracks([SAMPLE, copy.deepcopy(SAMPLE)])
+        self.assertEqual(merged.point_count, track.point_count)
+        times = [t for run in merged.runs for t in run.time]
+        self.assertEqual(times, sorted(times))
+
+    def test_statistics_cover_every_recording(self):
+        faster = copy.deepcopy(SAMPLE)
+        stats = faster['data']['track']
+        stats.update(top_speed_km_per_hour=72.0, max_altitude_meter=1200, min_altitude_meter=500)
+        del stats['calorie']
+        merged = merge_tracks([SAMPLE, faster])
+        track_info = merged.metadata['data']['track']
+        original = SAMPLE['data']['track']
+        self.assertEqual(track_top_speed(merged), 20)
+        self.assertEqual(track_info['max_altitude_meter'], 1200)
+        self.assertEqual(track_info['min_altitude_meter'], original['min_altitude_meter'])
+        self.assertEqual(track_info['distance_traveled_meter'], 2 * original['distance_traveled_meter'])
+        self.assertEqual(track_info['duration_second'], 2 * original['duration_second'])
+        self.assertEqual(track_info['calorie'], original['calorie'])
+        self.assertEqual(track_info['uuid'], original['uuid'])
+        # The recordings' own metadata is left alone
+        self.assertEqual(original['top_speed_km_per_hour'], 61.0)
+
+if __name__ == '__main__':
+    unittest.main()
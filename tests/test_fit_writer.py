@@ -0,0 +1,119 @@
+"""FIT output of fit_writer, decoded back with a minimal FIT reader."""
+import copy
+import json
+import math
+import struct
+import unittest
+
+from benchmarks.synthetic import SAMPLE_FILE
+from fit_writer import FIT_EPOCH, iter_fit
+from track_model import load_track
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+FORMATS = {0x00: 'B', 0x02: 'B', 0x84: 'H', 0x85: 'i', 0x86: 'I'}
+INVALID = {0x00: 0xFF, 0x02: 0xFF, 0x84: 0xFFFF, 0x85: 0x7FFFFFFF, 0x86: 0xFFFFFFFF}
+RECORD, LAP, SESSION, ACTIVITY = 20, 19, 18, 34
+
+def crc16(data):
+    """CRC-16/ARC computed bit by bit, independently of fit_writer's table."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+def read_fit(body):
+    """Check the header and CRCs, and return {global message number: [{field number: value}]}."""
+    header_size, _, _, data_size, signature = struct.unpack_from('<BBHI4s', body)
+    assert header_size == 14 and signature == b'.FIT', (header_size, signature)
+    assert struct.unpack_from('<H', body, 12)[0] == crc16(body[:12]), 'header CRC'
+    assert len(body) == header_size + data_size + 2, 'data size'
+    assert struct.unpack_from('<H', body, len(body) - 2)[0] == crc16(body[:-2]), 'file CRC'
+
+    definitions = {}
+    messages = {}
+    pos = header_size
+    end = header_size + data_size
+    while pos < end:
+        record_header = body[pos]
+        pos += 1
+        assert not record_header & 0x80, 'compressed timestamp headers are not written'
+        local_type = record_header & 0x0F
+        if record_header & 0x40:
+            _, architecture, global_number, count = struct.unpack_from('<BBHB', body, pos)
+            assert architecture == 0, 'little endian'
+            pos += 5
+            fields = []
+            for _ in range(count):
+                number, size, base_type = struct.unpack_from('<BBB', body, pos)
+                assert struct.calcsize(FORMATS[base_type]) == size
+                fields.append((number, base_type))
+                pos += 3
+            definitions[local_type] = global_number, fields
+        else:
+            global_number, fields = definitions[local_type]
+            values = {}
+            for number, base_type in fields:
+                value, = struct.unpack_from('<' + FORMATS[base_type], body, pos)
+                pos += struct.calcsize(FORMATS[base_type])
+                values[number] = None if value == INVALID[base_type] else value
+            messages.setdefault(global_number, []).append(values)
+    assert pos == end, 'records overrun the data size'
+    return messages
+
+def degrees(semicircles):
+    return semicircles * 180 / 2 ** 31
+
+class FitWriterTest(unittest.TestCase):
+
+    def test_records_round_trip(self):
+        messages = read_fit(b''.join(iter_fit(SAMPLE)))
+        points = [(run.lat[i], run.lon[i], run.time[i], run.ele[i], run.speed[i])
+                  for run in load_track(SAMPLE).runs for i in range(len(run))]
+        records = messages[RECORD]
+        self.assertEqual(len(records), len(points))
+        for record, (lat, lon, epoch, ele, speed) in zip(records, points):
+            self.assertAlmostEqual(degrees(record[0]), lat, places=6)
+            self.assertAlmostEqual(degrees(record[1]), lon, places=6)
+            self.assertEqual(record[253], round(epoch - FIT_EPOCH))
+            self.assertAlmostEqual(record[2] / 5 - 500, ele, delta=0.1)
+            if math.isnan(speed):
+                self.assertIsNone(record[6])
+            else:
+                self.assertAlmostEqual(record[6] / 1000, speed / 3.6, delta=0.001)
+        distances = [record[5] for record in records]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_one_lap_per_run(self):
+        messages = read_fit(b''.join(iter_fit(SAMPLE, timezone_offset=8)))
+        track = load_track(SAMPLE)
+        laps = messages[LAP]
+        self.assertEqual(len(laps), len(track.runs))
+        self.assertEqual([lap[254] for lap in laps], list(range(len(laps))))
+        for lap, run in zip(laps, track.runs):
+            self.assertEqual((lap[2], lap[253]), (round(run.time[0] - FIT_EPOCH), round(run.time[-1] - FIT_EPOCH)))
+        session, = messages[SESSION]
+        self.assertEqual(session[26], len(laps))
+        # Each lap's distance is rounded to centimetres on its own
+        self.assertAlmostEqual(session[9], sum(lap[9] for lap in laps), delta=len(laps))
+        activity, = messages[ACTIVITY]
+        self.assertEqual(activity[5] - activity[253], 8 * 3600)
+
+    def test_points_without_a_position_are_skipped(self):
+        track_data = copy.deepcopy(SAMPLE)
+        first_run = track_data['data']['track_detail'][0]
+        first_run[1] = [None, None]
+        messages = read_fit(b''.join(iter_fit(track_data)))
+        self.assertEqual(len(messages[RECORD]), load_track(SAMPLE).point_count - 1)
+
+    def test_track_without_points_raises(self):
+        track_data = copy.deepcopy(SAMPLE)
+        track_data['data']['track_detail'] = [[[None, None]]]
+        with self.assertRaises(ValueError):
+            b''.join(iter_fit(track_data))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""fetch_tracks against the local API stub (benchmarks.api_stub)."""
+import json
+import time
+import unittest
+from unittest import mock
+
+import huabei_api
+from benchmarks.api_stub import StubServer
+from track_model import Track
+
+def payload(track_uuid):
+    """A minimal response that says which UUID it is for."""
+    return json.dumps({'data': {'uuid': track_uuid, 'track_detail': [[[138.84, 36.93], [138.85, 36.94]]]}}).encode()
+
+class FetchTracksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer(payload)
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        for patch in (mock.patch.object(huabei_api, 'API_BASE', self.stub.api_base),
+                      mock.patch.object(huabei_api, '_preferred_endpoints', {}),
+                      mock.patch.object(huabei_api, '_cache', None),
+                      mock.patch.object(huabei_api, '_limiter', None)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_results_in_input_order(self):
+        uuids = [f'track-{i:02d}' for i in range(20)]
+        results = huabei_api.fetch_tracks(uuids, max_workers=8)
+        self.assertEqual([result['data']['uuid'] for result in results], uuids)
+
+    def test_exceptions_are_returned_in_place(self):
+        results = huabei_api.fetch_tracks(['track-1', 'missing-1', 'track-2'], retries=0)
+        self.assertEqual(results[0]['data']['uuid'], 'track-1')
+        self.assertIsInstance(results[1], huabei_api.TrackFetchError)
+        self.assertEqual(results[2]['data']['uuid'], 'track-2')
+
+    def test_skis_fallback_is_remembered(self):
+        result, = huabei_api.fetch_tracks(['ski-0001'])
+        self.assertEqual(result['data']['uuid'], 'ski-0001')
+        self.assertEqual(self.stub.paths, ['/api/tracks/ski-0001', '/api/skis/ski-0001'])
+
+        # A UUID of the same style goes to /skis/ first
+        self.assertEqual(huabei_api.endpoint_order('ski-0002'), ('skis', 'tracks'))
+        huabei_api.fetch_tracks(['ski-0002'])
+        self.assertEqual(self.stub.paths[2:], ['/api/skis/ski-0002'])
+
+    def test_5xx_is_retried_with_backoff(self):
+        start = time.monotonic()
+        result, = huabei_api.fetch_tracks(['flaky-1'], backoff=0.1)
+        self.assertEqual(result['data']['uuid'], 'flaky-1')
+        self.assertEqual(self.stub.paths, ['/api/tracks/flaky-1'] * 2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+    def test_retries_give_up_with_a_returned_error(self):
+        start = time.monotonic()
+        result, = huabei_api.fetch_tracks(['broken-1'], retries=2, backoff=0.05)
+        self.assertIsInstance(result, huabei_api.TrackFetchError)
+        self.assertIn('503', str(result))
+        # Three attempts per endpoint, backing off 0.05 then 0.1 seconds between them
+        self.assertEqual(self.stub.paths, ['/api/tracks/broken-1'] * 3 + ['/api/skis/broken-1'] * 3)
+        self.assertGreaterEqual(time.monotonic() - start, 2 * (0.05 + 0.1))
+
+    def test_streamed_fetch_returns_tracks(self):
+        results = huabei_api.fetch_tracks(['track-1', 'missing-1'], retries=0, stream=True)
+        self.assertIsInstance(results[0], Track)
+        self.assertEqual(results[0].metadata['data']['uuid'], 'track-1')
+        self.assertIsInstance(results[1], huabei_api.TrackFetchError)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Stage timings, metrics rendering, log formats and request profiling."""
+import json
+import logging
+import time
+import unittest
+
+from instrumentation import (STAGE_SECONDS, JsonFormatter, KeyValueFormatter, Registry, RequestProfiler, span,
+                             timed_iter)
+
+def stage_count(stage, outcome='ok'):
+    for name, labels, value in STAGE_SECONDS.samples():
+        if name.endswith('_count') and labels == f'{{stage="{stage}",outcome="{outcome}"}}':
+            return value
+    return 0
+
+def stage_sum(stage, outcome='ok'):
+    for name, labels, value in STAGE_SECONDS.samples():
+        if name.endswith('_sum') and labels == f'{{stage="{stage}",outcome="{outcome}"}}':
+            return value
+    return 0.0
+
+class MetricsTest(unittest.TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests.', ('route',))
+        requests.inc(route='/')
+        requests.inc(2, route='/"x"')
+        self.assertIs(registry.counter('requests_total', 'Requests.', ('route',)), requests)
+        latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        latency.observe(0.05)
+        latency.observe(0.5)
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{route="/"} 1',
+            'requests_total{route="/\\"x\\""} 2',
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1.0"} 2',
+            'latency_seconds_bucket{le="+Inf"} 2',
+            'latency_seconds_sum 0.55',
+            'latency_seconds_count 2',
+        ])
+
+    def test_span_records_errors(self):
+        with span('test_span') as current:
+            current.set(points=3)
+        with self.assertRaises(ValueError):
+            with span('test_span'):
+                raise ValueError('bad')
+        self.assertEqual((stage_count('test_span'), stage_count('test_span', 'error')), (1, 1))
+        self.assertEqual(current.fields, {'points': 3})
+
+    def test_timed_iter_excludes_the_consumer(self):
+        def produce():
+            for _ in range(3):
+                time.sleep(0.01)
+                yield b'x'
+        for _ in timed_iter('test_timed_iter', produce()):
+            time.sleep(0.05)
+        self.assertEqual(stage_count('test_timed_iter'), 1)
+        self.assertGreater(stage_sum('test_timed_iter'), 0.025)
+        self.assertLess(stage_sum('test_timed_iter'), 0.1)
+
+class LogFormatTest(unittest.TestCase):
+
+    def record(self):
+        return logging.LogRecord('converter', logging.INFO, __file__, 1, 'took %.1fs', (1.25,), None)
+
+    def test_extra_fields_are_appended(self):
+        record = self.record()
+        record.stage = 'fetch'
+        self.assertEqual(KeyValueFormatter('%(message)s').format(record), 'took 1.2s stage=fetch')
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual((entry['message'], entry['level'], entry['stage']), ('took 1.2s', 'INFO', 'fetch'))
+
+class RequestProfilerTest(unittest.TestCase):
+
+    def test_one_profile_at_a_time(self):
+        for mode in ('cpu', 'memory'):
+            profiler = RequestProfiler(mode, 'GET /')
+            self.assertTrue(profiler.start())
+            self.assertFalse(RequestProfiler(mode, 'GET /other').start())
+            sum(range(10000))
+            with self.assertLogs('instrumentation', 'INFO'):
+                report = profiler.stop()
+            self.assertTrue(report)
+        with self.assertRaises(ValueError):
+            RequestProfiler('wall', 'GET /')
+
+    def test_metrics_route(self):
+        from web_interface import app
+        client = app.test_client()
+        client.get('/healthz')
+        response = client.get('/metrics')
+        self.assertEqual(response.mimetype, 'text/plain')
+        text = response.get_data(as_text=True)
+        self.assertIn('# TYPE huabei_stage_duration_seconds histogram', text)
+        self.assertIn('huabei_http_requests_total{route="/healthz",status="200"}', text)
+
+if __name__ == '__main__':
+    unittest.main()
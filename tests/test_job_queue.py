@@ -0,0 +1,96 @@
+"""JobQueue status saving, draining and abandoned jobs."""
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from job_queue import ABANDONED_MESSAGE, Job, JobQueue, QueueFull
+
+def handler(job):
+    for index in range(len(job.urls)):
+        job.update(index, filename=f'{index}.gpx')
+    with open(job.artifact_path, 'wb'):
+        pass
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = JobQueue(handler, workers=4, max_pending=200)
+        self.addCleanup(self.jobs.close)
+
+    def test_jobs_saved_while_running_all_finish(self):
+        submitted = [self.jobs.submit([f'url-{i}-{j}' for j in range(5)]) for i in range(100)]
+        self.assertTrue(self.jobs.drain(30))
+        for job in submitted:
+            saved = Job.load(job.status_path, job.artifact_path)
+            self.assertEqual(saved.status, 'done')
+            self.assertEqual(saved.to_dict()['completed'], 5)
+        self.assertEqual([name for name in os.listdir(self.jobs.artifact_dir) if name.endswith('.part')], [])
+
+    def test_failed_job_is_saved(self):
+        def fail(job):
+            raise ValueError('没有成功转换的文件')
+        jobs = JobQueue(fail, workers=1)
+        self.addCleanup(jobs.close)
+        job = jobs.submit(['url'])
+        self.assertTrue(jobs.drain(10))
+        saved = Job.load(job.status_path, job.artifact_path)
+        self.assertEqual((saved.status, saved.error), ('failed', '没有成功转换的文件'))
+
+    def test_draining_queue_refuses_jobs(self):
+        self.assertTrue(self.jobs.drain(1))
+        with self.assertRaises(QueueFull):
+            self.jobs.submit(['url'])
+
+class AbandonedJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = JobQueue(handler, workers=1, heartbeat=0.1)
+        self.addCleanup(self.jobs.close)
+
+    def save_status(self, job_id, owner, status='running'):
+        """Save a job as another process would have, before it stopped."""
+        job = Job(['url'], {}, job_id)
+        job.status_path = os.path.join(self.jobs.artifact_dir, f'{job_id}.json')
+        job.status = status
+        job.owner = owner
+        job.save()
+        return job
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def test_job_of_an_exited_process_is_resubmitted(self):
+        for job_id, status in (('d1', 'queued'), ('d2', 'running')):
+            self.save_status(job_id, self.dead_pid(), status)
+            job = self.jobs.get(job_id)
+            self.assertEqual((job.status, job.error), ('failed', ABANDONED_MESSAGE))
+            resubmitted = self.jobs.submit(['url'], job_id=job_id)
+            self.assertEqual(resubmitted.owner, os.getpid())
+            self.assertTrue(self.jobs.drain(10))
+            self.assertEqual(self.jobs.get(job_id).status, 'done')
+            self.jobs.draining = False
+
+    def test_job_without_heartbeats_is_abandoned(self):
+        self.save_status('a1', os.getpid())
+        self.assertEqual(self.jobs.get('a1').status, 'running')
+        time.sleep(0.4)
+        self.assertEqual(self.jobs.get('a1').status, 'failed')
+
+    def test_running_job_of_another_queue_stays_running(self):
+        release = threading.Event()
+        other = JobQueue(lambda job: release.wait(5), workers=1, heartbeat=0.1,
+                         artifact_dir=self.jobs.artifact_dir)
+        other.submit(['url'], job_id='b2')
+        time.sleep(0.5)
+        self.assertEqual(self.jobs.get('b2').status, 'running')
+        release.set()
+        self.assertTrue(other.drain(5))
+        self.assertEqual(self.jobs.get('b2').status, 'done')
+
+if __name__ == '__main__':
+    unittest.main()
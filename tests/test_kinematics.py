@@ -0,0 +1,82 @@
+"""Speed and azimuth for the gte:gps extension."""
+import json
+import math
+import unittest
+from array import array
+
+from benchmarks.synthetic import SAMPLE_FILE
+from converter_gpx import GTE_NAMESPACE, iter_gpx
+from kinematics import EARTH_RADIUS, moving_average, run_kinematics, segment_kinematics
+from track_model import NAN, Run
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+# Degrees of latitude per metre
+LAT_PER_METRE = math.degrees(1 / EARTH_RADIUS)
+
+def straight_run(metres_per_second, count=20, heading='north', speeds=None):
+    """A run at constant speed, one point per second, heading due north or east along the equator."""
+    run = Run()
+    for i in range(count):
+        offset = i * metres_per_second * LAT_PER_METRE
+        run.lat.append(offset if heading == 'north' else 0.0)
+        run.lon.append(offset if heading == 'east' else 0.0)
+        run.time.append(1707100000.0 + i)
+        run.ele.append(1500.0)
+        run.speed.append(NAN if speeds is None else speeds[i])
+    return run
+
+class KinematicsTest(unittest.TestCase):
+
+    def test_segments(self):
+        distance, duration, bearing = segment_kinematics([0.0, LAT_PER_METRE * 100, LAT_PER_METRE * 100],
+                                                         [0.0, 0.0, LAT_PER_METRE * 100], [0.0, 10.0, 30.0])
+        self.assertEqual([round(d, 6) for d in distance], [100, 100])
+        self.assertEqual(list(duration), [10, 20])
+        self.assertEqual([round(b, 3) for b in bearing], [0, 90])
+
+    def test_moving_average_skips_missing_values(self):
+        self.assertEqual(list(moving_average([1, NAN, 3, 5], 3)), [1, 2, 4, 4])
+        self.assertTrue(math.isnan(moving_average([NAN, NAN], 3)[0]))
+
+    def test_constant_speed_and_heading(self):
+        speed, azimuth = run_kinematics(straight_run(10, heading='east'))
+        self.assertTrue(all(abs(s - 10) < 1e-6 for s in speed))
+        self.assertTrue(all(abs(a - 90) < 1e-6 for a in azimuth))
+
+    def test_jumps_above_the_top_speed_are_dropped(self):
+        run = straight_run(10)
+        run.lat[10] += 500 * LAT_PER_METRE
+        speed, _ = run_kinematics(run, top_speed=20)
+        self.assertLess(max(speed), 20)
+        self.assertTrue(all(abs(s - 10) < 1e-6 for s in speed[:8]))
+
+    def test_api_speed_is_blended_in(self):
+        speed, _ = run_kinematics(straight_run(10, speeds=[72.0] * 10 + [NAN] * 10), api_weight=0.5)
+        self.assertAlmostEqual(speed[0], 15)
+        self.assertAlmostEqual(speed[-1], 10)
+
+    def test_stationary_points_keep_the_heading(self):
+        run = straight_run(10, count=5, heading='east')
+        for column in (run.lat, run.lon):
+            column.append(column[-1])
+        run.time.append(run.time[-1] + 1)
+        run.ele.append(1500.0)
+        run.speed.append(NAN)
+        _, azimuth = run_kinematics(run)
+        self.assertAlmostEqual(azimuth[-1], 90)
+
+    def test_single_points_have_no_kinematics(self):
+        speed, azimuth = run_kinematics(straight_run(10, count=1))
+        self.assertTrue(math.isnan(speed[0]) and math.isnan(azimuth[0]))
+        self.assertEqual(run_kinematics(Run()), (array('d'), array('d')))
+
+    def test_gpx_points_carry_the_extension(self):
+        gpx = b''.join(iter_gpx(SAMPLE, gps_extensions=True)).decode('utf-8')
+        self.assertIn(f'xmlns:gte="{GTE_NAMESPACE}"', gpx)
+        self.assertEqual(gpx.count('<trkpt '), gpx.count('<gte:gps '))
+        self.assertNotIn('gte:', b''.join(iter_gpx(SAMPLE)).decode('utf-8'))
+
+if __name__ == '__main__':
+    unittest.main()
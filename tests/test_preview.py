@@ -0,0 +1,87 @@
+"""Preview pyramids, level selection and rendering."""
+import json
+import unittest
+
+from benchmarks.synthetic import SAMPLE_FILE, generate_track
+from preview import (PREVIEW_LEVELS, build_pyramid, dump_pyramid, level_runs, load_pyramid, pick_level,
+                     render_geojson, render_preview, render_svg)
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+def track_data(*runs):
+    return {'code': 0, 'data': {'track': {'max_altitude_meter': 2000}, 'track_detail': list(runs)}}
+
+class PyramidTest(unittest.TestCase):
+
+    def test_pick_level_boundaries(self):
+        pyramid = {'counts': [2000, 500, 125]}
+        for max_points, level in ((5000, 0), (2000, 0), (1999, 1), (500, 1), (499, 2), (125, 2), (10, 2)):
+            self.assertEqual(pick_level(pyramid, max_points), level, max_points)
+
+    def test_levels_stay_within_their_budgets(self):
+        pyramid = build_pyramid(generate_track(5000, runs=8))
+        self.assertEqual(pyramid['points'], 5000)
+        for level, budget in enumerate(PREVIEW_LEVELS):
+            points = sum(len(run) for run in level_runs(pyramid, level))
+            self.assertEqual(points, pyramid['counts'][level])
+            self.assertLessEqual(points, budget)
+        self.assertEqual(pyramid['counts'], sorted(pyramid['counts'], reverse=True))
+
+    def test_end_points_are_kept_at_every_level(self):
+        pyramid = build_pyramid(generate_track(5000, runs=8))
+        finest = level_runs(pyramid, 0)
+        for level in range(len(PREVIEW_LEVELS)):
+            for run, full in zip(level_runs(pyramid, level), finest):
+                self.assertEqual((run[0], run[-1]), (full[0], full[-1]))
+
+    def test_end_points_alone_over_the_budget(self):
+        # 300 runs of two points: their 600 end points are more than the two coarser levels allow
+        runs = [[[138.8 + i * 0.001, 36.9], [138.8 + i * 0.001, 36.91]] for i in range(300)]
+        pyramid = build_pyramid(track_data(*runs))
+        self.assertEqual(pyramid['counts'], [600, 600, 600])
+        self.assertEqual(pyramid['tolerances'], [0.0, None, None])
+
+    def test_round_trips_through_the_cache_format(self):
+        pyramid = build_pyramid(SAMPLE)
+        self.assertEqual(load_pyramid(dump_pyramid(pyramid)), pyramid)
+
+    def test_track_without_positions_raises(self):
+        for data in (track_data(), track_data([[None, None]], [])):
+            with self.assertRaises(ValueError):
+                build_pyramid(data)
+
+class RenderTest(unittest.TestCase):
+
+    def test_sample_renders_one_polyline_per_run(self):
+        pyramid = build_pyramid(SAMPLE)
+        svg = render_preview(pyramid, 'svg', 0).decode('utf-8')
+        self.assertTrue(svg.startswith('<svg '))
+        self.assertEqual(svg.count('<polyline '), len(pyramid['runs']))
+        geojson = json.loads(render_preview(pyramid, 'geojson', 1))
+        feature, = geojson['features']
+        self.assertEqual(len(feature['geometry']['coordinates']), len(pyramid['runs']))
+        self.assertEqual(feature['properties']['preview_points'], pyramid['counts'][1])
+        with self.assertRaises(ValueError):
+            render_preview(pyramid, 'png')
+
+    def test_single_point_runs(self):
+        pyramid = build_pyramid(track_data([[138.8, 36.9]], [[138.81, 36.91], [138.82, 36.9], [138.83, 36.92]]))
+        svg = render_svg(pyramid, 0).decode('utf-8')
+        self.assertEqual((svg.count('<circle '), svg.count('<polyline ')), (1, 1))
+        lines, points = json.loads(render_geojson(pyramid, 0))['features']
+        self.assertEqual(lines['geometry'], {'type': 'MultiLineString', 'coordinates': [
+            [[138.81, 36.91], [138.82, 36.9], [138.83, 36.92]]]})
+        self.assertEqual(points['geometry'], {'type': 'MultiPoint', 'coordinates': [[138.8, 36.9]]})
+
+    def test_single_point_track_is_centred(self):
+        pyramid = build_pyramid(track_data([[138.8, 36.9]]))
+        svg = render_svg(pyramid, 0, size=100).decode('utf-8')
+        self.assertIn('width="100" height="100"', svg)
+        self.assertIn('cx="50.0" cy="50.0"', svg)
+        lines, points = json.loads(render_geojson(pyramid, 0))['features']
+        self.assertEqual(lines['geometry']['coordinates'], [])
+        self.assertEqual(points['geometry']['coordinates'], [[138.8, 36.9]])
+
+if __name__ == '__main__':
+    unittest.main()
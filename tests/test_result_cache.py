@@ -0,0 +1,71 @@
+"""Converted output cache: keys, memory and disk tiers."""
+import os
+import tempfile
+import unittest
+
+from result_cache import DISK_LABEL, MAX_ENTRY_BYTES, RESULT_LOOKUPS, ResultCache, cache_chunks, result_key
+
+class ResultKeyTest(unittest.TestCase):
+
+    def test_equivalent_options_share_a_key(self):
+        self.assertEqual(result_key(['a'], 8, simplify=5), result_key(['a'], 8, simplify=5.0))
+        self.assertEqual(result_key(['a'], 8, simplify=0, simplify_method='vw'), result_key(['a'], 8))
+        self.assertEqual(result_key(['a'], 8, gps_extensions=1), result_key(['a'], 8, gps_extensions=True))
+
+    def test_options_that_change_the_output_do_not(self):
+        base = result_key(['a'], 8)
+        for key in (result_key(['b'], 8), result_key(['a'], 9), result_key(['a', 'b'], 8),
+                    result_key(['a'], 8, simplify=5), result_key(['a'], 8, output_format='fit'),
+                    result_key(['a'], 8, gps_extensions=True)):
+            self.assertNotEqual(key, base)
+        self.assertNotEqual(result_key(['a'], 8, simplify=5), result_key(['a'], 8, simplify=5, simplify_method='vw'))
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = ResultCache(directory.name, memory_bytes=1000)
+
+    def lookups(self):
+        return {tier: RESULT_LOOKUPS.value(tier=tier) for tier in ('memory', 'disk', 'miss')}
+
+    def test_disk_hits_are_promoted_after_memory_eviction(self):
+        first = self.cache.put('a', 'a.fit', b'a' * 600)
+        self.cache.put('b', 'b.gpx', b'b' * 600)
+        self.assertEqual(self.cache.stats(), {'entries': 1, 'memory_bytes': 600})
+        self.assertTrue(os.path.exists(self.cache.disk._path(DISK_LABEL, 'a')))
+
+        before = self.lookups()
+        self.assertEqual(self.cache.get('a'), first)
+        self.assertEqual(self.cache.get('a'), first)
+        self.assertIsNone(self.cache.get('c'))
+        after = self.lookups()
+        self.assertEqual({tier: after[tier] - before[tier] for tier in after}, {'memory': 1, 'disk': 1, 'miss': 1})
+        # Promoting a evicted b from memory, but not from disk
+        self.assertEqual(self.cache.stats(), {'entries': 1, 'memory_bytes': 600})
+        self.assertEqual(self.cache.get('b').content, b'b' * 600)
+
+    def test_memory_only_cache(self):
+        cache = ResultCache(None, memory_bytes=1000)
+        cache.put('a', 'a.gpx', b'a')
+        self.assertEqual(cache.get('a').content, b'a')
+        self.assertIsNone(cache.get('b'))
+
+    def test_only_complete_outputs_are_stored(self):
+        self.assertEqual(b''.join(cache_chunks(self.cache, 'a', 'a.gpx', [b'1', b'2'])), b'12')
+        self.assertEqual(self.cache.get('a').content, b'12')
+
+        def failing():
+            yield b'1'
+            raise ValueError('bad point')
+        with self.assertRaises(ValueError):
+            list(cache_chunks(self.cache, 'b', 'b.gpx', failing()))
+        self.assertIsNone(self.cache.get('b'))
+
+        chunk = b'x' * (MAX_ENTRY_BYTES // 2 + 1)
+        self.assertEqual(len(b''.join(cache_chunks(self.cache, 'c', 'c.gpx', [chunk, chunk]))), 2 * len(chunk))
+        self.assertIsNone(self.cache.get('c'))
+
+if __name__ == '__main__':
+    unittest.main()
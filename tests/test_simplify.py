@@ -0,0 +1,79 @@
+"""Douglas-Peucker and Visvalingam-Whyatt simplification."""
+import json
+import math
+import unittest
+from array import array
+
+from benchmarks.synthetic import SAMPLE_FILE
+from simplify import (EARTH_RADIUS, douglas_peucker, douglas_peucker_significance, project, simplify_run,
+                      simplify_track, visvalingam_whyatt)
+from track_model import load_track
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+def max_deviation(run, simplified):
+    """Largest distance in metres of a point of run from the polyline of simplified."""
+    xs, ys = project(run)
+    lat0 = math.radians(sum(run.lat) / len(run.lat))
+    kx = EARTH_RADIUS * math.cos(lat0)
+    kept = [(kx * math.radians(lon), EARTH_RADIUS * math.radians(lat)) for lon, lat in zip(simplified.lon,
+                                                                                           simplified.lat)]
+    worst = 0.0
+    for x, y in zip(xs, ys):
+        best = math.inf
+        for (x1, y1), (x2, y2) in zip(kept, kept[1:]):
+            dx, dy = x2 - x1, y2 - y1
+            length2 = dx * dx + dy * dy
+            t = 0.0 if length2 == 0 else min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / length2))
+            best = min(best, math.hypot(x - x1 - t * dx, y - y1 - t * dy))
+        worst = max(worst, best)
+    return worst
+
+class SimplifyTest(unittest.TestCase):
+
+    def test_straight_line_keeps_its_ends(self):
+        xs = array('d', range(10))
+        ys = array('d', [0.0] * 10)
+        self.assertEqual(douglas_peucker(xs, ys, 0.1, 0, 9), {0, 9})
+        self.assertEqual(visvalingam_whyatt(xs, ys, 0.1, 0, 9), {0, 9})
+
+    def test_corner_is_kept(self):
+        xs = array('d', [0, 1, 2, 3, 3, 3])
+        ys = array('d', [0, 0, 0, 0, 1, 2])
+        self.assertEqual(douglas_peucker(xs, ys, 0.1, 0, 5), {0, 3, 5})
+        self.assertEqual(visvalingam_whyatt(xs, ys, 0.1, 0, 5), {0, 3, 5})
+
+    def test_significance_gives_every_tolerance(self):
+        run = load_track(SAMPLE).runs[0]
+        xs, ys = project(run)
+        significance = douglas_peucker_significance(xs, ys)
+        for tolerance in (0.5, 2, 5, 20):
+            kept = {i for i, value in enumerate(significance) if value > tolerance}
+            self.assertEqual(kept, douglas_peucker(xs, ys, tolerance, 0, len(run) - 1), tolerance)
+
+    def test_dp_stays_within_the_tolerance(self):
+        track = load_track(SAMPLE)
+        simplified = simplify_track(track, 5, 'dp')
+        self.assertLess(simplified.point_count, track.point_count)
+        for run, simplified_run in zip(track.runs, simplified.runs):
+            self.assertLessEqual(max_deviation(run, simplified_run), 5 + 1e-6)
+
+    def test_status_changes_are_kept(self):
+        run = max(load_track(SAMPLE).runs, key=lambda run: len(set(run.status)))
+        changes = [i for i in range(1, len(run)) if run.status[i] != run.status[i - 1]]
+        self.assertTrue(changes)
+        for method in ('dp', 'vw'):
+            simplified = simplify_run(run, 1000, method)
+            kept = list(zip(simplified.lon, simplified.lat, simplified.status))
+            for i in [0, len(run) - 1] + changes:
+                self.assertIn((run.lon[i], run.lat[i], run.status[i]), kept, (method, i))
+
+    def test_no_tolerance_keeps_the_track(self):
+        track = load_track(SAMPLE)
+        self.assertEqual(simplify_track(track, 0).point_count, track.point_count)
+        with self.assertRaises(ValueError):
+            simplify_track(track, 5, 'rdp')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Coalescing of duplicate fetches and the upstream rate limiter."""
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from throttle import COALESCED, RateLimiter, SingleFlight, ThrottleTimeout
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.001)
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def blocked(self, outcome):
+        """A call that waits for self.release, then returns or raises outcome."""
+        def fn():
+            self.calls += 1
+            self.release.wait(5)
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
+        return fn
+
+    def run_concurrently(self, key, fn, callers=8):
+        """Start callers calls of fn for key, all arriving while the first is in flight; returns their outcomes."""
+        coalesced = COALESCED.value()
+
+        def call():
+            try:
+                return self.flights.do(key, fn, timeout=5)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(callers) as executor:
+            futures = [executor.submit(call)]
+            wait_until(lambda: self.calls == 1)
+            futures += [executor.submit(call) for _ in range(callers - 1)]
+            wait_until(lambda: COALESCED.value() - coalesced == callers - 1)
+            self.release.set()
+            return [future.result() for future in futures]
+
+    def test_concurrent_calls_share_one_result(self):
+        result = {'data': {}}
+        outcomes = self.run_concurrently('track-1', self.blocked(result))
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(outcome is result for outcome in outcomes))
+        self.assertEqual(self.flights.in_flight(), 0)
+        # Nothing is kept once the call is over
+        self.assertEqual(self.flights.do('track-1', lambda: 'again'), 'again')
+
+    def test_the_exception_reaches_every_caller(self):
+        error = ConnectionError('reset')
+        outcomes = self.run_concurrently('track-1', self.blocked(error))
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(outcome is error for outcome in outcomes))
+        self.assertEqual(self.flights.in_flight(), 0)
+
+    def test_other_keys_are_not_coalesced(self):
+        self.release.set()
+        self.flights.do('track-1', self.blocked(1))
+        self.flights.do('track-2', self.blocked(2))
+        self.assertEqual(self.calls, 2)
+
+    def test_waiters_give_up_after_the_timeout(self):
+        with ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(self.flights.do, 'track-1', self.blocked('done'))
+            wait_until(lambda: self.calls == 1)
+            start = time.monotonic()
+            with self.assertRaises(ThrottleTimeout):
+                self.flights.do('track-1', self.blocked('late'), timeout=0.05)
+            self.assertLess(time.monotonic() - start, 1)
+            self.release.set()
+            self.assertEqual(leader.result(), 'done')
+        self.assertEqual(self.calls, 1)
+
+class RateLimiterTest(unittest.TestCase):
+
+    def timed_acquires(self, limiter, count):
+        start = time.monotonic()
+        for _ in range(count):
+            with limiter.acquire():
+                pass
+        return time.monotonic() - start
+
+    def test_rate_spaces_requests_after_the_burst(self):
+        # The burst is immediate, then one request every 1 / rate seconds
+        self.assertLess(self.timed_acquires(RateLimiter(rate=20, burst=5), 5), 0.04)
+        seconds = self.timed_acquires(RateLimiter(rate=20, burst=1), 6)
+        self.assertGreaterEqual(seconds, 0.24)
+        self.assertLess(seconds, 1)
+
+    def test_tokens_refill_while_idle(self):
+        limiter = RateLimiter(rate=20, burst=2)
+        self.timed_acquires(limiter, 2)
+        time.sleep(0.11)
+        self.assertLess(self.timed_acquires(limiter, 2), 0.04)
+
+    def test_rate_wait_past_the_timeout_raises(self):
+        limiter = RateLimiter(rate=1, burst=1, timeout=0.1)
+        self.timed_acquires(limiter, 1)
+        start = time.monotonic()
+        with self.assertRaises(ThrottleTimeout):
+            with limiter.acquire():
+                pass
+        # The wait is known to be too long up front
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_concurrency_is_bounded(self):
+        limiter = RateLimiter(concurrency=2)
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def request():
+            with limiter.acquire():
+                with lock:
+                    active.append(1)
+                    peak.append(len(active))
+                time.sleep(0.02)
+                with lock:
+                    active.pop()
+
+        with ThreadPoolExecutor(6) as executor:
+            list(executor.map(lambda _: request(), range(12)))
+        self.assertEqual(max(peak), 2)
+
+    def test_concurrency_wait_past_the_timeout_raises(self):
+        limiter = RateLimiter(concurrency=1, timeout=0.05)
+        with limiter.acquire():
+            with self.assertRaises(ThrottleTimeout):
+                with limiter.acquire():
+                    pass
+        # The slot is free again once its holder is done
+        self.timed_acquires(limiter, 1)
+
+if __name__ == '__main__':
+    unittest.main()
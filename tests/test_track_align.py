@@ -0,0 +1,77 @@
+"""Alignment of thinned altitude_arr/speed_arr samples, checked against the sample response."""
+import copy
+import hashlib
+import json
+import random
+import unittest
+
+from benchmarks.bench_interp import bisect_interp
+from benchmarks.synthetic import SAMPLE_FILE
+from converter_gpx import iter_gpx
+from track_align import interp
+from track_model import load_track
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+# sha256 of iter_gpx(SAMPLE, 8) written before track_align existed, when every
+# run of the sample (whose arrays all have equal lengths) was index matched
+INDEX_MATCHED_GPX_SHA256 = 'ccc1ea7f2357b0010285cf3a6d78ecaeec09409086020bde18083e6190924981'
+
+def thinned(step):
+    """The sample with only every step-th altitude and speed sample left in each run."""
+    track_data = copy.deepcopy(SAMPLE)
+    for key in ('altitude_arr', 'speed_arr'):
+        track_data['data'][key] = [run[::step] for run in track_data['data'][key]]
+    return track_data
+
+def mean_error(expected, actual, column):
+    pairs = [(a, b) for run_a, run_b in zip(expected.runs, actual.runs)
+             for a, b in zip(getattr(run_a, column), getattr(run_b, column))]
+    assert all(a == a and b == b for a, b in pairs), f"{column} has missing values"
+    return sum(abs(a - b) for a, b in pairs) / len(pairs)
+
+class TrackAlignTest(unittest.TestCase):
+
+    def setUp(self):
+        self.full = load_track(SAMPLE)
+
+    def assert_errors(self, step, time_error, ele_error, speed_error):
+        track = load_track(thinned(step))
+        self.assertEqual(track.point_count, self.full.point_count)
+        self.assertLess(mean_error(self.full, track, 'time'), time_error)
+        self.assertLess(mean_error(self.full, track, 'ele'), ele_error)
+        self.assertLess(mean_error(self.full, track, 'speed'), speed_error)
+
+    def test_every_second_sample(self):
+        # About 3.6 s, 0.9 m and 0.8 km/h
+        self.assert_errors(2, time_error=5, ele_error=1.5, speed_error=1.2)
+
+    def test_every_third_sample(self):
+        # About 7.7 s, 1.5 m and 1.4 km/h
+        self.assert_errors(3, time_error=10, ele_error=2.5, speed_error=2)
+
+    def test_equal_length_runs_are_index_matched(self):
+        gpx = b''.join(iter_gpx(SAMPLE, 8))
+        self.assertEqual(hashlib.sha256(gpx).hexdigest(), INDEX_MATCHED_GPX_SHA256)
+
+    def test_interp_matches_numpy_semantics(self):
+        result = interp([-1, 0, 0.5, 2, 3, float('nan')], [0, 1, 2], [10, 20, 40])
+        self.assertEqual(list(result[:5]), [10, 10, 15, 40, 40])
+        self.assertNotEqual(result[5], result[5])
+
+    def test_interp_matches_a_binary_search_per_query(self):
+        rng = random.Random(3)
+        xp = sorted(rng.choice((0, 1, 2, 5, 30)) + i for i in range(0, 2000, 3))
+        fp = [rng.uniform(1000, 2000) for _ in xp]
+        ascending = [t + rng.random() for t in range(-10, 2100)]
+        mixed = ascending[:500] + [float('nan')] * 3 + ascending[1500:] + ascending[500:1500]
+        shuffled = ascending[:]
+        rng.shuffle(shuffled)
+        for queries in (ascending, mixed, shuffled, [5.0] * 10, []):
+            expected = bisect_interp(queries, xp, fp)
+            result = interp(queries, xp, fp)
+            self.assertEqual([v if v == v else None for v in result], [v if v == v else None for v in expected])
+
+if __name__ == '__main__':
+    unittest.main()
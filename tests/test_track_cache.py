@@ -0,0 +1,92 @@
+"""TrackCache storage, eviction and offline fetching."""
+import gzip
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import huabei_api
+from benchmarks.api_stub import StubServer
+from track_cache import TrackCache
+
+def payload(track_uuid):
+    return json.dumps({'data': {'uuid': track_uuid, 'track_detail': [[[138.84, 36.93], [138.85, 36.94]]]}}).encode()
+
+class TrackCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = directory.name
+        self.cache = TrackCache(self.cache_dir)
+
+    def age(self, endpoint, track_uuid, seconds):
+        path = self.cache._path(endpoint, track_uuid)
+        mtime = time.time() - seconds
+        os.utime(path, (mtime, mtime))
+
+    def test_round_trip_and_counters(self):
+        self.cache.put('tracks', 'a', b'{"data": {}}')
+        self.assertEqual(self.cache.lookup('a', ['skis', 'tracks']), b'{"data": {}}')
+        self.assertIsNone(self.cache.lookup('b', ['skis', 'tracks']))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['writes']), (1, 1, 1))
+
+    def test_least_recently_used_entries_are_evicted_first(self):
+        content = os.urandom(4096)  # incompressible, so every entry is about the same size
+        for index, track_uuid in enumerate('abcd'):
+            self.cache.put('tracks', track_uuid, content)
+            self.age('tracks', track_uuid, 100 - index)
+        # Reading a bumps it to most recently used
+        self.assertIsNotNone(self.cache.get('tracks', 'a'))
+        entry_size = os.path.getsize(self.cache._path('tracks', 'a'))
+        self.cache.max_bytes = 2 * entry_size
+        self.assertEqual(self.cache.evict(), 2)
+        self.assertEqual([track_uuid for track_uuid in 'abcd' if self.cache.get('tracks', track_uuid)], ['a', 'd'])
+
+    def test_expired_entries_are_misses(self):
+        self.cache.put('tracks', 'a', b'{}')
+        self.age('tracks', 'a', self.cache.max_age + 10)
+        self.assertIsNone(self.cache.get('tracks', 'a'))
+        self.assertFalse(os.path.exists(self.cache._path('tracks', 'a')))
+
+    def test_corrupt_entries_are_misses(self):
+        content = json.dumps({'data': {'track_detail': [[[1.5, 2.5]] * 1000]}}).encode()
+        compressed = gzip.compress(content)
+        corruptions = {
+            'truncated': compressed[:len(compressed) // 2],
+            'garbage': b'not gzip at all',
+            'bad-deflate': compressed[:20] + bytes(len(compressed) - 28) + compressed[-8:],
+            'bad-crc': compressed[:-8] + bytes(8),
+        }
+        for track_uuid, data in corruptions.items():
+            self.cache.put('tracks', track_uuid, content)
+            with open(self.cache._path('tracks', track_uuid), 'wb') as f:
+                f.write(data)
+            self.assertIsNone(self.cache.get('tracks', track_uuid), track_uuid)
+
+    def test_failed_writer_stores_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with self.cache.writer('tracks', 'a') as f:
+                f.write(b'{"data"')
+                raise RuntimeError('connection reset')
+        self.assertIsNone(self.cache.get('tracks', 'a'))
+        self.assertEqual([name for _, _, names in os.walk(self.cache_dir) for name in names], [])
+
+    def test_offline_fetches_only_use_the_cache(self):
+        with StubServer(payload) as stub, \
+                mock.patch.object(huabei_api, 'API_BASE', stub.api_base), \
+                mock.patch.object(huabei_api, '_cache', self.cache), \
+                mock.patch.object(huabei_api, '_limiter', None):
+            with self.assertRaises(huabei_api.TrackFetchError):
+                huabei_api.fetch_track_data('track-1', offline=True)
+            self.assertEqual(stub.paths, [])
+            huabei_api.fetch_track_data('track-1')
+            track_data = huabei_api.fetch_track_data('track-1', offline=True)
+        self.assertEqual(track_data['data']['uuid'], 'track-1')
+        self.assertEqual(len(stub.paths), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Parsing and formatting of track columns."""
+import datetime
+import json
+import math
+import unittest
+
+from benchmarks.synthetic import SAMPLE_FILE
+from track_model import (NO_STATUS, POINT_ARRAYS, Track, format_column, format_timestamps, load_track, naive_epoch,
+                         parse_timestamp, parse_timestamps)
+
+with open(SAMPLE_FILE, encoding='utf-8') as f:
+    SAMPLE = json.load(f)
+
+def track_data(**data):
+    return {'code': 0, 'data': dict({'track': {'max_altitude_meter': 2000}}, **data)}
+
+class TimestampTest(unittest.TestCase):
+
+    def test_batch_parse_agrees_with_parse_timestamp(self):
+        timestamps = ['2024-02-05 09:15:30', '2024-02-05 09:15', '2024-02-06 00:00:00', '2024-2-5 9:05:01',
+                      '2024-02-30 10:00:00', '2024-02-05 24:00:00', 'yesterday', '', None, 1707124530]
+        expected = []
+        for timestamp_str in timestamps:
+            timestamp = parse_timestamp(timestamp_str) if isinstance(timestamp_str, str) else None
+            expected.append(naive_epoch(timestamp) if timestamp else None)
+        self.assertEqual(parse_timestamps(timestamps), expected)
+
+    def test_format_shifts_by_the_timezone(self):
+        epoch = naive_epoch(datetime.datetime(2024, 2, 5, 23, 30, 5))
+        self.assertEqual(format_timestamps([epoch], 8), ['2024-02-06T07:30:05+08:00'])
+        self.assertEqual(format_timestamps([epoch], -7), ['2024-02-05T16:30:05-07:00'])
+        self.assertEqual(format_timestamps([epoch, None, float('nan')]), ['2024-02-05T23:30:05+00:00', None, None])
+
+    def test_columns_format_like_the_json_numbers(self):
+        self.assertEqual(format_column([1.0, 2.0, float('nan')], True), ['1', '2', None])
+        self.assertEqual(format_column([138.123456, 36.5], False), ['138.123456', '36.5'])
+
+class LoadTrackTest(unittest.TestCase):
+
+    def test_columns_hold_the_sample_points(self):
+        track = load_track(SAMPLE)
+        data = SAMPLE['data']
+        self.assertEqual(len(track.runs), len(data['track_detail']))
+        for run, coords, altitudes, statuses in zip(track.runs, data['track_detail'], data['altitude_arr'],
+                                                    data['status_arr']):
+            self.assertEqual(list(zip(run.lon, run.lat)), [tuple(coord[:2]) for coord in coords])
+            self.assertEqual(list(run.ele), [altitude[0] for altitude in altitudes])
+            self.assertEqual(format_timestamps(run.time), [altitude[1].replace(' ', 'T') + '+00:00'
+                                                           for altitude in altitudes])
+            self.assertEqual(list(run.status), [status[0] for status in statuses])
+
+    def test_metadata_drops_only_the_point_arrays(self):
+        track = load_track(SAMPLE)
+        self.assertIs(load_track(track), track)
+        self.assertEqual(set(track.metadata['data']), set(SAMPLE['data']) - set(POINT_ARRAYS))
+        self.assertEqual(track.metadata['data']['track'], SAMPLE['data']['track'])
+
+    def test_numbers_keep_their_json_formatting(self):
+        track = load_track(track_data(track_detail=[[[138, 36.5], [138.25, 37]]],
+                                      altitude_arr=[[[1500, '2024-02-05 09:00:00'], [1500.5, '2024-02-05 09:00:01']]]))
+        run, = track.runs
+        self.assertEqual(format_column(run.lon, run.lon_integral), ['138.0', '138.25'])
+        self.assertEqual(format_column(run.ele, run.ele_integral), ['1500.0', '1500.5'])
+        track = load_track(track_data(track_detail=[[[138, 36], [139, 37]]],
+                                      altitude_arr=[[[1500, '2024-02-05 09:00:00'], [1501, '2024-02-05 09:00:01']]]))
+        run, = track.runs
+        self.assertEqual(format_column(run.lon, run.lon_integral), ['138', '139'])
+        self.assertEqual(format_column(run.ele, run.ele_integral), ['1500', '1501'])
+
+    def test_malformed_points_are_dropped_or_marked_missing(self):
+        track = load_track(track_data(
+            track_detail=[[[138.1, 36.1], [], [138.2, 36.2], [138.3, 36.3]]],
+            altitude_arr=[[[1500, '2024-02-05 09:00:00'], [1501, 'bad'], [None, '2024-02-05 09:00:02'], [1503]]],
+            status_arr=[[[1], [2], ['x'], 999]]))
+        run, = track.runs
+        self.assertIsInstance(track, Track)
+        self.assertEqual(len(run), 3)
+        self.assertEqual(list(run.lat), [36.1, 36.2, 36.3])
+        self.assertEqual(run.ele[0], 1500)
+        self.assertTrue(math.isnan(run.ele[1]))
+        self.assertTrue(math.isnan(run.time[2]))
+        self.assertEqual(list(run.status), [1, NO_STATUS, NO_STATUS])
+
+    def test_unmatched_altitude_data_is_aligned_or_falls_back(self):
+        track = load_track(track_data(track_detail=[[[138.1, 36.1], [138.2, 36.2], [138.3, 36.3]]],
+                                      altitude_arr=[[[1500, '2024-02-05 09:00:00']] * 3 + [[1, 'x']]]))
+        self.assertEqual(list(track.runs[0].ele), [1500, 1500, 1500])
+        track = load_track(track_data(track_detail=[[[138.1, 36.1], [138.2, 36.2]]], altitude_arr=[[]]))
+        self.assertEqual(list(track.runs[0].ele), [2000, 2000])
+
+    def test_no_coordinates_is_an_error(self):
+        for data in ({}, {'data': {}}, track_data(track_detail=[])):
+            with self.assertRaises(ValueError):
+                load_track(data)
+
+if __name__ == '__main__':
+    unittest.main()
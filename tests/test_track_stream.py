@@ -0,0 +1,96 @@
+"""Incremental decoding of API responses split into arbitrary chunks."""
+import json
+import math
+import unittest
+
+from benchmarks.synthetic import SAMPLE_FILE
+from track_model import load_track
+from track_stream import TrackStreamDecoder, load_track_stream
+
+with open(SAMPLE_FILE, 'rb') as f:
+    SAMPLE_BYTES = f.read()
+SAMPLE = json.loads(SAMPLE_BYTES)
+
+def small_response():
+    """Two short runs of the sample, with escapes, non-ASCII text and odd numbers around them."""
+    data = SAMPLE['data']
+    response = {
+        'code': 0,
+        'msg': 'ok "quoted" \\ back\\slash été 雪\U0001f3bf \n\t',
+        'data': {
+            'track': dict(data['track'], name='Café \\"run\\"'),
+            'user': {'nickname': '滑雪', 'scores': [-12.5e-3, 1E+2, 0, -0.0, 12345678901234567890]},
+            'track_detail': [run[:4] for run in data['track_detail'][:2]],
+            'altitude_arr': [run[:4] for run in data['altitude_arr'][:2]],
+            'speed_arr': [run[:4] for run in data['speed_arr'][:2]],
+            'status_arr': [run[:4] for run in data['status_arr'][:2]],
+            'ski_ranch': {'name': 'Hakuba 白馬', 'tags': [], 'extra': None},
+        },
+    }
+    return response
+
+def snapshot(track):
+    """The track's metadata and columns, with NaN as None so equal tracks compare equal."""
+    runs = []
+    for run in track.runs:
+        columns = {name: [None if isinstance(v, float) and math.isnan(v) else v for v in getattr(run, name)]
+                   for name in ('lon', 'lat', 'ele', 'time', 'speed', 'status')}
+        columns.update(integral=(run.lon_integral, run.lat_integral, run.ele_integral))
+        runs.append(columns)
+    return track.metadata, runs
+
+def split(body, *boundaries):
+    edges = [0, *boundaries, len(body)]
+    return [body[start:end] for start, end in zip(edges, edges[1:])]
+
+class TrackStreamTest(unittest.TestCase):
+
+    def assert_decodes_like_load_track(self, body, chunkings):
+        expected = snapshot(load_track(json.loads(body)))
+        for chunks in chunkings:
+            self.assertEqual(snapshot(load_track_stream(chunks)), expected)
+
+    def test_every_two_way_split(self):
+        for body in (json.dumps(small_response(), ensure_ascii=False).encode('utf-8'),
+                     json.dumps(small_response(), indent=2).encode('utf-8')):
+            with self.subTest(size=len(body)):
+                self.assert_decodes_like_load_track(body, (split(body, i) for i in range(len(body) + 1)))
+
+    def test_one_byte_at_a_time(self):
+        body = json.dumps(small_response(), ensure_ascii=False).encode('utf-8')
+        # Multi-byte characters and escapes are cut in the middle too
+        self.assertIn('雪'.encode('utf-8'), body)
+        self.assertIn(b'\\"', body)
+        self.assert_decodes_like_load_track(body, [[body[i:i + 1] for i in range(len(body))]])
+
+    def test_sample_in_chunks(self):
+        self.assert_decodes_like_load_track(SAMPLE_BYTES, (split(SAMPLE_BYTES, *range(size, len(SAMPLE_BYTES), size))
+                                                           for size in (7, 4096, len(SAMPLE_BYTES))))
+
+    def test_feed_returns_completed_runs(self):
+        chunks = split(SAMPLE_BYTES, *range(4096, len(SAMPLE_BYTES), 4096))
+        decoder = TrackStreamDecoder()
+        completed = []
+        for i, chunk in enumerate(chunks):
+            runs = decoder.feed(chunk)
+            if runs and not completed:
+                first_chunk = i
+            completed += runs
+        track = decoder.close()
+        # Runs are handed out before the response ends, in order and only once
+        self.assertLess(first_chunk, len(chunks) - 1)
+        self.assertEqual([id(run) for run in completed], [id(run) for run in track.runs[:len(completed)]])
+        self.assertEqual(decoder.bytes, len(SAMPLE_BYTES))
+
+    def test_malformed_responses(self):
+        body = json.dumps(small_response()).encode('utf-8')
+        for bad in (body[:-1], body[:len(body) // 2], body + b' {}', b'[1, 2]', b'{"code": 0, "data": {}}',
+                    body.replace(b'"code": 0', b'"code": 0 0')):
+            with self.subTest(bad=bad[:40]):
+                with self.assertRaises(ValueError):
+                    load_track_stream(split(bad, len(bad) // 3))
+        # Trailing whitespace is fine
+        self.assertEqual(len(load_track_stream([body, b' \n']).runs), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+"""Conversion routes against the local API stub (benchmarks.api_stub)."""
+import io
+import json
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+import huabei_api
+import result_cache
+import web_interface
+from benchmarks.api_stub import StubServer
+from benchmarks.synthetic import SAMPLE_FILE
+from job_queue import JobQueue
+from web_interface import app, run_conversion_job
+
+with open(SAMPLE_FILE, 'rb') as f:
+    SAMPLE = f.read()
+# Fetched fine, but has nothing to convert
+EMPTY = json.dumps({'data': {'track': {}, 'track_detail': []}}).encode()
+# One point with a position
+SINGLE = json.dumps({'data': {'track': {}, 'track_detail': [[[138.8, 36.9]]]}}).encode()
+
+def payload(track_uuid):
+    if track_uuid.startswith('empty'):
+        return EMPTY
+    return SINGLE if track_uuid.startswith('single') else SAMPLE
+
+class WebInterfaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = stub = StubServer(payload)
+        stub.__enter__()
+        self.addCleanup(stub.__exit__, None, None, None)
+        for patch in (mock.patch.object(huabei_api, 'API_BASE', stub.api_base),
+                      mock.patch.object(huabei_api, '_cache', None),
+                      mock.patch.object(huabei_api, '_limiter', None),
+                      mock.patch.object(result_cache, '_result_cache', None)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        jobs = JobQueue(run_conversion_job)
+        self.addCleanup(jobs.close)
+        # Before the stub stops, so no job outlives its test
+        self.addCleanup(jobs.drain, 10)
+        patch = mock.patch.object(web_interface, 'jobs', jobs)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.client = app.test_client()
+
+    def wait_for_job(self, status_url, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.client.get(status_url).get_json()
+            if status['status'] in ('done', 'failed') or time.monotonic() > deadline:
+                return status
+            time.sleep(0.02)
+
+    def test_index_reports_tracks_that_all_fail_to_convert(self):
+        response = self.client.post('/', data={'urls[]': ['empty-1', 'empty-2'], 'timezone': '8'})
+        self.assertEqual(response.mimetype, 'text/html')
+        page = response.get_data(as_text=True)
+        self.assertIn('没有成功转换的文件', page)
+        self.assertIn('URL 2: No coordinate data', page)
+
+    def test_index_leaves_failed_tracks_out_of_the_archive(self):
+        response = self.client.post('/', data={'urls[]': ['empty-1', 'track-1'], 'timezone': '8'})
+        self.assertEqual(response.mimetype, 'application/zip')
+        names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].endswith('.gpx'))
+
+    def test_track_failing_part_way_is_left_out_and_reported(self):
+        iter_output = web_interface.iter_output
+        calls = []
+
+        def fail_second(*args):
+            calls.append(args)
+            chunks = iter_output(*args)
+            if len(calls) == 2:
+                yield next(chunks)
+                raise ValueError('bad point')
+            yield from chunks
+
+        with mock.patch.object(web_interface, 'iter_output', fail_second):
+            job = self.client.post('/jobs', data={'urls[]': ['track-1', 'track-2', 'track-3']}).get_json()
+            status = self.wait_for_job(job['status_url'])
+            archive = zipfile.ZipFile(io.BytesIO(self.client.get(job['download_url']).data))
+        self.assertEqual([entry['status'] for entry in status['progress']], ['done', 'failed', 'done'])
+        self.assertEqual(status['progress'][1]['error'], 'bad point')
+        self.assertEqual(archive.namelist(), [status['progress'][0]['filename'], status['progress'][2]['filename']])
+        self.assertIsNone(archive.testzip())
+
+    def test_api_returns_422_when_no_track_converts(self):
+        response = self.client.post('/api/convert', json={'tracks': ['empty-1', 'empty-2']})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(response.get_json()['errors']), 2)
+
+    def test_api_lists_failed_tracks_in_the_archive(self):
+        response = self.client.post('/api/convert', json={'tracks': ['empty-1', 'track-1', 'track-2']})
+        self.assertEqual(response.mimetype, 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        names = archive.namelist()
+        self.assertEqual(len(names), 3)
+        self.assertEqual(names[-1], 'errors.json')
+        errors = json.loads(archive.read('errors.json'))
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('URL 1: '))
+
+    def test_api_lists_failed_tracks_in_a_header_of_a_single_file(self):
+        response = self.client.post('/api/convert', json={'tracks': ['track-1', 'missing-1']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/gpx+xml')
+        errors = json.loads(response.headers['X-Conversion-Errors'])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('URL 2: '))
+
+    def test_job_converts_in_the_background(self):
+        response = self.client.post('/jobs', data={'urls[]': ['track-1', 'missing-1'], 'timezone': '8'})
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+        status = self.wait_for_job(job['status_url'])
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual([entry['status'] for entry in status['progress']], ['done', 'failed'])
+        download = self.client.get(job['download_url'])
+        self.assertEqual(download.mimetype, 'application/zip')
+        names = zipfile.ZipFile(io.BytesIO(download.data)).namelist()
+        self.assertEqual(names, [status['progress'][0]['filename']])
+
+    def test_resubmitted_batch_finds_the_first_job(self):
+        form = {'urls[]': ['track-1'], 'timezone': '8'}
+        first = self.client.post('/jobs', data=form).get_json()
+        second = self.client.post('/jobs', data=form).get_json()
+        self.assertEqual(first['id'], second['id'])
+        other = self.client.post('/jobs', data={'urls[]': ['track-1'], 'timezone': '9'}).get_json()
+        self.assertNotEqual(other['id'], first['id'])
+
+    def test_failed_job_reports_its_error(self):
+        job = self.client.post('/jobs', data={'urls[]': ['empty-1']}).get_json()
+        status = self.wait_for_job(job['status_url'])
+        self.assertEqual(status['status'], 'failed')
+        self.assertIn('没有成功转换的文件', status['error'])
+        self.assertEqual(self.client.get(job['download_url']).status_code, 409)
+
+    def test_unknown_jobs_are_404(self):
+        self.assertEqual(self.client.get('/jobs/0123abcd').status_code, 404)
+        self.assertEqual(self.client.get('/jobs/0123abcd/download').status_code, 404)
+        self.assertEqual(self.client.get('/jobs/..%2Fpasswd').status_code, 404)
+
+    def test_api_download_is_revalidated_without_converting(self):
+        body = {'tracks': ['track-1', 'track-2'], 'compression': 6}
+        response = self.client.post('/api/convert', json=body)
+        etag = response.headers['ETag']
+        self.assertNotIn('Last-Modified', response.headers)
+        fetched = len(self.stub.paths)
+        response = self.client.post('/api/convert', json=body, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(self.stub.paths), fetched)
+        # Another batch, or the same one in another encoding, is sent in full
+        self.assertEqual(self.client.post('/api/convert', json=dict(body, timezone=8),
+                                          headers={'If-None-Match': etag}).status_code, 200)
+        single = {'tracks': ['track-1']}
+        gzipped = self.client.post('/api/convert', json=single, headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(gzipped.headers['ETag'].endswith('-gzip"'))
+        self.assertEqual(self.client.post('/api/convert', json=single, headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': gzipped.headers['ETag']}).status_code, 304)
+        self.assertEqual(self.client.post('/api/convert', json=single, headers={
+            'Accept-Encoding': 'br;q=1, gzip;q=0', 'If-None-Match': gzipped.headers['ETag']}).status_code, 200)
+
+    def test_job_download_is_conditional(self):
+        job = self.client.post('/jobs', data={'urls[]': ['track-1']}).get_json()
+        self.wait_for_job(job['status_url'])
+        response = self.client.get(job['download_url'])
+        self.assertEqual(response.headers['ETag'], f'"{job["id"]}"')
+        response = self.client.get(job['download_url'], headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_bad_form_values_are_rejected(self):
+        for field, value in (('simplify', 'abc'), ('simplify', '-1'), ('simplify_method', 'rdp'),
+                             ('compression', 'max'), ('timezone', 'UTC+8')):
+            form = {'urls[]': ['track-1'], field: value}
+            response = self.client.post('/jobs', data=form)
+            self.assertEqual(response.status_code, 400, field)
+            self.assertIn('error', response.get_json())
+            self.assertEqual(self.client.post('/', data=form).status_code, 400, field)
+
+    def test_bad_api_values_are_rejected(self):
+        # The JSON parser accepts NaN and Infinity, which are no tolerance either
+        for simplify in ('-1', '"2"', 'true', 'NaN', 'Infinity', '-Infinity'):
+            response = self.client.post('/api/convert', data=f'{{"tracks": ["track-1"], "simplify": {simplify}}}',
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400, simplify)
+            self.assertIn('simplify', response.get_json()['error'])
+
+    def test_preview_formats(self):
+        svg = self.client.get('/preview?track=track-1&size=200')
+        self.assertEqual((svg.status_code, svg.mimetype), (200, 'image/svg+xml'))
+        self.assertIn(b'<polyline ', svg.data)
+        geojson = self.client.get('/preview?track=track-1&format=geojson&points=500')
+        self.assertEqual(geojson.mimetype, 'application/geo+json')
+        lines = json.loads(geojson.data)['features'][0]['geometry']['coordinates']
+        self.assertLessEqual(sum(len(line) for line in lines), 500)
+        self.assertEqual(self.client.get('/preview?track=track-1&format=png').status_code, 400)
+
+    def test_preview_of_empty_and_single_point_tracks(self):
+        for output_format in ('svg', 'geojson'):
+            response = self.client.get(f'/preview?track=empty-1&format={output_format}')
+            self.assertEqual(response.status_code, 422, output_format)
+            self.assertIn('error', response.get_json())
+        svg = self.client.get('/preview?track=single-1')
+        self.assertEqual(svg.status_code, 200)
+        self.assertIn(b'<circle ', svg.data)
+        features = json.loads(self.client.get('/preview?track=single-1&format=geojson').data)['features']
+        self.assertEqual(features[-1]['geometry'], {'type': 'MultiPoint', 'coordinates': [[138.8, 36.9]]})
+
+if __name__ == '__main__':
+    unittest.main()
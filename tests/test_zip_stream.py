@@ -0,0 +1,54 @@
+"""Streamed ZIP archives."""
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+from zip_stream import iter_zip, spool_chunks, write_zip
+
+def read_zip(data):
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    return {info.filename: (info.compress_type, archive.read(info)) for info in archive.infolist()}
+
+class IterZipTest(unittest.TestCase):
+
+    def test_entries_round_trip(self):
+        entries = [('a.gpx', [b'<gpx>', b'a' * 10000, b'</gpx>']), ('b.gpx', []), ('c.gpx', [b'c'])]
+        for compresslevel, compress_type in ((None, zipfile.ZIP_STORED), (6, zipfile.ZIP_DEFLATED)):
+            files = read_zip(b''.join(iter_zip(iter(entries), compresslevel)))
+            self.assertEqual(files, {name: (compress_type, b''.join(chunks)) for name, chunks in entries})
+
+    def test_entries_can_set_their_own_level(self):
+        entries = [('a.gpx', [b'a' * 1000]), ('b.fit', [b'b' * 1000], 0), ('c.csv', [b'c' * 1000], None)]
+        files = read_zip(b''.join(iter_zip(entries, 9)))
+        self.assertEqual({name: compress_type for name, (compress_type, _) in files.items()},
+                         {'a.gpx': zipfile.ZIP_DEFLATED, 'b.fit': zipfile.ZIP_STORED, 'c.csv': zipfile.ZIP_DEFLATED})
+        files = read_zip(b''.join(iter_zip([('a.gpx', [b'a'], 6), ('b.gpx', [b'b'])])))
+        self.assertEqual([compress_type for compress_type, _ in files.values()],
+                         [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+
+    def test_write_zip_counts_entries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'out.zip')
+            self.assertEqual(write_zip(iter([('a', [b'1']), ('b', [b'2'])]), path, 6), 2)
+            self.assertEqual(write_zip(iter([]), path), 0)
+            with zipfile.ZipFile(path) as archive:
+                self.assertEqual(archive.namelist(), [])
+
+class SpoolChunksTest(unittest.TestCase):
+
+    def test_replays_the_chunks(self):
+        chunks = [os.urandom(1000) for _ in range(50)]
+        for max_size in (0, 100, 1 << 20):
+            self.assertEqual(b''.join(spool_chunks(iter(chunks), max_size)), b''.join(chunks))
+
+    def test_failure_is_raised_before_anything_is_produced(self):
+        def failing():
+            yield b'<gpx>'
+            raise ValueError('bad point')
+        with self.assertRaises(ValueError):
+            spool_chunks(failing())
+
+if __name__ == '__main__':
+    unittest.main()
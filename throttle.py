@@ -0,0 +1,129 @@
+"""Request coalescing and rate limiting for calls to the upstream API."""
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import REGISTRY, observe_stage
+
+COALESCED = REGISTRY.counter(
+    'huabei_fetch_coalesced_total', 'Fetches that waited for an identical fetch already in flight.')
+THROTTLED = REGISTRY.counter(
+    'huabei_fetch_throttled_total', 'Upstream requests delayed by the rate limiter, by what they waited for.',
+    ('limit',))
+THROTTLE_TIMEOUTS = REGISTRY.counter(
+    'huabei_fetch_throttle_timeouts_total', 'Fetches that gave up waiting, by what they waited for.', ('limit',))
+
+# Waits shorter than this are not counted as throttled
+THROTTLE_THRESHOLD = 0.001
+
+class ThrottleTimeout(TimeoutError):
+    """Raised when a request waits longer than allowed for the limiter or an in-flight fetch."""
+
+class RateLimiter:
+    """A token bucket of rate requests per second (up to burst at once) plus a concurrency cap.
+
+    acquire() blocks until a request may start and holds one of the
+    concurrency slots until the block ends. rate or concurrency of None
+    leaves that limit off. Waiting longer than timeout seconds raises
+    ThrottleTimeout.
+    """
+
+    def __init__(self, rate=None, burst=None, concurrency=None, timeout=30.0):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+
+    def _take_token(self, deadline):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+
+        if self._slots is not None:
+            if not self._slots.acquire(timeout=max(0.0, deadline - start)):
+                THROTTLE_TIMEOUTS.inc(limit='concurrency')
+                raise ThrottleTimeout(f"Waited too long for one of {self.concurrency} upstream connections")
+            if time.monotonic() - start > THROTTLE_THRESHOLD:
+                THROTTLED.inc(limit='concurrency')
+        try:
+            if self.rate:
+                token_start = time.monotonic()
+                if not self._take_token(deadline):
+                    THROTTLE_TIMEOUTS.inc(limit='rate')
+                    raise ThrottleTimeout(f"Waited too long for the upstream rate limit ({self.rate:g}/s)")
+                if time.monotonic() - token_start > THROTTLE_THRESHOLD:
+                    THROTTLED.inc(limit='rate')
+            observe_stage('throttle', time.monotonic() - start)
+            yield
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Run a function once per key at a time, sharing its outcome with concurrent callers.
+
+    The first caller for a key runs fn; callers arriving while it runs wait
+    for it (up to timeout seconds, then ThrottleTimeout) and get the same
+    result or exception. Nothing is kept once the call finishes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            COALESCED.inc()
+            if not call.done.wait(timeout):
+                THROTTLE_TIMEOUTS.inc(limit='coalesced')
+                raise ThrottleTimeout(f"Waited too long for the fetch of {key} already in flight")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
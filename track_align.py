@@ -0,0 +1,91 @@
+"""Time-indexed alignment of altitude_arr/speed_arr samples onto coordinates."""
+import math
+from array import array
+from bisect import bisect_right
+
+NAN = float('nan')
+# Index entries interp steps over before binary searching for a query
+WALK_STEPS = 4
+
+def time_index(times, values):
+    """Build a sorted (times, values) index, dropping samples with a missing time or value."""
+    pairs = sorted((t, v) for t, v in zip(times, values) if t == t and v == v)
+    return array('d', (t for t, _ in pairs)), array('d', (v for _, v in pairs))
+
+def interp(x, xp, fp):
+    """Linearly interpolate fp(xp) at each x, like numpy.interp.
+
+    xp must be sorted ascending. Queries outside xp are clamped to the end
+    values; NaN queries and an empty index give NaN. Ascending queries (the
+    usual case, point times along a run) are merged with xp in one forward
+    pass that steps to the next query and only binary searches over long
+    gaps; a query smaller than the one before it is searched from scratch.
+    """
+    if not xp:
+        return array('d', [NAN] * len(x))
+    last = len(xp) - 1
+    result = array('d')
+    # i is bisect_right(xp, previous) for the previous non-NaN query
+    i = 0
+    previous = -math.inf
+    for value in x:
+        if value != value:
+            result.append(NAN)
+            continue
+        if value >= previous:
+            # A few steps cover the next query; a longer way is binary searched
+            stop = i + WALK_STEPS
+            while i <= last and xp[i] <= value:
+                i += 1
+                if i == stop:
+                    i = bisect_right(xp, value, i)
+                    break
+        else:
+            i = bisect_right(xp, value)
+        previous = value
+        if i == 0:
+            result.append(fp[0])
+        elif i > last:
+            result.append(fp[last])
+        else:
+            x0 = xp[i - 1]
+            x1 = xp[i]
+            if x1 == x0:
+                result.append(fp[i])
+            else:
+                result.append(fp[i - 1] + (fp[i] - fp[i - 1]) * (value - x0) / (x1 - x0))
+    return result
+
+def coordinate_times(count, sample_times):
+    """Spread count coordinates over the run's sampled times.
+
+    Coordinates and altitude_arr samples both cover the whole run in order,
+    so coordinate i sits at fractional sample position i * (m - 1) / (count - 1).
+    Its time is interpolated between the samples around that position, which
+    follows uneven sampling instead of assuming 1 Hz.
+    """
+    positions, times = time_index(range(len(sample_times)), sample_times)
+    if not times:
+        return array('d', [NAN] * count)
+    span = len(sample_times) - 1
+    if count == 1 or span == 0:
+        return interp([0.0] * count, positions, times)
+    scale = span / (count - 1)
+    return interp([i * scale for i in range(count)], positions, times)
+
+def align_samples(count, alt_times, alt_eles, speed_times=(), speeds=()):
+    """Give count coordinates an interpolated time, elevation and speed.
+
+    Returns (times, eles, speeds) arrays of length count; times are rounded
+    to whole seconds and elevations to 0.1 m. Values that cannot be
+    interpolated are NaN.
+    """
+    times = array('d', (round(t) if t == t else NAN for t in coordinate_times(count, alt_times)))
+    ele_times, ele_values = time_index(alt_times, alt_eles)
+    eles = array('d', (round(e, 1) if e == e else NAN for e in interp(times, ele_times, ele_values)))
+    speed_index = time_index(speed_times, speeds)
+    return times, eles, align_speeds(times, *speed_index)
+
+def align_speeds(times, speed_times, speeds):
+    """Interpolate speed samples at the given point times."""
+    return interp(times, speed_times, speeds)
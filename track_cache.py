@@ -0,0 +1,155 @@
+"""On-disk cache of raw Huabei API responses."""
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'HUABEI_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'huabei2slopes'))
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE = 90 * 24 * 3600  # seconds since an entry was last used
+
+# Run an eviction pass after this many writes from one process
+EVICT_EVERY = 32
+
+class TrackCache:
+    """Content-addressed, gzip-compressed cache of API responses.
+
+    Entries are keyed by (endpoint, track_uuid) and stored as
+    <dir>/<aa>/<sha256>.json.gz. Writes go to a temporary file that is then
+    renamed into place, so several processes can share one directory. Each hit
+    bumps the entry's mtime, which eviction uses as the LRU order.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _path(self, endpoint, track_uuid):
+        key = hashlib.sha256(f"{endpoint}/{track_uuid}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, endpoint, track_uuid):
+        """Return the cached response body as bytes, or None if it is not cached."""
+        path = self._path(endpoint, track_uuid)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                self._remove(path)
+                return None
+            with gzip.open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except (OSError, EOFError, zlib.error):
+            # Missing, evicted by another worker, truncated or corrupt
+            return None
+        return content
+
+    def lookup(self, track_uuid, endpoints):
+        """Return the first cached body for track_uuid among endpoints, counting a hit or miss."""
+        for endpoint in endpoints:
+            content = self.get(endpoint, track_uuid)
+            if content is not None:
+                self._count('hits')
+                return content
+        self._count('misses')
+        return None
+
+    def put(self, endpoint, track_uuid, content):
+        """Store a response body atomically."""
+        with self.writer(endpoint, track_uuid) as f:
+            f.write(content)
+
+    @contextmanager
+    def writer(self, endpoint, track_uuid):
+        """Yield a file to write a response body to in pieces.
+
+        The entry is stored atomically when the block exits normally; if it
+        raises, nothing is stored.
+        """
+        path = self._path(endpoint, track_uuid)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                yield f
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self.writes += 1
+            evict = self.writes % EVICT_EVERY == 1
+        if evict:
+            self.evict()
+
+    def _entries(self):
+        """Yield (mtime, size, path) for every cache entry."""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json.gz'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones until under max_bytes."""
+        now = time.time()
+        entries = []
+        total = 0
+        removed = 0
+        for mtime, size, path in self._entries():
+            if now - mtime > self.max_age:
+                removed += self._remove(path)
+            else:
+                entries.append((mtime, size, path))
+                total += size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            removed += self._remove(path)
+            total -= size
+
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            # Another worker got there first
+            return 0
+
+    def stats(self):
+        """Return the hit/miss/write/eviction counters of this process."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+            }
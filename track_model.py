@@ -0,0 +1,369 @@
+"""Compact, array-backed model of a parsed Huabei track."""
+import datetime
+import logging
+import re
+from array import array
+from collections import namedtuple
+
+from instrumentation import span
+from track_align import align_samples, align_speeds, time_index
+
+# Fast path for the "YYYY-MM-DD HH:MM[:SS]" timestamps used by altitude_arr
+_TIMESTAMP_RE = re.compile(r'(\d{4}-\d{2}-\d{2}) (\d{2}):(\d{2})(?::(\d{2}))?', re.ASCII)
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+
+NAN = float('nan')
+NO_STATUS = -1
+
+# Per-point arrays that are dropped from the metadata kept on a Track
+POINT_ARRAYS = ('track_detail', 'altitude_arr', 'speed_arr', 'status_arr', 'dasheds')
+
+log = logging.getLogger(__name__)
+
+def parse_timestamp(timestamp_str):
+    """Parse timestamp string to datetime object."""
+    try:
+        # Format is likely "YYYY-MM-DD HH:MM:SS"
+        return datetime.datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        # Try alternative formats if necessary
+        try:
+            return datetime.datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M")
+        except ValueError:
+            return None
+
+def parse_timestamps(timestamp_strs):
+    """Parse a run's timestamp strings into epoch seconds in a single pass.
+
+    The timestamps are naive local times, so the result counts seconds as if
+    they were UTC. Entries that parse_timestamp would reject (or that are not
+    strings) become None.
+    """
+    day_cache = {}
+    epochs = []
+    for timestamp_str in timestamp_strs:
+        if not isinstance(timestamp_str, str):
+            epochs.append(None)
+            continue
+        
+        match = _TIMESTAMP_RE.fullmatch(timestamp_str)
+        if match:
+            # All points of a run share one or two dates, so look those up once
+            date_str, hour, minute, second = match.groups()
+            day = day_cache.get(date_str)
+            if day is None:
+                try:
+                    day = datetime.date.fromisoformat(date_str).toordinal() - _EPOCH_ORDINAL
+                except ValueError:
+                    day = False
+                day_cache[date_str] = day
+            hour, minute, second = int(hour), int(minute), int(second or 0)
+            if day is not False and hour < 24 and minute < 60 and second < 60:
+                epochs.append(day * 86400 + hour * 3600 + minute * 60 + second)
+                continue
+        
+        # Unusual layouts (unpadded fields, etc.) go through strptime
+        timestamp = parse_timestamp(timestamp_str)
+        if timestamp:
+            epochs.append(int((timestamp - _EPOCH).total_seconds()))
+        else:
+            epochs.append(None)
+    return epochs
+
+def format_timestamps(epochs, timezone_offset=0):
+    """Format epoch seconds from parse_timestamps as GPX times shifted by timezone_offset hours."""
+    tz_suffix = f"{timezone_offset:+03d}:00"
+    shift = timezone_offset * 3600
+    day_cache = {}
+    times = []
+    for epoch in epochs:
+        # None or NaN marks a point without a time
+        if epoch is None or epoch != epoch:
+            times.append(None)
+            continue
+        day, seconds = divmod(int(epoch) + shift, 86400)
+        date_text = day_cache.get(day)
+        if date_text is None:
+            date_text = datetime.date.fromordinal(day + _EPOCH_ORDINAL).strftime('%Y-%m-%d')
+            day_cache[day] = date_text
+        hour, seconds = divmod(seconds, 3600)
+        minute, second = divmod(seconds, 60)
+        times.append(f"{date_text}T{hour:02d}:{minute:02d}:{second:02d}{tz_suffix}")
+    return times
+
+def format_column(values, integral):
+    """Format a run column as strings the way the API's JSON numbers print; NaN becomes None."""
+    if integral:
+        return [str(int(value)) if value == value else None for value in values]
+    return [str(value) if value == value else None for value in values]
+
+def naive_epoch(timestamp):
+    """Convert a naive datetime to the epoch seconds used by parse_timestamps."""
+    return int((timestamp - _EPOCH).total_seconds())
+
+def _number(value):
+    """Return value as a float, or NaN if it is not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+def _is_integral(values):
+    """True if every present value came from an int, so it formats without a decimal point."""
+    return all(type(value) is int for value in values if value is not None)
+
+class Run:
+    """One ski run stored as typed per-point columns.
+
+    lon, lat, ele, time (epoch seconds, see parse_timestamps) and speed
+    (km/h) are array('d') with NaN for missing values; status is array('b')
+    with NO_STATUS for missing values. The *_integral flags record whether
+    the API sent whole numbers, so writers can format them the same way.
+    """
+
+    __slots__ = ('lon', 'lat', 'ele', 'time', 'speed', 'status',
+                 'lon_integral', 'lat_integral', 'ele_integral')
+
+    def __init__(self):
+        self.lon = array('d')
+        self.lat = array('d')
+        self.ele = array('d')
+        self.time = array('d')
+        self.speed = array('d')
+        self.status = array('b')
+        self.lon_integral = False
+        self.lat_integral = False
+        self.ele_integral = False
+
+    def __len__(self):
+        return len(self.lon)
+
+class Track:
+    """A parsed track: its runs plus the response without the per-point arrays.
+
+    metadata keeps the shape of the API response ({'data': {'track': ...,
+    'ski_ranch': ..., ...}}), so get_track_name and get_default_filename work
+    on it unchanged.
+    """
+
+    __slots__ = ('metadata', 'runs')
+
+    def __init__(self, metadata, runs):
+        self.metadata = metadata
+        self.runs = runs
+
+    @property
+    def point_count(self):
+        return sum(len(run) for run in self.runs)
+
+def get_track_name(track_data):
+    """Build the track name shown in the GPX metadata."""
+    if isinstance(track_data, Track):
+        track_data = track_data.metadata
+    if 'data' in track_data and 'track' in track_data['data']:
+        track_info = track_data['data']['track']
+        # Use the formatted date-time if available
+        if 'start_at_str_format' in track_info:
+            track_name = f"Ski Track - {track_info['start_at_str_format']}"
+        else:
+            track_name = f"Ski Track - {track_info.get('start_at_str', 'Unknown')}"
+        
+        # Get resort name if available
+        if 'ski_ranch' in track_data['data'] and 'name' in track_data['data']['ski_ranch']:
+            resort_name = track_data['data']['ski_ranch']['name']
+            track_name = f"{track_name} at {resort_name}"
+    else:
+        track_name = "Ski Track"
+    return track_name
+
+def subset_run(run, indices):
+    """Return a new Run holding only the points at indices."""
+    result = Run()
+    for column in ('lon', 'lat', 'ele', 'time', 'speed', 'status'):
+        values = getattr(run, column)
+        setattr(result, column, array(values.typecode, (values[i] for i in indices)))
+    result.lon_integral = run.lon_integral
+    result.lat_integral = run.lat_integral
+    result.ele_integral = run.ele_integral
+    return result
+
+def _strip_point_arrays(track_data):
+    data = track_data.get('data', {})
+    metadata = {key: value for key, value in track_data.items() if key != 'data'}
+    if 'data' in track_data:
+        metadata['data'] = {key: value for key, value in data.items() if key not in POINT_ARRAYS}
+    return metadata
+
+def _resample_index(count, size):
+    """Nearest sample index for each of count points spread over size samples."""
+    if size == 0:
+        return [None] * count
+    if count == 1:
+        return [0]
+    scale = (size - 1) / (count - 1)
+    return [int(i * scale + 0.5) for i in range(count)]
+
+# One run's entry of each per-point array, converted to typed columns but not
+# yet matched up with the coordinates. count is the length of the raw entry.
+#   kept: indices of the usable coordinates, or None when all of them are
+#   integral (altitude): True if every elevation was a whole number, else an
+#     array('b') flagging the ones that were
+CoordColumns = namedtuple('CoordColumns', ['count', 'kept', 'lon', 'lat', 'lon_integral', 'lat_integral'])
+AltitudeColumns = namedtuple('AltitudeColumns', ['count', 'ele', 'time', 'integral'])
+SpeedColumns = namedtuple('SpeedColumns', ['count', 'speed', 'time'])
+StatusColumn = namedtuple('StatusColumn', ['count', 'status'])
+
+def coord_columns(coords):
+    """Convert one track_detail run; coordinates without lon and lat are left out."""
+    kept = [point_idx for point_idx, coord in enumerate(coords) if len(coord) >= 2]
+    if len(kept) == len(coords):
+        points = coords
+        kept = None
+    else:
+        points = [coords[point_idx] for point_idx in kept]
+    lons = [coord[0] for coord in points]
+    lats = [coord[1] for coord in points]
+    return CoordColumns(len(coords), kept, array('d', map(_number, lons)), array('d', map(_number, lats)),
+                        _is_integral(lons), _is_integral(lats))
+
+def _epoch_column(timestamp_strs):
+    return array('d', (NAN if epoch is None else epoch for epoch in parse_timestamps(timestamp_strs)))
+
+def altitude_columns(alt_run):
+    """Convert one altitude_arr run of [elevation, timestamp] samples."""
+    eles = [alt_point[0] if isinstance(alt_point, list) and len(alt_point) >= 1 else None
+            for alt_point in alt_run]
+    times = _epoch_column([alt_point[1] if isinstance(alt_point, list) and len(alt_point) >= 2 else None
+                           for alt_point in alt_run])
+    integral = _is_integral(eles) or array('b', (type(ele) is int or ele is None for ele in eles))
+    return AltitudeColumns(len(alt_run), array('d', map(_number, eles)), times, integral)
+
+def speed_columns(speed_run):
+    """Convert one speed_arr run of [speed, timestamp, ...] samples."""
+    speeds = [speed_point[0] if isinstance(speed_point, list) and speed_point else None
+              for speed_point in speed_run]
+    times = _epoch_column([speed_point[1] if isinstance(speed_point, list) and len(speed_point) >= 2 else None
+                           for speed_point in speed_run])
+    return SpeedColumns(len(speed_run), array('d', map(_number, speeds)), times)
+
+def status_column(status_run):
+    """Convert one status_arr run; anything but a small int becomes NO_STATUS."""
+    statuses = [status_point[0] if isinstance(status_point, list) and status_point else status_point
+                for status_point in status_run]
+    return StatusColumn(len(status_run), array('b', (status if type(status) is int and -128 <= status < 128
+                                                     else NO_STATUS for status in statuses)))
+
+def _select(values, indices, count):
+    """values at indices (all of the first count when indices is None), as a new array."""
+    if indices is None:
+        return values[:count]
+    return array(values.typecode, (values[i] for i in indices))
+
+def assemble_run(coords, altitude, speed, status, default_elevation, start_time, first_point):
+    """Build a Run from the columns of one run's entries in each per-point array.
+
+    When altitude_arr has one entry per coordinate they are matched by index.
+    Otherwise each coordinate's time, elevation and speed are interpolated
+    from the time-indexed samples (see track_align). Coordinates still left
+    without data get the track's max altitude and start_time + their position
+    in the track, one second apart.
+    """
+    run = Run()
+    run.lon = coords.lon
+    run.lat = coords.lat
+    run.lon_integral = coords.lon_integral
+    run.lat_integral = coords.lat_integral
+    kept = range(coords.count) if coords.kept is None else coords.kept
+    
+    if altitude.count != coords.count and any(epoch == epoch for epoch in altitude.time):
+        run.time, run.ele, _ = align_samples(len(kept), altitude.time, altitude.ele)
+        run.ele_integral = False
+    elif altitude.count >= coords.count:
+        run.ele = _select(altitude.ele, coords.kept, coords.count)
+        run.time = _select(altitude.time, coords.kept, coords.count)
+        run.ele_integral = altitude.integral is True or all(altitude.integral[i] for i in kept)
+    else:
+        # Points past the end of altitude_arr fall back to the default elevation
+        count = altitude.count
+        default = _number(default_elevation)
+        run.ele = array('d', (altitude.ele[i] if i < count else default for i in kept))
+        run.time = array('d', (altitude.time[i] if i < count else NAN for i in kept))
+        default_integral = type(default_elevation) is int or default_elevation is None
+        run.ele_integral = all(
+            (altitude.integral is True or altitude.integral[i]) if i < count else default_integral
+            for i in kept)
+    
+    # Fall back to one second per point from the track start
+    if start_time:
+        for i, point_idx in enumerate(kept):
+            if run.time[i] != run.time[i]:
+                run.time[i] = naive_epoch(datetime.datetime.fromtimestamp(start_time + first_point + point_idx))
+    
+    if speed.count == coords.count:
+        run.speed = _select(speed.speed, coords.kept, coords.count)
+    else:
+        run.speed = align_speeds(run.time, *time_index(speed.time, speed.speed))
+    
+    if status.count == coords.count:
+        run.status = _select(status.status, coords.kept, coords.count)
+    else:
+        run.status = array('b', (NO_STATUS if i is None else status.status[i]
+                                 for i in _resample_index(len(kept), status.count)))
+    return run
+
+def _build_run(coords, alt_run, speed_run, status_run, default_elevation, start_time, first_point):
+    """Turn one run's raw lists into a Run (see assemble_run)."""
+    return assemble_run(coord_columns(coords), altitude_columns(alt_run), speed_columns(speed_run),
+                        status_column(status_run), default_elevation, start_time, first_point)
+
+def load_track(track_data):
+    """Parse and validate a track once, from fetch_track_data or load_json_file output.
+
+    A Track is returned unchanged. Raises ValueError if there is no
+    coordinate data.
+    """
+    if isinstance(track_data, Track):
+        return track_data
+
+    with span('convert') as convert_span:
+        track = _parse_track(track_data)
+        convert_span.set(runs=len(track.runs), points=track.point_count)
+    return track
+
+def _parse_track(track_data):
+    data = track_data.get('data', {})
+    runs = data.get('track_detail') or []
+    altitude_data = data.get('altitude_arr') or []
+    speed_data = data.get('speed_arr') or []
+    status_data = data.get('status_arr') or []
+
+    if runs:
+        total_points = sum(len(run) for run in runs)
+        log.info("Found %d ski runs with a total of %d coordinate points", len(runs), total_points)
+    if altitude_data and isinstance(altitude_data[0], list) and len(altitude_data[0]) >= 2:
+        # If altitude_arr exists and has the expected format
+        log.debug("Found altitude/time data")
+
+    if not runs:
+        raise ValueError("No coordinate data found in the track data")
+
+    track_info = data.get('track', {})
+    # Get the max altitude for default elevation if needed
+    default_elevation = track_info.get('max_altitude_meter')
+    # Get time offset from track start time if available
+    start_time = track_info.get('start_at')
+
+    parsed_runs = []
+    first_point = 0
+    for run_idx, coords in enumerate(runs):
+        run = _build_run(
+            coords,
+            altitude_data[run_idx] if run_idx < len(altitude_data) else [],
+            speed_data[run_idx] if run_idx < len(speed_data) else [],
+            status_data[run_idx] if run_idx < len(status_data) else [],
+            default_elevation, start_time, first_point)
+        first_point += len(run)
+        parsed_runs.append(run)
+
+    return Track(_strip_point_arrays(track_data), parsed_runs)
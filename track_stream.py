@@ -0,0 +1,323 @@
+"""Incremental decoding of a Huabei API response into a Track while it downloads.
+
+json.loads needs the whole body and turns every point into a Python list
+before conversion can start. TrackStreamDecoder instead walks the top two
+levels of the response itself and decodes the per-point arrays one run at a
+time, converting each run's entry to typed columns (see track_model) as soon
+as it arrives. A run is assembled once its entry in every per-point array has
+been read, so with the API's key order run N is built while run N+1 of
+status_arr is still downloading, and no more than one run's raw JSON is held
+at once.
+"""
+import codecs
+import json
+import logging
+import re
+import time
+
+from instrumentation import observe_stage
+from track_model import (POINT_ARRAYS, Track, altitude_columns, assemble_run, coord_columns, speed_columns,
+                         status_column)
+
+# Per-run arrays decoded element by element, and how each element is converted
+RUN_COLUMNS = {
+    'track_detail': coord_columns,
+    'altitude_arr': altitude_columns,
+    'speed_arr': speed_columns,
+    'status_arr': status_column,
+}
+# Columns of a per-run array that has no entry for a run
+_MISSING = {
+    'altitude_arr': altitude_columns([]),
+    'speed_arr': speed_columns([]),
+    'status_arr': status_column([]),
+}
+DEFAULT_CHUNK_BYTES = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+# Parser states
+_VALUE, _KEY, _FIRST_KEY, _COLON, _AFTER_VALUE, _ELEMENT, _FIRST_ELEMENT, _AFTER_ELEMENT, _END = range(9)
+
+log = logging.getLogger(__name__)
+
+class _NeedMore(Exception):
+    """The buffered text ends before the next token or value does."""
+
+class TrackStreamDecoder:
+    """Decode an API response fed in byte chunks into a Track.
+
+    feed() returns the runs completed by that chunk, so a caller can start on
+    them before the response has ended; close() returns the Track. Malformed
+    JSON raises ValueError (json.JSONDecodeError for bad values), as does a
+    response without coordinates. Only the top-level object and its 'data'
+    object are walked; any other value is decoded whole with the json module.
+    """
+
+    def __init__(self):
+        self.runs = []
+        self.bytes = 0
+        self.decode_seconds = 0.0
+        self.convert_seconds = 0.0
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._pending = []
+        self._pending_size = 0
+        self._need = 0  # buffered characters required before retrying a value decode
+        self._closed = False
+        self._state = _VALUE
+        self._frames = []  # 'top', 'data' or the name of a per-run array
+        self._key = None
+        self._top = {}
+        self._data = None
+        self._entries = {key: [] for key in RUN_COLUMNS}
+        self._finished = set()  # per-run arrays read to their end
+        self._first_point = 0
+
+    def feed(self, chunk):
+        """Decode a chunk of the response body and return the runs it completed."""
+        start = time.perf_counter()
+        self.bytes += len(chunk)
+        text = self._text.decode(chunk)
+        if text:
+            self._pending.append(text)
+            self._pending_size += len(text)
+        completed = len(self.runs)
+        self._parse()
+        self.decode_seconds += time.perf_counter() - start
+        return self.runs[completed:]
+
+    def close(self):
+        """Finish decoding and return the Track; raises ValueError if the response is incomplete."""
+        start = time.perf_counter()
+        self._closed = True
+        text = self._text.decode(b'', final=True)
+        if text:
+            self._pending.append(text)
+            self._pending_size += len(text)
+        self._parse()
+        if self._state != _END:
+            raise ValueError("The response ended before the JSON document did")
+        self.decode_seconds += time.perf_counter() - start
+        self.decode_seconds -= self.convert_seconds
+
+        if not self._entries['track_detail']:
+            raise ValueError("No coordinate data found in the track data")
+        log.info("Found %d ski runs with a total of %d coordinate points", len(self.runs),
+                 sum(len(run) for run in self.runs))
+        observe_stage('json_decode', self.decode_seconds, bytes=self.bytes, streamed=True)
+        observe_stage('convert', self.convert_seconds, runs=len(self.runs), points=self._first_point,
+                      streamed=True)
+        return Track(self._top, self.runs)
+
+    # Tokenizing
+
+    def _available(self):
+        return len(self._buffer) - self._pos + self._pending_size
+
+    def _fill(self):
+        self._buffer = self._buffer[self._pos:] + ''.join(self._pending)
+        self._pos = 0
+        self._pending = []
+        self._pending_size = 0
+
+    def _peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._pending:
+                if self._closed:
+                    raise ValueError("The response ended before the JSON document did")
+                raise _NeedMore
+            self._fill()
+
+    def _value(self):
+        """Decode the JSON value at the current position.
+
+        A value that runs to the end of the buffer may be cut short (a number
+        especially), so it only counts once more text follows it. Failed
+        attempts wait for the buffer to double, which keeps a large value
+        arriving in many chunks linear to decode.
+        """
+        self._peek()
+        if self._available() < self._need and not self._closed:
+            raise _NeedMore
+        self._fill()
+        try:
+            value, end = _decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if self._closed:
+                raise
+            value = end = None
+        if end is None or (end == len(self._buffer) and not self._closed):
+            self._need = 2 * (len(self._buffer) - self._pos) + 1
+            raise _NeedMore
+        self._need = 0
+        self._pos = end
+        return value
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} in the response, found {self._buffer[self._pos]!r}")
+        self._pos += 1
+
+    # Parsing
+
+    def _parse(self):
+        try:
+            while self._step():
+                pass
+        except _NeedMore:
+            pass
+
+    def _step(self):
+        """Consume one token or value; returns False once the document has ended."""
+        state = self._state
+        if state == _END:
+            if self._closed and self._peek_end():
+                raise ValueError("Unexpected data after the JSON document")
+            return False
+
+        if state == _VALUE:
+            self._read_value()
+        elif state in (_KEY, _FIRST_KEY):
+            if state == _FIRST_KEY and self._peek() == '}':
+                self._pos += 1
+                self._end_frame()
+            else:
+                if self._peek() != '"':
+                    raise ValueError(f"Expected a key in the response, found {self._buffer[self._pos]!r}")
+                self._key = self._value()
+                self._state = _COLON
+        elif state == _COLON:
+            self._expect(':')
+            self._state = _VALUE
+        elif state == _AFTER_VALUE:
+            char = self._peek()
+            self._pos += 1
+            if char == ',':
+                self._state = _KEY
+            elif char == '}':
+                self._end_frame()
+            else:
+                raise ValueError(f"Expected ',' or '}}' in the response, found {char!r}")
+        elif state in (_ELEMENT, _FIRST_ELEMENT):
+            if state == _FIRST_ELEMENT and self._peek() == ']':
+                self._pos += 1
+                self._end_frame()
+            else:
+                self._add_entry(self._frames[-1], self._value())
+                self._state = _AFTER_ELEMENT
+        elif state == _AFTER_ELEMENT:
+            char = self._peek()
+            self._pos += 1
+            if char == ',':
+                self._state = _ELEMENT
+            elif char == ']':
+                self._end_frame()
+            else:
+                raise ValueError(f"Expected ',' or ']' in the response, found {char!r}")
+        return True
+
+    def _peek_end(self):
+        """True if anything but whitespace follows the document."""
+        self._fill()
+        return _WHITESPACE.match(self._buffer, self._pos).end() < len(self._buffer)
+
+    def _read_value(self):
+        frame = self._frames[-1] if self._frames else None
+        char = self._peek()
+        if frame is None:
+            if char != '{':
+                raise ValueError("The response is not a JSON object")
+            self._pos += 1
+            self._frames.append('top')
+            self._state = _FIRST_KEY
+        elif frame == 'top' and self._key == 'data' and char == '{':
+            self._pos += 1
+            self._data = self._top['data'] = {}
+            self._frames.append('data')
+            self._state = _FIRST_KEY
+        elif frame == 'data' and self._key in RUN_COLUMNS and char == '[':
+            self._pos += 1
+            self._frames.append(self._key)
+            self._state = _FIRST_ELEMENT
+        else:
+            key = self._key
+            value = self._value()
+            if frame == 'top':
+                self._top[key] = value
+            elif key in RUN_COLUMNS:
+                # null or another non-array counts as no entries
+                self._finished.add(key)
+            elif key not in POINT_ARRAYS:
+                self._data[key] = value
+                if key == 'track':
+                    self._assemble_ready()
+            self._state = _AFTER_VALUE
+
+    def _end_frame(self):
+        frame = self._frames.pop()
+        if frame in RUN_COLUMNS:
+            self._finished.add(frame)
+        if frame == 'data':
+            self._finished.update(RUN_COLUMNS)
+        if frame != 'top':
+            self._assemble_ready()
+        self._state = _AFTER_VALUE if self._frames else _END
+
+    # Runs
+
+    def _add_entry(self, key, entry):
+        start = time.perf_counter()
+        self._entries[key].append(RUN_COLUMNS[key](entry))
+        self.convert_seconds += time.perf_counter() - start
+        self._assemble_ready()
+
+    def _run_columns(self, run_idx):
+        """The other arrays' columns for run run_idx, or None while one may still be coming."""
+        columns = []
+        for key, missing in _MISSING.items():
+            entries = self._entries[key]
+            if run_idx < len(entries):
+                columns.append(entries[run_idx])
+            elif key in self._finished:
+                columns.append(missing)
+            else:
+                return None
+        return columns
+
+    def _assemble_ready(self):
+        """Build every run whose entries have all been read."""
+        # The track's start time and max altitude are needed to fill gaps
+        if self._data is None or ('track' not in self._data and 'data' in self._frames):
+            return
+        start = time.perf_counter()
+        track_info = self._data.get('track', {})
+        coords = self._entries['track_detail']
+        while len(self.runs) < len(coords):
+            run_idx = len(self.runs)
+            columns = self._run_columns(run_idx)
+            if columns is None:
+                break
+            run = assemble_run(coords[run_idx], *columns, track_info.get('max_altitude_meter'),
+                               track_info.get('start_at'), self._first_point)
+            # The columns are not needed once the run is built
+            for entries in self._entries.values():
+                if run_idx < len(entries):
+                    entries[run_idx] = None
+            self._first_point += len(run)
+            self.runs.append(run)
+            log.debug("Decoded RUN %d with %d points", run_idx + 1, len(run))
+        self.convert_seconds += time.perf_counter() - start
+
+def load_track_stream(chunks):
+    """Decode an iterable of response body chunks into a Track."""
+    decoder = TrackStreamDecoder()
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder.close()
@@ -1,9 +1,42 @@
-from flask import Flask, render_template_string, request, send_file
+from flask import Flask, Response, g, jsonify, render_template_string, request, send_file, url_for
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import math
 import os
-import tempfile
-from converter_gpx import process_track, handle_duplicate_filenames
+import unicodedata
+from urllib.parse import quote
+from content_encoding import iter_encoded, negotiate_encoding
+from converter_gpx import (OUTPUT_FORMATS, extract_track_uuid, fetch_urls, get_default_filename, iter_output,
+                           plan_outputs, unique_filenames, with_extension)
+from instrumentation import PROFILE_MODES, REGISTRY, RequestProfiler, configure_logging
+from result_cache import CachedResult, cache_chunks, get_result_cache, result_key
+from simplify import METHODS, simplify_track
+from track_model import load_track
+from job_queue import JobQueue, QueueFull
+from preview import (DEFAULT_PREVIEW_POINTS, DEFAULT_PREVIEW_SIZE, MAX_PREVIEW_SIZE, PREVIEW_FORMATS, build_pyramid,
+                     dump_pyramid, load_pyramid, pick_level, preview_key, render_preview)
+from zip_stream import iter_zip, spool_chunks, write_zip
 
 app = Flask(__name__)
+log = logging.getLogger(__name__)
+
+# Requests carrying X-Profile: cpu|memory and this token in X-Profile-Token are profiled
+PROFILE_TOKEN = os.environ.get('HUABEI_PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('HUABEI_PROFILE_DIR')
+# Larger request bodies are refused with 413 before the form is parsed
+MAX_BODY_BYTES = int(os.environ.get('HUABEI_MAX_BODY_BYTES', 256 * 1024))
+# Links accepted in one conversion or job
+MAX_URLS = int(os.environ.get('HUABEI_MAX_URLS', 50))
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
+# Archive entry and response header listing the tracks /api/convert could not convert
+ERRORS_ENTRY = 'errors.json'
+ERRORS_HEADER = 'X-Conversion-Errors'
+
+HTTP_REQUESTS = REGISTRY.counter('huabei_http_requests_total', 'HTTP requests by route and status.',
+                                 ('route', 'status'))
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -67,15 +100,38 @@ HTML_TEMPLATE = """
         }
         .url-item {
             display: flex;
+            flex-wrap: wrap;
             align-items: center;
             margin: 10px 0;
         }
+        .url-item .url-input {
+            flex: 1;
+        }
+        .preview-btn {
+            background-color: #2196F3;
+            color: white;
+            padding: 5px 10px;
+            border: none;
+            border-radius: 4px;
+            cursor: pointer;
+            margin-left: 10px;
+        }
+        .preview {
+            flex-basis: 100%;
+            max-width: 320px;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+        }
         .timezone-select {
             padding: 10px;
             margin: 10px 0;
             border: 1px solid #ddd;
             border-radius: 4px;
         }
+        .option {
+            display: block;
+            margin: 10px 0;
+        }
         .message {
             margin: 20px 0;
             padding: 10px;
@@ -88,6 +144,12 @@ HTML_TEMPLATE = """
         .error {
             background-color: #f2dede;
             color: #a94442;
+            white-space: pre-line;
+        }
+        .progress {
+            background-color: #d9edf7;
+            color: #31708f;
+            white-space: pre-line;
         }
     </style>
 </head>
@@ -99,7 +161,9 @@ HTML_TEMPLATE = """
             <div id="urlList" class="url-list">
                 <div class="url-item">
                     <input type="text" name="urls[]" class="url-input" placeholder="输入滑呗分享链接">
+                    <button type="button" class="preview-btn" onclick="previewUrl(this)">预览</button>
                     <button type="button" class="remove-btn" onclick="removeUrl(this)">删除</button>
+                    <img class="preview" alt="轨迹预览" hidden>
                 </div>
             </div>
             
@@ -133,8 +197,43 @@ HTML_TEMPLATE = """
                 <option value="12">UTC+12:00</option>
             </select>
             
+            <select name="compression" class="timezone-select">
+                <option value="0" selected>不压缩</option>
+                <option value="1">快速压缩</option>
+                <option value="6">标准压缩</option>
+                <option value="9">最大压缩</option>
+            </select>
+            
+            <select name="format" class="timezone-select">
+                <option value="gpx" selected>GPX</option>
+                <option value="fit">FIT（Garmin 等运动手表）</option>
+                <option value="geojson">GeoJSON（地图和分析工具）</option>
+                <option value="csv">CSV（表格）</option>
+            </select>
+            
+            <label class="option">
+                <input type="checkbox" name="merge_by_day" value="1">
+                同一天同一雪场的多段记录合并为一个文件
+            </label>
+            
+            <label class="option">
+                <input type="checkbox" name="gps_extensions" value="1">
+                写入速度和朝向（gte:gps），避免 Slopes 夸大最大速度
+            </label>
+            
+            <label class="option">
+                简化轨迹（米，留空不简化）
+                <input type="number" name="simplify" min="0" step="0.5" placeholder="例如 2">
+                <select name="simplify_method">
+                    <option value="dp" selected>Douglas-Peucker</option>
+                    <option value="vw">Visvalingam-Whyatt</option>
+                </select>
+            </label>
+            
             <button type="submit" class="submit-btn">转换并下载</button>
         </form>
+        
+        <div id="status" class="message {% if message %}error{% endif %}">{{ message }}</div>
     </div>
 
     <script>
@@ -144,7 +243,9 @@ HTML_TEMPLATE = """
             newUrlItem.className = 'url-item';
             newUrlItem.innerHTML = `
                 <input type="text" name="urls[]" class="url-input" placeholder="输入滑呗分享链接">
+                <button type="button" class="preview-btn" onclick="previewUrl(this)">预览</button>
                 <button type="button" class="remove-btn" onclick="removeUrl(this)">删除</button>
+                <img class="preview" alt="轨迹预览" hidden>
             `;
             urlList.appendChild(newUrlItem);
         }
@@ -155,93 +256,541 @@ HTML_TEMPLATE = """
                 button.parentElement.remove();
             }
         }
+
+        // Draw the track behind a link before converting it, to check it is the right one
+        function previewUrl(button) {
+            const item = button.parentElement;
+            const url = item.querySelector('.url-input').value.trim();
+            const image = item.querySelector('.preview');
+            if (!url) {
+                return;
+            }
+            image.onload = () => { image.hidden = false; };
+            image.onerror = () => {
+                image.hidden = true;
+                showStatus('无法预览：' + url, 'error');
+            };
+            image.src = '/preview?track=' + encodeURIComponent(url);
+        }
+
+        function showStatus(text, className) {
+            const status = document.getElementById('status');
+            status.className = 'message ' + className;
+            status.textContent = text;
+        }
+
+        // Submit as a background job and poll it instead of waiting on one long request
+        document.getElementById('urlForm').addEventListener('submit', async function (event) {
+            event.preventDefault();
+            const response = await fetch('/jobs', {method: 'POST', body: new FormData(this)});
+            const job = await response.json();
+            if (!response.ok) {
+                showStatus(job.error, 'error');
+                return;
+            }
+            pollJob(job);
+        });
+
+        async function pollJob(job) {
+            const response = await fetch(job.status_url);
+            const state = await response.json();
+            if (!response.ok) {
+                showStatus(state.error, 'error');
+                return;
+            }
+            const lines = state.progress
+                .map((entry, i) => entry.status === 'pending' ? '' :
+                     `URL ${i + 1}: ${entry.error || entry.filename}`)
+                .filter(line => line);
+            if (state.status === 'done') {
+                showStatus(`转换完成 ${state.completed}/${state.total}\\n` + lines.join('\\n'), 'success');
+                window.location = job.download_url;
+            } else if (state.status === 'failed') {
+                showStatus(state.error, 'error');
+            } else {
+                showStatus(`正在转换 ${state.completed}/${state.total}\\n` + lines.join('\\n'), 'progress');
+                setTimeout(() => pollJob(job), 1000);
+            }
+        }
     </script>
 </body>
 </html>
 """
 
+def prepare_batch(urls, timezone, on_progress=None, merge_by_day=False, gps_extensions=False,
+                  simplify=None, simplify_method='dp', output_format='gpx', always_number=True):
+    """Fetch the URLs and resolve every archive entry name up front.
+
+    Returns (fetched_count, entries, error_messages). entries lazily yields
+    (filename, chunks) pairs for iter_zip, each file in output_format;
+    error_messages also collects conversion errors hit while entries is
+    consumed. on_progress(index, filename, error) is called as each non-empty
+    URL finishes. merge_by_day merges tracks of the same day and resort into
+    one entry; simplify is a tolerance in metres for simplify_track. Entry
+    names get a _001 style number, or only when repeated without always_number.
+    Each file is converted in full (see spool_chunks) before its entry is
+    yielded, so a track that fails part way is reported rather than truncated.
+    
+    Converted tracks come from the result cache when possible; single tracks
+    found there are not even fetched. New conversions are added to it.
+    """
+    # Skip empty URLs, keeping each URL's position for error messages
+    numbered_urls = [(i, url) for i, url in enumerate(urls, 1) if url.strip()]
+    log.info("Processing %d URLs", len(numbered_urls))
+    options = {'gps_extensions': gps_extensions, 'simplify': simplify, 'simplify_method': simplify_method,
+               'output_format': output_format}
+    track_uuids = [_track_uuid(url) for _, url in numbered_urls]
+    cache = get_result_cache()
+    
+    # Merged outputs depend on which tracks share a day, so they are only
+    # looked up once every track is fetched
+    cached = {}
+    if cache is not None and not merge_by_day:
+        for position, track_uuid in enumerate(track_uuids):
+            if track_uuid:
+                result = cache.get(result_key([track_uuid], timezone, **options))
+                if result is not None:
+                    cached[position] = (result, None)
+    missing = [position for position in range(len(numbered_urls)) if position not in cached]
+    fetched = dict(zip(missing, fetch_urls([numbered_urls[position][1] for position in missing])))
+    results = [cached.get(position) or fetched[position] for position in range(len(numbered_urls))]
+    units = plan_outputs(results, merge_by_day)
+    # Repeated names count up
+    filenames = unique_filenames([_default_filename(track, output_format) for _, track in units],
+                                 number_format='_{:03d}', always_number=always_number)
+    
+    error_messages = []  # Track error messages
+    
+    def report(positions, filename, error):
+        for position in positions:
+            i = numbered_urls[position][0]
+            if error:
+                error_msg = f"URL {i}: {error}"
+                log.warning("Error: %s", error_msg)
+                error_messages.append(error_msg)
+            if on_progress:
+                on_progress(position, filename, error)
+    
+    for position, (track_data, error) in enumerate(results):
+        if track_data is None:
+            report([position], None, error)
+    
+    def entries():
+        for (positions, track_data), filename in zip(units, filenames):
+            key = result_key([track_uuids[position] for position in positions], timezone, **options)
+            if merge_by_day and cache is not None:
+                track_data = cache.get(key) or track_data
+            if isinstance(track_data, CachedResult):
+                log.info("Adding cached output to zip: %s", filename)
+                yield filename, [track_data.content]
+                report(positions, filename, None)
+                continue
+            
+            # Convert the whole file before the entry is opened so a track that
+            # fails part way is left out and reported instead of truncated
+            try:
+                track = load_track(track_data)
+                if simplify:
+                    track = simplify_track(track, simplify, simplify_method)
+                chunks = spool_chunks(iter_output(track, output_format, timezone, gps_extensions))
+            except Exception as e:
+                report(positions, None, str(e) or "无法生成文件")
+                continue
+            if cache is not None:
+                chunks = cache_chunks(cache, key, _default_filename(track, output_format), chunks)
+            log.info("Adding to zip: %s", filename)
+            yield filename, chunks
+            report(positions, filename, None)
+    
+    return len(units), entries(), error_messages
+
+def _track_uuid(url):
+    try:
+        return extract_track_uuid(url)
+    except ValueError:
+        return None
+
+def _default_filename(track, output_format='gpx'):
+    if isinstance(track, CachedResult):
+        return track.filename
+    return with_extension(get_default_filename(track), output_format)
+
+def batch_key(urls, timezone, compresslevel, merge_by_day=False, **options):
+    """Identify the archive a batch produces; the same links and options give the same files.
+
+    Used as the archive's ETag and as the job id, so a resubmitted batch
+    finds the job and download URL of the first submission.
+    """
+    tracks = [_track_uuid(url) or url for url in urls if url.strip()]
+    payload = json.dumps([result_key(tracks, timezone, **options), bool(merge_by_day), compresslevel or 0])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _no_files_message(error_messages):
+    error_message = "没有成功转换的文件"
+    if error_messages:
+        error_message += "\n错误信息：\n" + "\n".join(error_messages)
+    return error_message
+
+def _started_entries(entries):
+    """entries with its first entry already converted, or None if no track converts.
+
+    Checked before a response is committed to, so a batch whose tracks all
+    fail gets the error messages rather than an empty archive.
+    """
+    first_entry = next(entries, None)
+    if first_entry is None:
+        return None
+    return itertools.chain([first_entry], entries)
+
+def _with_errors_entry(entries, error_messages):
+    """Yield entries, then an ERRORS_ENTRY listing error_messages if there are any by then."""
+    yield from entries
+    if error_messages:
+        yield ERRORS_ENTRY, [json.dumps(error_messages, ensure_ascii=False, indent=1).encode('utf-8')]
+
+def _output_options(form):
+    """Per-track output options chosen in the form; raises ValueError for a bad value."""
+    simplify = form.get('simplify', '').strip()
+    try:
+        simplify = float(simplify) if simplify else None
+    except ValueError:
+        raise ValueError("简化距离必须是以米为单位的数字") from None
+    if simplify is not None and not (math.isfinite(simplify) and simplify >= 0):
+        raise ValueError("简化距离必须是以米为单位的数字")
+    simplify_method = form.get('simplify_method', 'dp')
+    if simplify_method not in METHODS:
+        raise ValueError(f"简化方法必须是 {' 或 '.join(METHODS)}")
+    return {
+        'merge_by_day': bool(form.get('merge_by_day')),
+        'gps_extensions': bool(form.get('gps_extensions')),
+        'simplify': simplify or None,
+        'simplify_method': simplify_method,
+        'output_format': form.get('format') if form.get('format') in OUTPUT_FORMATS else 'gpx',
+    }
+
+def _timezone(form):
+    """UTC offset in hours chosen in the form; raises ValueError for a bad value."""
+    try:
+        timezone = int(form.get('timezone', 0))
+    except ValueError:
+        raise ValueError("时区必须是 -12 到 14 的整数") from None
+    if not -12 <= timezone <= 14:
+        raise ValueError("时区必须是 -12 到 14 的整数")
+    return timezone
+
+def _api_request(body):
+    """(tracks, timezone, options, compresslevel) from a /api/convert body; raises ValueError."""
+    tracks = body.get('tracks')
+    if not isinstance(tracks, list) or not all(isinstance(track, str) for track in tracks):
+        raise ValueError("'tracks' must be a list of track UUIDs or shared URLs")
+    timezone = body.get('timezone', 0)
+    if not isinstance(timezone, int) or isinstance(timezone, bool) or not -12 <= timezone <= 14:
+        raise ValueError("'timezone' must be a whole number of hours from -12 to 14")
+    output_format = body.get('format', 'gpx')
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"'format' must be one of {', '.join(OUTPUT_FORMATS)}")
+    simplify = body.get('simplify')
+    if simplify is not None and (not isinstance(simplify, (int, float)) or isinstance(simplify, bool)
+                                 or not math.isfinite(simplify) or simplify < 0):
+        raise ValueError("'simplify' must be a tolerance in metres")
+    simplify_method = body.get('simplify_method', 'dp')
+    if simplify_method not in METHODS:
+        raise ValueError(f"'simplify_method' must be one of {', '.join(METHODS)}")
+    compresslevel = body.get('compression', 0)
+    if not isinstance(compresslevel, int) or isinstance(compresslevel, bool) or not 0 <= compresslevel <= 9:
+        raise ValueError("'compression' must be a ZIP deflate level from 0 to 9")
+    options = {
+        'merge_by_day': bool(body.get('merge_by_day')),
+        'gps_extensions': bool(body.get('gps_extensions')),
+        'simplify': simplify or None,
+        'simplify_method': simplify_method,
+        'output_format': output_format,
+    }
+    return tracks, timezone, options, compresslevel
+
+def _attachment(filename):
+    """Content-Disposition options for downloading as filename, with an ASCII fallback name."""
+    ascii_name = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    if ascii_name == filename:
+        return {'filename': filename}
+    return {'filename': ascii_name, 'filename*': f"UTF-8''{quote(filename, safe='')}"}
+
+def _download_response(chunks, mimetype, filename, key, compress=True):
+    """Stream chunks as a download, compressed on the fly with the best encoding the client accepts.
+
+    key identifies the content for the ETag; compress=False sends chunks as
+    they are, for content that is already compressed.
+    """
+    encoding = negotiate_encoding(request.accept_encodings) if compress else None
+    response = Response(iter_encoded(chunks, encoding), mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', **_attachment(filename))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # Weak: entry timestamps inside a ZIP differ between builds of the same files
+    response.set_etag(f'{key}-{encoding}' if encoding else key, weak=True)
+    return response
+
+def _not_modified(key):
+    """A 304 response if the request's If-None-Match has key's ETag from _download_response, else None.
+
+    Checked before the batch is fetched, so revalidating a download costs no
+    conversion.
+    """
+    encoding = negotiate_encoding(request.accept_encodings)
+    for etag in ([f'{key}-{encoding}'] if encoding else []) + [key]:
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            response.vary.add('Accept-Encoding')
+            return response
+    return None
+
+def _preview_pyramid(url, track_uuid):
+    """(pyramid, key) of a track, built once and then read from the result cache; raises ValueError."""
+    cache = get_result_cache()
+    key = preview_key(track_uuid)
+    result = cache.get(key) if cache is not None else None
+    if result is not None:
+        return load_pyramid(result.content), key
+    
+    (track_data, error), = fetch_urls([url])
+    if track_data is None:
+        raise ValueError(error)
+    pyramid = build_pyramid(track_data)
+    if cache is not None:
+        filename = os.path.splitext(get_default_filename(track_data))[0] + '.preview.json'
+        cache.put(key, filename, dump_pyramid(pyramid))
+    return pyramid, key
+
+def _too_many_urls(urls):
+    return sum(1 for url in urls if url.strip()) > MAX_URLS
+
+def _compresslevel(form):
+    """Deflate level for archive entries from the form; 0 stores them uncompressed. Raises ValueError."""
+    try:
+        return min(max(int(form.get('compression', 0)), 0), 9)
+    except ValueError:
+        raise ValueError("压缩级别必须是 0 到 9 的整数") from None
+
+def run_conversion_job(job):
+    """Job handler: convert the job's URLs into its archive."""
+    options = dict(job.options)
+    timezone = options.pop('timezone', 0)
+    compresslevel = options.pop('compresslevel', None)
+    fetched_count, entries, error_messages = prepare_batch(job.urls, timezone, job.update, **options)
+    if not fetched_count:
+        raise ValueError(_no_files_message(error_messages))
+    if not write_zip(entries, job.artifact_path, compresslevel):
+        raise ValueError(_no_files_message(error_messages))
+
+jobs = JobQueue(run_conversion_job)
+
+def _requested_profile():
+    """The profile mode asked for by this request, if it carries the profiling token."""
+    mode = request.headers.get('X-Profile')
+    if not mode or not PROFILE_TOKEN or mode not in PROFILE_MODES:
+        return None
+    if not hmac.compare_digest(request.headers.get('X-Profile-Token', ''), PROFILE_TOKEN):
+        return None
+    return mode
+
+@app.before_request
+def start_profile():
+    mode = _requested_profile()
+    if mode:
+        profiler = RequestProfiler(mode, f'{request.method} {request.path}', PROFILE_DIR)
+        if profiler.start():
+            g.profiler = profiler
+        else:
+            log.warning("Not profiling %s %s, another profile is running", request.method, request.path)
+
+@app.after_request
+def finish_request(response):
+    HTTP_REQUESTS.inc(route=request.url_rule.rule if request.url_rule else 'unmatched',
+                      status=response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # Streamed bodies are generated after this, so stop once the response is closed
+        response.call_on_close(profiler.stop)
+        response.headers['X-Profile'] = profiler.mode
+    return response
+
+@app.teardown_request
+def abandon_profile(error):
+    # Only left over when the request failed before a response was made
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
         urls = request.form.getlist('urls[]')
-        timezone = int(request.form.get('timezone', 0))
+        if _too_many_urls(urls):
+            return render_template_string(HTML_TEMPLATE, message=f"一次最多转换 {MAX_URLS} 个链接"), 413
+        try:
+            timezone = _timezone(request.form)
+            options = _output_options(request.form)
+            compresslevel = _compresslevel(request.form)
+        except ValueError as e:
+            return render_template_string(HTML_TEMPLATE, message=str(e)), 400
+        key = batch_key(urls, timezone, compresslevel, **options)
+        not_modified = _not_modified(key)
+        if not_modified is not None:
+            return not_modified
+        fetched_count, entries, error_messages = prepare_batch(urls, timezone, **options)
+        entries = _started_entries(entries) if fetched_count else None
+        if entries is None:
+            return render_template_string(HTML_TEMPLATE, message=_no_files_message(error_messages))
         
-        # Create a temporary directory for the output files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            output_files = []
-            processed_filenames = {}  # Track processed filenames to handle duplicates
-            error_messages = []  # Track error messages
-            
-            for i, url in enumerate(urls, 1):
-                if url.strip():  # Skip empty URLs
-                    try:
-                        print(f"Processing URL {i}: {url}")
-                        output_file = process_track(url, timezone, temp_dir)
-                        if output_file:
-                            # Get the base filename without path
-                            base_filename = os.path.basename(output_file)
-                            print(f"Generated file: {base_filename}")
-                            
-                            # Handle duplicate filenames
-                            if base_filename in processed_filenames:
-                                processed_filenames[base_filename] += 1
-                                # Format the number with leading zeros (e.g., 001, 002, etc.)
-                                number = str(processed_filenames[base_filename]).zfill(3)
-                                new_filename = f"{os.path.splitext(base_filename)[0]}_{number}.gpx"
-                                new_path = os.path.join(temp_dir, new_filename)
-                                print(f"Renaming duplicate file to: {new_filename}")
-                                # Move the file to the new path instead of renaming
-                                import shutil
-                                shutil.move(output_file, new_path)
-                                output_files.append((new_path, new_filename))
-                            else:
-                                processed_filenames[base_filename] = 1
-                                # Format the first number with leading zeros
-                                number = str(1).zfill(3)
-                                new_filename = f"{os.path.splitext(base_filename)[0]}_{number}.gpx"
-                                new_path = os.path.join(temp_dir, new_filename)
-                                import shutil
-                                shutil.move(output_file, new_path)
-                                output_files.append((new_path, new_filename))
-                        else:
-                            error_messages.append(f"URL {i}: 无法生成文件")
-                    except Exception as e:
-                        error_msg = f"URL {i}: {str(e)}"
-                        print(f"Error: {error_msg}")
-                        error_messages.append(error_msg)
-                        continue
-            
-            if output_files:
-                print(f"Total files to be zipped: {len(output_files)}")
-                # Create a zip file containing all GPX files
-                import zipfile
-                zip_path = os.path.join(temp_dir, 'converted_files.zip')
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    for file_path, file_name in output_files:
-                        if os.path.exists(file_path):
-                            print(f"Adding to zip: {file_name}")
-                            zipf.write(file_path, file_name)
-                        else:
-                            print(f"Warning: File not found: {file_path}")
-                
-                if error_messages:
-                    print("Errors occurred during processing:")
-                    for msg in error_messages:
-                        print(f"- {msg}")
-                
-                return send_file(
-                    zip_path,
-                    as_attachment=True,
-                    download_name='converted_files.zip',
-                    mimetype='application/zip'
-                )
-            else:
-                error_message = "没有成功转换的文件"
-                if error_messages:
-                    error_message += "\n错误信息：\n" + "\n".join(error_messages)
-                return render_template_string(HTML_TEMPLATE, message=error_message)
+        # Entries are generated while the archive is sent, nothing touches the disk
+        return _download_response(iter_zip(entries, compresslevel), 'application/zip', 'converted_files.zip',
+                                  key, compress=not compresslevel)
     
     return render_template_string(HTML_TEMPLATE)
 
+@app.route('/api/convert', methods=['POST'])
+def api_convert():
+    """Convert the tracks listed in a JSON body: {"tracks": [UUID or URL, ...], options...}.
+
+    A single output file is returned as is and several as a ZIP archive;
+    errors are JSON objects with an 'error' message. Tracks that fail while
+    others convert are listed in the archive's ERRORS_ENTRY, or as a JSON
+    list in the ERRORS_HEADER of a single file.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        tracks, timezone, options, compresslevel = _api_request(body)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not any(track.strip() for track in tracks):
+        return jsonify({'error': 'No tracks given'}), 400
+    if _too_many_urls(tracks):
+        return jsonify({'error': f'At most {MAX_URLS} tracks can be converted at once'}), 413
+    key = batch_key(tracks, timezone, compresslevel, **options)
+    not_modified = _not_modified(key)
+    if not_modified is not None:
+        return not_modified
+    
+    fetched_count, entries, error_messages = prepare_batch(tracks, timezone, always_number=False, **options)
+    entries = _started_entries(entries) if fetched_count else None
+    if entries is None:
+        return jsonify({'error': 'No track could be converted', 'errors': error_messages}), 422
+    if fetched_count > 1:
+        # Later tracks may still fail while the archive is sent, so their errors go at its end
+        return _download_response(iter_zip(_with_errors_entry(entries, error_messages), compresslevel),
+                                  'application/zip', 'converted_files.zip', key, compress=not compresslevel)
+    
+    filename, chunks = next(entries)
+    response = _download_response(chunks, OUTPUT_FORMATS[options['output_format']].mimetype, filename, key)
+    if error_messages:
+        response.headers[ERRORS_HEADER] = json.dumps(error_messages)
+    return response
+
+@app.route('/preview')
+def preview():
+    """Preview one track (?track=UUID or shared URL) as a small SVG or GeoJSON polyline.
+
+    format is svg (default) or geojson; the finest level of the track's
+    pyramid with at most points points is drawn, size pixels across for SVG.
+    """
+    url = request.args.get('track', '').strip()
+    output_format = request.args.get('format', 'svg')
+    if output_format not in PREVIEW_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(PREVIEW_FORMATS)}"}), 400
+    track_uuid = _track_uuid(url) if url else None
+    if track_uuid is None:
+        return jsonify({'error': '无法识别的链接'}), 400
+    max_points = request.args.get('points', DEFAULT_PREVIEW_POINTS, type=int)
+    size = min(max(request.args.get('size', DEFAULT_PREVIEW_SIZE, type=int), 16), MAX_PREVIEW_SIZE)
+    
+    try:
+        pyramid, key = _preview_pyramid(url, track_uuid)
+    except ValueError as e:
+        return jsonify({'error': str(e) or '无法预览'}), 422
+    level = pick_level(pyramid, max_points)
+    encoding = negotiate_encoding(request.accept_encodings)
+    etag = f'{key}-{output_format}-{level}' + (f'-{size}' if output_format == 'svg' else '')
+    if encoding:
+        etag += f'-{encoding}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = render_preview(pyramid, output_format, level, size)
+        response = Response(b''.join(iter_encoded([body], encoding)), mimetype=PREVIEW_FORMATS[output_format])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # A shared track does not change, nor does its preview
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Enqueue a conversion and return its job id."""
+    urls = [url for url in request.form.getlist('urls[]') if url.strip()]
+    if not urls:
+        return jsonify({'error': '请输入至少一个链接'}), 400
+    if _too_many_urls(urls):
+        return jsonify({'error': f'一次最多转换 {MAX_URLS} 个链接'}), 413
+    try:
+        timezone = _timezone(request.form)
+        options = _output_options(request.form)
+        compresslevel = _compresslevel(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        job = jobs.submit(urls, job_id=batch_key(urls, timezone, compresslevel, **options),
+                          timezone=timezone, compresslevel=compresslevel, **options)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    
+    return jsonify({
+        'id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'download_url': url_for('download_job', job_id=job.id),
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/download')
+def download_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 409
+    # The job id identifies the batch, so it is the archive's ETag in every process
+    return send_file(
+        job.artifact_path,
+        as_attachment=True,
+        download_name='converted_files.zip',
+        mimetype='application/zip',
+        etag=job.id
+    )
+
+@app.route('/healthz')
+def healthz():
+    """Health check for load balancers; 503 once the server has started draining."""
+    if jobs.draining:
+        return jsonify({'status': 'draining'}), 503
+    return jsonify({'status': 'ok'})
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings and request counters in the Prometheus text format."""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
+    configure_logging()
     app.run(debug=True, port=5001) 
\ No newline at end of file
@@ -0,0 +1,355 @@
+"""Production HTTP server for the web interface.
+
+`python web_interface.py` runs Flask's single-process debug server. This
+module serves the same app from several pre-forked worker processes sharing
+one listening socket, each handling requests on a fixed pool of threads.
+Requests that arrive while every thread is busy wait in a bounded admission
+queue; once that is full they are answered 503 straight away rather than
+piling up behind slow conversions.
+
+SIGTERM or SIGINT drains the server: workers first report draining from
+/healthz while still serving for a grace period, so load balancers stop
+sending them traffic, then stop accepting, finish the requests and
+background jobs they have, and exit (or are killed once the drain timeout
+has passed). Run from the repository root:
+    python web_server.py --host 0.0.0.0 --processes 4 --threads 8
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from instrumentation import REGISTRY, configure_logging
+
+DEFAULT_HOST = os.environ.get('HUABEI_WEB_HOST', '127.0.0.1')
+DEFAULT_PORT = int(os.environ.get('HUABEI_WEB_PORT', 5001))
+DEFAULT_PROCESSES = int(os.environ.get('HUABEI_WEB_PROCESSES', os.cpu_count() or 1))
+DEFAULT_THREADS = int(os.environ.get('HUABEI_WEB_THREADS', 8))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('HUABEI_WEB_QUEUE_SIZE', 16))  # per process
+DEFAULT_DRAIN_TIMEOUT = float(os.environ.get('HUABEI_WEB_DRAIN_TIMEOUT', 60))  # seconds
+# Seconds a draining worker keeps accepting while /healthz answers 503
+DEFAULT_DRAIN_GRACE = float(os.environ.get('HUABEI_WEB_DRAIN_GRACE', 5))
+# Seconds without progress before a client's connection is dropped
+REQUEST_TIMEOUT = 120
+# Seconds a client turned away with 503 is asked to wait
+RETRY_AFTER = 5
+# Rejected connections are closed once the client has sent its request, or after this
+# many seconds; at most MAX_LINGERING are waited on at once
+LINGER_SECONDS = 2.0
+MAX_LINGERING = 64
+# A worker that exits within this many seconds of starting is respawned with a delay
+RESPAWN_DELAY = 1.0
+
+REJECTED = REGISTRY.counter(
+    'huabei_http_rejected_total', 'Requests answered 503 because the admission queue was full.')
+
+log = logging.getLogger(__name__)
+
+class _RequestHandler(WSGIRequestHandler):
+    # One request per connection, so every queued connection is one request and
+    # an idle keep-alive client cannot hold a thread
+    protocol_version = 'HTTP/1.0'
+    timeout = REQUEST_TIMEOUT
+
+class PooledWSGIServer(BaseWSGIServer):
+    """A WSGI server handling requests on a fixed pool of threads.
+
+    Accepted connections wait in a queue of queue_size for a free thread;
+    beyond that they get a 503 with Retry-After. The threads start with
+    start_threads(), so the server can be created before forking.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=DEFAULT_THREADS, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(host, port, app, handler=_RequestHandler)
+        # Every process sharing the socket is woken for a connection; the ones
+        # that lose the race must not block in accept() or they cannot shut down
+        self.socket.setblocking(False)
+        self.threads = threads
+        self.queue_size = queue_size
+        self._pending = None
+        self._workers = []
+        self._lingering = threading.BoundedSemaphore(MAX_LINGERING)
+
+    def start_threads(self):
+        self._pending = queue.Queue(maxsize=self.queue_size)
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._work, name=f'http-worker-{i}', daemon=True)
+            thread.start()
+            self._workers.append(thread)
+
+    def process_request(self, request, client_address):
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            REJECTED.inc()
+            log.warning("Admission queue full, rejecting %s", client_address[0])
+            self._reject(request)
+
+    def _reject(self, request):
+        body = json.dumps({'error': 'The server is busy, try again later'}).encode('utf-8')
+        head = (f'HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\nRetry-After: {RETRY_AFTER}\r\nConnection: close\r\n\r\n')
+        try:
+            request.settimeout(1.0)
+            request.sendall(head.encode('ascii') + body)
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            self.close_request(request)
+            return
+        # Closing while the client is still sending its body would reset the
+        # connection and could lose the response, so read the rest first
+        if self._lingering.acquire(blocking=False):
+            threading.Thread(target=self._linger, args=(request,), name='http-linger', daemon=True).start()
+        else:
+            self.close_request(request)
+
+    def _linger(self, request):
+        deadline = time.monotonic() + LINGER_SECONDS
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                request.settimeout(remaining)
+                if not request.recv(65536):
+                    break
+        except OSError:
+            pass
+        finally:
+            self.close_request(request)
+            self._lingering.release()
+
+    def _work(self):
+        while True:
+            item = self._pending.get()
+            try:
+                if item is None:
+                    return
+                request, client_address = item
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+            finally:
+                self._pending.task_done()
+
+    def pending(self):
+        """Requests accepted and not yet finished or picked up, as (in_flight, queued)."""
+        queued = self._pending.qsize()
+        return self._pending.unfinished_tasks - queued, queued
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for accepted requests to finish; True if they all did."""
+        deadline = time.monotonic() + timeout
+        with self._pending.all_tasks_done:
+            while self._pending.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._pending.all_tasks_done.wait(remaining)
+        for _ in self._workers:
+            self._pending.put(None)
+        return True
+
+def share_upstream_limits(processes):
+    """Split the upstream rate limiter's limits between worker processes.
+
+    Each process has its own limiter, so the configured rate, burst and
+    concurrency are divided to keep them limits for the whole server.
+    """
+    from huabei_api import get_limiter, set_limiter
+    from throttle import RateLimiter
+
+    limiter = get_limiter()
+    if limiter is None or processes <= 1:
+        return
+    set_limiter(RateLimiter(
+        limiter.rate / processes if limiter.rate else None,
+        max(1.0, limiter.burst / processes),
+        max(1, limiter.concurrency // processes) if limiter.concurrency else None,
+        limiter.timeout,
+    ))
+
+def run_worker(server, jobs=None, drain_timeout=DEFAULT_DRAIN_TIMEOUT, parent_pid=None,
+               drain_grace=DEFAULT_DRAIN_GRACE):
+    """Serve until SIGTERM or SIGINT (or the parent process going away), then drain.
+
+    Draining first marks jobs (the JobQueue /healthz reports on) as draining
+    and keeps serving for drain_grace seconds, or until a second signal, so
+    health checks can see it before the listening socket is closed.
+    Returns 0 if every request and job then finished within drain_timeout,
+    1 otherwise.
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    server.start_threads()
+    threading.Thread(target=server.serve_forever, name='http-acceptor', daemon=True).start()
+    while not stop.wait(1.0):
+        if parent_pid is not None and os.getppid() != parent_pid:
+            log.warning("Parent process %d went away, shutting down", parent_pid)
+            break
+
+    if jobs is not None:
+        jobs.draining = True
+    if drain_grace > 0:
+        log.info("Draining, still accepting requests for %gs", drain_grace)
+        stop.clear()
+        stop.wait(drain_grace)
+    deadline = time.monotonic() + drain_timeout
+    in_flight, queued = server.pending()
+    log.info("Draining %d running and %d queued requests", in_flight, queued)
+    server.shutdown()
+    server.server_close()
+    drained = server.drain(deadline - time.monotonic())
+    if jobs is not None:
+        drained = jobs.drain(max(0.0, deadline - time.monotonic())) and drained
+    if not drained:
+        log.warning("Drain timed out after %.0fs, abandoning unfinished work", drain_timeout)
+        return 1
+    log.info("Drained, exiting")
+    return 0
+
+class Supervisor:
+    """Fork worker processes that serve a shared listening socket, respawning any that die."""
+
+    def __init__(self, server, processes, jobs=None, drain_timeout=DEFAULT_DRAIN_TIMEOUT,
+                 drain_grace=DEFAULT_DRAIN_GRACE):
+        self.server = server
+        self.processes = processes
+        self.jobs = jobs
+        self.drain_timeout = drain_timeout
+        self.drain_grace = drain_grace
+        self.children = {}  # pid -> start time
+        self.stopping = False
+        self.stop_time = None
+
+    def spawn(self):
+        parent_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            # The supervisor's handlers would signal this worker's siblings
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self.children = {}
+            code = 1
+            try:
+                code = run_worker(self.server, self.jobs, self.drain_timeout, parent_pid, self.drain_grace)
+            except BaseException:
+                log.exception("Worker %d crashed", os.getpid())
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        log.info("Started worker %d", pid)
+
+    def start(self):
+        for _ in range(self.processes):
+            self.spawn()
+
+    def stop(self, signum=None, frame=None):
+        """Ask every worker to drain; the loop in supervise() waits for them."""
+        if self.stopping:
+            return
+        self.stopping = True
+        self.stop_time = time.monotonic()
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def supervise(self):
+        """Reap and respawn workers until stop() is called and they have all exited."""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.stopping and time.monotonic() - self.stop_time > self.drain_grace + self.drain_timeout + 5:
+                    for pid in list(self.children):
+                        log.warning("Killing worker %d, it did not exit after draining", pid)
+                        os.kill(pid, signal.SIGKILL)
+                    self.stop_time = float('inf')
+                time.sleep(0.1)
+                continue
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            log.warning("Worker %d exited with status %d, starting another", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < RESPAWN_DELAY:
+                time.sleep(RESPAWN_DELAY)
+            self.spawn()
+        self.server.server_close()
+
+def serve(app, host=DEFAULT_HOST, port=DEFAULT_PORT, processes=DEFAULT_PROCESSES, threads=DEFAULT_THREADS,
+          queue_size=DEFAULT_QUEUE_SIZE, drain_timeout=DEFAULT_DRAIN_TIMEOUT, jobs=None,
+          drain_grace=DEFAULT_DRAIN_GRACE):
+    """Serve app until SIGTERM or SIGINT and return an exit status.
+
+    With one process, or where os.fork is missing, requests are served from
+    this process; jobs (a JobQueue) is drained along with the requests.
+    """
+    server = PooledWSGIServer(host, port, app, threads, queue_size)
+    host, port = server.server_address[:2]
+    log.info("Serving on http://%s:%d with %d processes of %d threads, admission queue %d",
+             host, port, processes, threads, queue_size)
+    if processes <= 1 or not hasattr(os, 'fork'):
+        try:
+            return run_worker(server, jobs, drain_timeout, drain_grace=drain_grace)
+        finally:
+            server.server_close()
+
+    share_upstream_limits(processes)
+    supervisor = Supervisor(server, processes, jobs, drain_timeout, drain_grace)
+    supervisor.start()
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    supervisor.supervise()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the converter web interface in production')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'Address to listen on (default: {DEFAULT_HOST})')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help=f'Port (default: {DEFAULT_PORT})')
+    parser.add_argument('-w', '--processes', type=int, default=DEFAULT_PROCESSES,
+                        help=f'Worker processes (default: $HUABEI_WEB_PROCESSES or {DEFAULT_PROCESSES})')
+    parser.add_argument('-t', '--threads', type=int, default=DEFAULT_THREADS,
+                        help=f'Request threads per process (default: $HUABEI_WEB_THREADS or {DEFAULT_THREADS})')
+    parser.add_argument('-q', '--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help='Requests per process waiting for a thread before new ones get 503 '
+                             f'(default: $HUABEI_WEB_QUEUE_SIZE or {DEFAULT_QUEUE_SIZE})')
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help='Seconds to let running requests and jobs finish on shutdown '
+                             f'(default: $HUABEI_WEB_DRAIN_TIMEOUT or {DEFAULT_DRAIN_TIMEOUT:g})')
+    parser.add_argument('--drain-grace', type=float, default=DEFAULT_DRAIN_GRACE,
+                        help='Seconds to keep serving on shutdown while /healthz reports draining '
+                             f'(default: $HUABEI_WEB_DRAIN_GRACE or {DEFAULT_DRAIN_GRACE:g})')
+    parser.add_argument('--log-level', help='Log level (default: $HUABEI_LOG_LEVEL or INFO)')
+    parser.add_argument('--log-format', choices=('plain', 'text', 'json'),
+                        help='Log line format (default: $HUABEI_LOG_FORMAT or text)')
+    args = parser.parse_args(argv)
+    if min(args.processes, args.threads, args.queue_size) < 1:
+        parser.error('--processes, --threads and --queue-size must be at least 1')
+    configure_logging(args.log_level, args.log_format)
+
+    from web_interface import app, jobs
+    return serve(app, args.host, args.port, args.processes, args.threads, args.queue_size, args.drain_timeout, jobs,
+                 args.drain_grace)
+
+if __name__ == '__main__':
+    sys.exit(main())
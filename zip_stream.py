@@ -0,0 +1,111 @@
+"""Stream ZIP archives without temporary files."""
+import io
+import tempfile
+import time
+import zipfile
+
+from instrumentation import observe_stage
+
+# Bytes of an entry spool_chunks keeps in memory before spilling to a temporary file
+ENTRY_SPOOL_BYTES = 8 * 1024 * 1024
+SPOOL_READ_BYTES = 64 * 1024
+
+class _ChunkBuffer(io.RawIOBase):
+    """Unseekable sink that collects what ZipFile writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip(entries, compresslevel=None):
+    """Yield a ZIP archive as byte chunks.
+
+    entries is an iterable of (name, chunks) or (name, chunks, compresslevel)
+    tuples, where chunks is an iterable of bytes; each entry is written as it
+    is produced, so only the chunk in flight is held in memory. compresslevel
+    1-9 deflates entries at that level; None or 0 stores them uncompressed.
+    An entry's own compresslevel, unless None, overrides the archive's, so
+    content that is already compressed can be stored. Time spent compressing
+    and framing (not producing the chunks) is recorded as the zip stage.
+
+    If chunks raises, the archive is left truncated mid-entry; pass chunks
+    through spool_chunks first when an entry may fail part way.
+    """
+    buffer = _ChunkBuffer()
+    elapsed = 0.0
+    count = 0
+    # ZipFile falls back to data descriptors because the buffer cannot seek
+    with zipfile.ZipFile(buffer, 'w') as zipf:
+        for entry in entries:
+            name, chunks = entry[:2]
+            level = entry[2] if len(entry) > 2 and entry[2] is not None else compresslevel
+            if level:
+                zipf.compression = zipfile.ZIP_DEFLATED
+                zipf.compresslevel = level
+            else:
+                zipf.compression = zipfile.ZIP_STORED
+                zipf.compresslevel = None
+            with zipf.open(name, 'w') as entry:
+                for chunk in chunks:
+                    start = time.perf_counter()
+                    entry.write(chunk)
+                    data = buffer.drain()
+                    elapsed += time.perf_counter() - start
+                    if data:
+                        yield data
+                # The data descriptor is written when the entry closes
+                start = time.perf_counter()
+                entry.close()
+                data = buffer.drain()
+                elapsed += time.perf_counter() - start
+            count += 1
+            yield data
+    observe_stage('zip', elapsed, entries=count, compresslevel=compresslevel or 0)
+    # Central directory
+    yield buffer.drain()
+
+def spool_chunks(chunks, max_size=ENTRY_SPOOL_BYTES):
+    """Produce all of chunks now and return an iterator over the same bytes.
+
+    Whatever producing chunks raises is raised here, before any of it is
+    written, so a failed conversion can be left out of an archive instead of
+    truncating it. Up to max_size bytes are kept in memory and the rest in a
+    temporary file, removed once the bytes are read back.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size)
+    try:
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return _read_spool(spool)
+
+def _read_spool(spool):
+    with spool:
+        yield from iter(lambda: spool.read(SPOOL_READ_BYTES), b'')
+
+def write_zip(entries, output, compresslevel=None):
+    """Write a ZIP archive from iter_zip entries to a path; returns the number of entries."""
+    count = 0
+    def counted():
+        nonlocal count
+        for entry in entries:
+            count += 1
+            yield entry
+    with open(output, 'wb') as f:
+        for data in iter_zip(counted(), compresslevel):
+            f.write(data)
+    return count